@@ -0,0 +1,377 @@
+import struct
+import time
+
+import numpy
+
+# CPU time of the process, time.clock() in Python 2.
+process_time = getattr(time, 'process_time', None) or time.clock
+
+
+class AudioEncoder:
+    """
+    Compresses 16-bit PCM before upload. ENCODING is the name of the
+    format in cloud recognition config.
+
+    encode() compresses a whole phrase. Streaming upload calls start(),
+    then encode_chunk() for every recorded chunk and finish(), each
+    returns data to send, maybe empty. Sizes and CPU time of the last
+    phrase are kept in `stats`.
+    """
+    ENCODING = 'LINEAR16'
+    # Typical encoded size to PCM size, until a phrase is encoded.
+    RATIO = 1.0
+
+    def __init__(self, channels=1, rate=16000):
+        self.channels = channels
+        self.rate = rate
+        self.stats = {}
+
+    def encode(self, content):
+        """
+        :param content: 16-bit PCM data of a phrase
+        :return: encoded data
+        """
+        return b''.join([self.start(), self.encode_chunk(content), self.finish()])
+
+    def start(self):
+        self.stats = {'encoding': self.ENCODING, 'raw_bytes': 0, 'bytes': 0, 'cpu': 0.0}
+        return self._count(b'', 0, 0)
+
+    def encode_chunk(self, chunk):
+        start_time = process_time()
+        return self._count(self._encode_chunk(chunk), len(chunk), process_time() - start_time)
+
+    def finish(self):
+        start_time = process_time()
+        return self._count(self._finish(), 0, process_time() - start_time)
+
+    def _count(self, data, raw_size, cpu):
+        self.stats['raw_bytes'] += raw_size
+        self.stats['bytes'] += len(data)
+        self.stats['cpu'] += cpu
+
+        return data
+
+    def _encode_chunk(self, chunk):
+        return chunk
+
+    def _finish(self):
+        return b''
+
+
+class LinearEncoder(AudioEncoder):
+    """
+    Uploads PCM as is.
+    """
+    ENCODING = 'LINEAR16'
+
+
+class MulawEncoder(AudioEncoder):
+    """
+    G.711 mu-law, 8 bits per sample, half of PCM size. Lossy, but made
+    for speech, so recognition accuracy barely drops.
+    """
+    ENCODING = 'MULAW'
+    RATIO = 0.5
+
+    # G.711 works with 14-bit samples.
+    BIAS = 0x21
+    # Largest magnitude with the bias fitting into the last segment.
+    CLIP = 8158
+
+    def _encode_chunk(self, chunk):
+        samples = numpy.frombuffer(chunk, dtype=numpy.int16).astype(numpy.int32) >> 2
+        sign = (samples < 0).astype(numpy.int32) << 7
+        magnitude = numpy.minimum(numpy.abs(samples), self.CLIP) + self.BIAS
+        # Position of the highest bit over 5, magnitude is at least 0x21.
+        exponent = numpy.floor(numpy.log2(magnitude)).astype(numpy.int32) - 5
+        mantissa = (magnitude >> (exponent + 1)) & 0x0F
+
+        return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(numpy.uint8).tobytes()
+
+
+class FlacEncoder(AudioEncoder):
+    """
+    Lossless FLAC in pure numpy, usually 40-60% of PCM size for speech.
+
+    Every block is coded with the best of constant, verbatim or fixed
+    polynomial predictors, residuals with partitioned Rice codes. Stream
+    header goes first, so the encoded stream may be uploaded chunk by
+    chunk. Total samples are unknown in the header of a stream, MD5 is
+    always left unknown.
+    """
+    ENCODING = 'FLAC'
+    RATIO = 0.5
+
+    BITS_PER_SAMPLE = 16
+    MAX_FIXED_ORDER = 4
+    MAX_PARTITION_ORDER = 4
+    MAX_RICE_PARAMETER = 14
+    # Block header and STREAMINFO.
+    STREAM_INFO_SIZE = 38
+
+    def __init__(self, channels=1, rate=16000, block_size=4096):
+        AudioEncoder.__init__(self, channels, rate)
+        self.block_size = block_size
+        self._pending = b''
+        self._frame_number = 0
+
+    def start(self):
+        self._pending = b''
+        self._frame_number = 0
+        AudioEncoder.start(self)
+
+        start_time = process_time()
+        return self._count(b'fLaC' + self.get_stream_info(), 0, process_time() - start_time)
+
+    def encode(self, content):
+        data = AudioEncoder.encode(self, content)
+        # The whole phrase is known, total samples are put to the header.
+        header_size = 4 + self.STREAM_INFO_SIZE
+        samples = len(content) // (self.channels * 2)
+
+        return data[:4] + self.get_stream_info(samples) + data[header_size:]
+
+    def get_stream_info(self, total_samples=0):
+        """
+        :param total_samples: samples per channel, 0 if unknown
+        :return: STREAMINFO metadata block
+        """
+        bits = BitWriter()
+        # Last metadata block, STREAMINFO type, 34 bytes long.
+        bits.write(1, 1)
+        bits.write(0, 7)
+        bits.write(34, 24)
+        bits.write(self.block_size, 16)
+        bits.write(self.block_size, 16)
+        # Frame sizes are unknown.
+        bits.write(0, 24)
+        bits.write(0, 24)
+        bits.write(self.rate, 20)
+        bits.write(self.channels - 1, 3)
+        bits.write(self.BITS_PER_SAMPLE - 1, 5)
+        bits.write(total_samples, 36)
+        # MD5 is unknown.
+        for _ in range(4):
+            bits.write(0, 32)
+
+        return bits.get_bytes()
+
+    def _encode_chunk(self, chunk):
+        data = self._pending + chunk
+        block_bytes = self.block_size * self.channels * 2
+        size = len(data) // block_bytes * block_bytes
+        self._pending = data[size:]
+
+        return b''.join(self.encode_frame(data[offset:offset + block_bytes])
+                        for offset in range(0, size, block_bytes))
+
+    def _finish(self):
+        data = self._pending
+        self._pending = b''
+        # Odd trailing byte isn't a sample.
+        data = data[:len(data) // (self.channels * 2) * self.channels * 2]
+
+        return self.encode_frame(data) if data else b''
+
+    def encode_frame(self, data):
+        samples = numpy.frombuffer(data, dtype=numpy.int16).astype(numpy.int64).reshape(-1, self.channels)
+        block_size = len(samples)
+
+        bits = BitWriter()
+        # Sync code, fixed block size.
+        bits.write(0xFFF8, 16)
+        # Block size follows the header, sample rate is in STREAMINFO.
+        bits.write(7, 4)
+        bits.write(0, 4)
+        # Independent channels, sample size is in STREAMINFO.
+        bits.write(self.channels - 1, 4)
+        bits.write(0, 3)
+        bits.write(0, 1)
+        bits.write_bytes(self.encode_utf8(self._frame_number))
+        bits.write(block_size - 1, 16)
+        bits.write(crc8(bits.get_bytes()), 8)
+        self._frame_number += 1
+
+        for channel in range(self.channels):
+            self.write_subframe(bits, samples[:, channel])
+        frame = bits.get_bytes()
+
+        return frame + struct.pack('>H', crc16(frame))
+
+    def write_subframe(self, bits, samples):
+        if numpy.all(samples == samples[0]):
+            bits.write(0, 8)
+            bits.write_signed(int(samples[0]), self.BITS_PER_SAMPLE)
+            return
+
+        verbatim_size = len(samples) * self.BITS_PER_SAMPLE
+        best = None
+        for order in range(min(self.MAX_FIXED_ORDER, len(samples) - 1) + 1):
+            residual = numpy.diff(samples, n=order) if order else samples
+            size, partitions = self.get_rice_partitions(residual, order, len(samples))
+            size += order * self.BITS_PER_SAMPLE
+            if best is None or size < best[0]:
+                best = (size, order, residual, partitions)
+
+        size, order, residual, partitions = best
+        if size >= verbatim_size:
+            bits.write(1 << 1, 8)
+            bits.write_array(samples, self.BITS_PER_SAMPLE)
+            return
+
+        # Fixed predictor subframe with warm-up samples.
+        bits.write((8 | order) << 1, 8)
+        bits.write_array(samples[:order], self.BITS_PER_SAMPLE)
+        # Rice coding with 4-bit parameters.
+        bits.write(0, 2)
+        bits.write(len(partitions).bit_length() - 1, 4)
+        unsigned = zigzag(residual)
+        offset = 0
+        for count, parameter in partitions:
+            bits.write(parameter, 4)
+            bits.write_rice(unsigned[offset:offset + count], parameter)
+            offset += count
+
+    def get_rice_partitions(self, residual, order, block_size):
+        """
+        Finds partition order and Rice parameters giving the least bits.
+        :return: bits and list of (count of residuals, parameter) per partition
+        """
+        unsigned = zigzag(residual)
+        parameters = numpy.arange(self.MAX_RICE_PARAMETER + 1)
+        best = None
+        for partition_order in range(self.MAX_PARTITION_ORDER + 1):
+            partition_size = block_size >> partition_order
+            if block_size % (1 << partition_order) or partition_size <= order:
+                break
+            partitions = []
+            size = 0
+            offset = 0
+            for i in range(1 << partition_order):
+                count = partition_size - order if i == 0 else partition_size
+                values = unsigned[offset:offset + count]
+                # Unary quotients, stop bits and remainders for every parameter.
+                sizes = (values[:, None] >> parameters).sum(axis=0) + count * (parameters + 1)
+                parameter = int(numpy.argmin(sizes))
+                partitions.append((count, parameter))
+                size += int(sizes[parameter]) + 4
+                offset += count
+            if best is None or size < best[0]:
+                best = (size, partitions)
+
+        return best
+
+    @staticmethod
+    def encode_utf8(value):
+        """
+        Frame number in UTF-8 like coding of FLAC.
+        """
+        if value < 0x80:
+            return bytearray([value])
+        length = 2
+        while value >= 1 << (5 * length + 1):
+            length += 1
+        result = bytearray()
+        for i in range(length - 1):
+            result.insert(0, 0x80 | (value & 0x3F))
+            value >>= 6
+        result.insert(0, ((0xFF00 >> length) & 0xFF) | value)
+
+        return result
+
+
+class BitWriter:
+    """
+    Collects bit fields as numpy arrays of bits, packed once at the end.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._size = 0
+
+    def write(self, value, bits):
+        self.write_array(numpy.array([value], dtype=numpy.uint64), bits)
+
+    def write_signed(self, value, bits):
+        self.write(value & ((1 << bits) - 1), bits)
+
+    def write_array(self, values, bits):
+        """
+        Writes every value with the same count of bits, negative ones in
+        two's complement.
+        """
+        values = numpy.asarray(values).astype(numpy.int64) & ((1 << bits) - 1)
+        shifts = numpy.arange(bits - 1, -1, -1)
+        self._append(((values[:, None] >> shifts) & 1).astype(numpy.uint8).ravel())
+
+    def write_bytes(self, data):
+        self._append(numpy.unpackbits(numpy.frombuffer(bytes(data), dtype=numpy.uint8)))
+
+    def write_rice(self, values, parameter):
+        """
+        Writes unsigned values as quotient in unary zeros, stop bit and
+        `parameter` low bits.
+        """
+        if not len(values):
+            return
+        quotients = values >> parameter
+        lengths = quotients + 1 + parameter
+        starts = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+        result = numpy.zeros(int(lengths.sum()), dtype=numpy.uint8)
+        result[starts + quotients] = 1
+        for i in range(parameter):
+            result[starts + quotients + 1 + i] = (values >> (parameter - 1 - i)) & 1
+        self._append(result)
+
+    def _append(self, bits):
+        self._parts.append(bits)
+        self._size += len(bits)
+
+    def get_bytes(self):
+        """
+        :return: written bits padded with zeros to a byte
+        """
+        if not self._parts:
+            return b''
+        return numpy.packbits(numpy.concatenate(self._parts)).tobytes()
+
+
+def zigzag(values):
+    """
+    Maps signed residuals to unsigned: 0, -1, 1, -2... to 0, 1, 2, 3...
+    """
+    return numpy.where(values < 0, -2 * values - 1, 2 * values)
+
+
+def _make_crc_table(polynomial, bits):
+    table = []
+    top = 1 << (bits - 1)
+    mask = (1 << bits) - 1
+    for byte in range(256):
+        crc = byte << (bits - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) & mask if crc & top else (crc << 1) & mask
+        table.append(crc)
+
+    return table
+
+
+_CRC8_TABLE = _make_crc_table(0x07, 8)
+_CRC16_TABLE = _make_crc_table(0x8005, 16)
+
+
+def crc8(data):
+    crc = 0
+    for byte in bytearray(data):
+        crc = _CRC8_TABLE[crc ^ byte]
+
+    return crc
+
+
+def crc16(data):
+    crc = 0
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_TABLE[(crc >> 8) ^ byte]
+
+    return crc
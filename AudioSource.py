@@ -0,0 +1,311 @@
+import sys
+import threading
+import wave
+
+import pyaudio
+
+
+class AudioSource(object):
+    """
+    Source of raw audio data for the hotword detector and the recorder.
+
+    open() returns a stream with read(num_frames) and close() methods.
+    Replay sources return themselves from open(), so the recorder and the
+    hotword detector share one read position in the recorded audio and
+    closing a stream doesn't rewind it. Use terminate() to release the
+    source itself.
+
+    Replay sources are read as fast as they are consumed, not in real time.
+    Every read returns exactly num_frames, the last chunk is padded with
+    silence. An empty byte string means the end of audio data.
+    """
+    is_live = False
+
+    def __init__(self, audio_format, channels, rate, frames_per_buffer=2048):
+        self.audio_format = audio_format
+        self.channels = channels
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.frame_size = channels * pyaudio.get_sample_size(audio_format)
+
+    def get_config(self):
+        """
+        Audio stream config in the same form as stream config of recorder.
+        """
+        return {
+            'format': self.audio_format,
+            'channels': self.channels,
+            'rate': self.rate,
+            'frames_per_buffer': self.frames_per_buffer
+        }
+
+    def open(self, position=None):
+        """
+        :param position: byte position in the audio to start reading from,
+                         supported by SharedCaptureSource only
+        """
+        return self
+
+    def read(self, num_frames):
+        size = num_frames * self.frame_size
+        data = self.read_bytes(size)
+        if data and len(data) < size:
+            data += b'\x00' * (size - len(data))
+
+        return data
+
+    def read_bytes(self, size):
+        """
+        Reads up to size bytes of audio data, less only at the end.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+
+class MicrophoneSource(AudioSource):
+    """
+    Live audio from the default input device. Opens a new PyAudio stream
+    on every open().
+    """
+    is_live = True
+
+    def __init__(self, audio_format, channels, rate, frames_per_buffer=2048):
+        AudioSource.__init__(self, audio_format, channels, rate, frames_per_buffer)
+        self.audio = pyaudio.PyAudio()
+
+    def open(self, position=None):
+        return self.audio.open(format=self.audio_format,
+                               channels=self.channels,
+                               rate=self.rate,
+                               input=True,
+                               frames_per_buffer=self.frames_per_buffer)
+
+    def terminate(self):
+        self.audio.terminate()
+
+
+class WavFileSource(AudioSource):
+    """
+    Replays audio from a WAV file.
+    """
+
+    def __init__(self, filename, frames_per_buffer=2048):
+        self.wav = wave.open(filename, 'rb')
+        AudioSource.__init__(self,
+                             pyaudio.get_format_from_width(self.wav.getsampwidth()),
+                             self.wav.getnchannels(),
+                             self.wav.getframerate(),
+                             frames_per_buffer)
+
+    def read_bytes(self, size):
+        return self.wav.readframes(size // self.frame_size)
+
+    def terminate(self):
+        self.wav.close()
+
+
+class PipeSource(AudioSource):
+    """
+    Replays raw PCM data from a file object, e.g. a pipe or stdin.
+    """
+
+    def __init__(self, stream, audio_format, channels, rate, frames_per_buffer=2048):
+        AudioSource.__init__(self, audio_format, channels, rate, frames_per_buffer)
+        self.stream = stream
+
+    @staticmethod
+    def from_path(path, audio_format, channels, rate, frames_per_buffer=2048):
+        """
+        Opens raw PCM file or named pipe. Path '-' stands for stdin.
+        """
+        if path == '-':
+            stream = sys.stdin.buffer if hasattr(sys.stdin, 'buffer') else sys.stdin
+        else:
+            stream = open(path, 'rb')
+
+        return PipeSource(stream, audio_format, channels, rate, frames_per_buffer)
+
+    def read_bytes(self, size):
+        # Pipes may return less than requested before the end.
+        data = b''
+        while len(data) < size:
+            part = self.stream.read(size - len(data))
+            if not part:
+                break
+            data += part
+
+        return data
+
+    def terminate(self):
+        self.stream.close()
+
+
+class BufferSource(AudioSource):
+    """
+    Replays raw PCM data kept in memory.
+    """
+
+    def __init__(self, data, audio_format, channels, rate, frames_per_buffer=2048):
+        AudioSource.__init__(self, audio_format, channels, rate, frames_per_buffer)
+        self.data = memoryview(data)
+        self.position = 0
+
+    def read_bytes(self, size):
+        data = self.data[self.position:self.position + size].tobytes()
+        self.position += len(data)
+
+        return data
+
+    def rewind(self):
+        self.position = 0
+
+
+class SharedCaptureSource(AudioSource):
+    """
+    Live audio from the default input device captured by a single PyAudio
+    stream, which is opened once and fanned out to any number of readers.
+
+    Captured audio is kept in a ring of `buffer_seconds` length. Every
+    reader returned by open() has its own byte position in the captured
+    audio, so the recorder can start reading at the exact position where
+    the hotword detector stopped. A reader which lags behind more than the
+    ring length skips the lost audio, see `dropped_bytes`.
+    """
+    is_live = True
+
+    def __init__(self, audio_format, channels, rate, frames_per_buffer=2048, buffer_seconds=5):
+        AudioSource.__init__(self, audio_format, channels, rate, frames_per_buffer)
+        self._size = int(buffer_seconds * rate) * self.frame_size
+        self._buf = bytearray(self._size)
+        # Total count of bytes captured, the position of the next write.
+        self._written = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._terminated = False
+        self.dropped_bytes = 0
+        self.audio = None
+        self._stream = None
+
+    def start(self):
+        """
+        Opens the capture stream, does nothing if it's open already.
+        """
+        if self._stream is not None:
+            return
+        self.audio = pyaudio.PyAudio()
+        self._stream = self.audio.open(format=self.audio_format,
+                                       channels=self.channels,
+                                       rate=self.rate,
+                                       input=True,
+                                       frames_per_buffer=self.frames_per_buffer,
+                                       stream_callback=self._callback)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        self.write(in_data)
+        return None, pyaudio.paContinue
+
+    def write(self, data):
+        """
+        Adds captured data, overwrites the oldest one.
+        """
+        data = memoryview(data)
+        if len(data) > self._size:
+            data = data[-self._size:]
+        n = len(data)
+        with self._cond:
+            end = self._written % self._size
+            first = min(n, self._size - end)
+            self._buf[end:end + first] = data[:first]
+            self._buf[:n - first] = data[first:]
+            self._written += n
+            self._cond.notify_all()
+
+    def tell(self):
+        """
+        :return: byte position of the next captured data
+        """
+        return self._written
+
+    def open(self, position=None):
+        """
+        :param position: byte position to start reading from,
+                         by default the next captured data
+        :return: SharedCaptureReader
+        """
+        self.start()
+        return SharedCaptureReader(self, self._written if position is None else position)
+
+    def wait(self, position, size, timeout=None):
+        """
+        Blocks until `size` bytes from `position` are captured.
+        :return: True if they are captured
+        """
+        with self._cond:
+            if self._written < position + size and not self._terminated:
+                self._cond.wait(timeout)
+            return self._written >= position + size
+
+    def read_at(self, position, size):
+        """
+        Blocks until `size` bytes from `position` are captured and copies them.
+        :return: data and its actual position, which is later than requested
+                 if the data was overwritten. Empty data after terminate().
+        """
+        with self._cond:
+            while self._written < position + size and not self._terminated:
+                self._cond.wait()
+            if self._terminated:
+                return b'', position
+            oldest = self._written - self._size
+            if position < oldest:
+                # Reader lagged behind, the audio is lost.
+                self.dropped_bytes += oldest - position
+                position = oldest
+            start = position % self._size
+            first = min(size, self._size - start)
+            data = bytes(self._buf[start:start + first]) + bytes(self._buf[:size - first])
+
+        return data, position
+
+    def terminate(self):
+        with self._cond:
+            self._terminated = True
+            self._cond.notify_all()
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+            self.audio.terminate()
+
+
+class SharedCaptureReader(object):
+    """
+    Stream of SharedCaptureSource with its own read position.
+    """
+
+    def __init__(self, source, position):
+        self.source = source
+        self.position = position
+
+    def read(self, num_frames):
+        data, position = self.source.read_at(self.position, num_frames * self.source.frame_size)
+        self.position = position + len(data)
+
+        return data
+
+    def wait(self, num_frames, timeout=None):
+        """
+        Blocks until the next num_frames are captured or timeout passes.
+        :return: True if they are captured
+        """
+        return self.source.wait(self.position, num_frames * self.source.frame_size, timeout)
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        pass
@@ -1,8 +1,20 @@
 import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process, Pipe
 
-from GoogleCloudSpeechAPI import GoogleCloudSpeechAPI
-from MyPocketSphinx import MyPocketSphinx
+import pyaudio
+
+from AudioSource import WavFileSource, PipeSource, SharedCaptureSource
+from EscalationPolicy import CircuitBreaker, EscalationPolicy
+from Plugins import SERVICES
+from RecognitionDispatcher import RecognitionDispatcher
+from ResultCache import ResultCache
+from ResultTransport import ResultMessage, ResultPublisher, ResultSubscriber
+from StreamingRecognition import StreamingRecognition
+from Tracing import Tracer, NULL_TRACE
+from UtteranceArchive import UtteranceArchive
+from UtterancePipeline import Utterance, UtterancePipeline
 from VoiceRecord import VoiceRecord
 
 from snowboy import snowboydecoder
@@ -16,19 +28,33 @@ class CommandRecognition(Process):
         Process.__init__(self)
         # Init interprocess variables.
         self.interrupted = multiprocessing.Value('i', False)
+        # Set when models are loaded and the hotword is listened.
+        self.ready = multiprocessing.Event()
 
         # Detector configs.
         self.detector = None
         self.voice_record = None
+        self.audio_source = None
         self.last_result = []
 
         self.config = {}
         self.local_services = []
         self.cloud_services = []
+        self.dispatcher = None
+        self.result_cache = None
+        # Recognized phrases kept for offline tuning, if configured.
+        self.archive = None
+        # Stages of live audio, created in the recognition process.
+        self.pipeline = None
+        # Disabled until configured, costs nothing then.
+        self.tracer = Tracer()
 
         # Create transport to send commands.
         self.external_transport = None
         self.transport = None
+        self.transport_lock = threading.Lock()
+        # Socket transport to subscribers, created in the recognition process.
+        self.publisher = None
         self.init_pipe_transport()
 
     def init_pipe_transport(self):
@@ -40,6 +66,14 @@ class CommandRecognition(Process):
     def get_external_transport(self):
         return self.external_transport
 
+    def subscribe(self, connect_timeout=10.0):
+        """
+        Connects to results of socket transport, see `transport` config.
+        Several subscribers may be connected at once.
+        :return: ResultSubscriber
+        """
+        return ResultSubscriber(self.config['transport']['path'], connect_timeout)
+
     def get_pipe(self):
         return self.external_transport, self.transport
 
@@ -56,35 +90,110 @@ class CommandRecognition(Process):
     def start_recognize_loop(self):
         print('Initializing...')
 
-        # Configure Hotword detection.
-        model = self.config['hotword_detector']['model']
-        sensitivity = self.config['hotword_detector']['sensitivity']
-        self.detector = snowboydecoder.HotwordDetector(model, sensitivity=sensitivity)
+        if 'tracing' in self.config:
+            self.tracer = self.init_tracer(self.config['tracing'])
+
+        # Results go to socket subscribers instead of the pipe if configured.
+        if 'transport' in self.config and self.config['transport']['type'] == 'socket':
+            self.publisher = ResultPublisher(self.config['transport']['path'])
+
+        # A source created here is terminated at the end, the next loop creates a new one.
+        own_source = self.audio_source is None
+        # Replay recorded audio instead of the microphone if configured.
+        if self.audio_source is None and 'audio_source' in self.config:
+            self.audio_source = self.init_audio_source(self.config['audio_source'])
+        # Otherwise detector and recorder share one microphone stream
+        # in Snowboy audio format: 16 kHz, 16-bit, mono.
+        if self.audio_source is None:
+            self.audio_source = SharedCaptureSource(pyaudio.paInt16, 1, 16000)
 
         # Configure voice recorder
         self.config['recorder']['audio'] = self.get_stream_config()
-        self.voice_record = VoiceRecord(self.config['recorder'])
-        if 'bg_noise_samples' in self.config['recorder']:
-            self.voice_record.threshold = self.voice_record.measure_background_noise(num_samples=self.config['recorder']['bg_noise_samples'])
+        self.voice_record = VoiceRecord(self.config['recorder'], source=self.audio_source)
+        adaptive = self.config['recorder']['adaptive_threshold']
 
         # Store audio config for services.
         self.config['audio'] = self.config['recorder']['audio']
         self.config['audio']['encoding'] = self.voice_record.ENCODING
 
-        self.create_services()
+        if 'archive' in self.config:
+            self.archive = self.init_archive(self.config['archive'], self.config['audio'])
+            self.archive.start()
+
+        # Hotword and recognition models are loaded while background noise is measured.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            detector_future = executor.submit(self.create_detector)
+            services_future = executor.submit(self.create_services)
+            if 'bg_noise_samples' in self.config['recorder'] and not adaptive:
+                self.voice_record.threshold = self.voice_record.measure_background_noise(num_samples=self.config['recorder']['bg_noise_samples'])
+            # Raises errors of loading.
+            self.detector = detector_future.result()
+            services_future.result()
+
+        # Live audio is detected, recorded and recognized at once.
+        if self.is_pipeline_enabled():
+            behaviour = self.config['handler_behaviour']
+            self.pipeline = UtterancePipeline(
+                self.record_utterance, self.process_utterance,
+                queue_size=int(behaviour['pipeline_queue_size']) if 'pipeline_queue_size' in behaviour else 4,
+                source=self.audio_source)
+            self.pipeline.start()
 
         # main loop
         print('Listening...')
+        self.ready.set()
         self.set_interrupted(False)
         self.detector.start(
             detected_callback=lambda: self.command_handler(),
             interrupt_check=self.interrupt_callback,
-            sleep_time=0.001)
+            sleep_time=0.2,
+            audio_callback=self.voice_record.update_noise_floor if adaptive else None,
+            skip_after_callback=self.pipeline is None)
 
         print('Stop listening')
+        self.ready.clear()
         self.detector.terminate()
+        # Stops recording of the pipeline, then it finishes recorded phrases.
+        self.audio_source.terminate()
+        if own_source:
+            self.audio_source = None
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            print('Pipeline: {}'.format(self.pipeline.get_stats()))
+            self.pipeline = None
+        if self.result_cache is not None:
+            print('Result cache: {}'.format(self.result_cache.get_stats()))
+            self.result_cache.close()
+        print('Cloud escalation: {}'.format(self.dispatcher.policy.stats))
+        # Waits for phrases dispatched in background.
+        self.dispatcher.shutdown()
+        if self.archive is not None:
+            self.archive.stop()
+            print('Archive: {}'.format(self.archive.get_stats()))
+            self.archive = None
+        if self.publisher is not None:
+            self.publisher.close()
+            self.publisher = None
+
+    def create_detector(self):
+        # Configure Hotword detection.
+        model = self.config['hotword_detector']['model']
+        sensitivity = self.config['hotword_detector']['sensitivity']
+
+        return snowboydecoder.HotwordDetector(model, sensitivity=sensitivity, audio_source=self.audio_source)
 
     def create_services(self):
+        behaviour = self.config['handler_behaviour']
+        self.dispatcher = RecognitionDispatcher(
+            behaviour['confidence_threshold'],
+            deadline=behaviour['deadline'] if 'deadline' in behaviour else None,
+            speculative_cloud=behaviour['speculative_cloud'] if 'speculative_cloud' in behaviour else False,
+            policy=self.init_escalation_policy(behaviour),
+            queue_size=int(behaviour['queue_size']) if 'queue_size' in behaviour else 4)
+
+        if 'result_cache' in self.config:
+            self.result_cache = self.init_result_cache(self.config['result_cache'])
+
         if 'services' not in self.config:
             return
 
@@ -103,54 +212,238 @@ class CommandRecognition(Process):
                 self.local_services.append(service)
             else:
                 self.cloud_services.append(service)
+            timeout = service_config['timeout'] if 'timeout' in service_config else None
+            self.dispatcher.add_service(service, is_local, timeout)
+
+    @staticmethod
+    def init_audio_source(config):
+        """
+        Creates replay audio source from config.
+        :param config: dict with `type` of 'wav' or 'pipe' and `path`.
+                       'pipe' reads raw PCM and needs `sample_width` in bytes,
+                       `channels` and `rate`, path '-' stands for stdin.
+        :return: AudioSource
+        """
+        frames_per_buffer = config['frames_per_buffer'] if 'frames_per_buffer' in config else 2048
+        if config['type'] == 'wav':
+            return WavFileSource(config['path'], frames_per_buffer)
+        elif config['type'] == 'pipe':
+            audio_format = pyaudio.get_format_from_width(config['sample_width'])
+            return PipeSource.from_path(config['path'], audio_format,
+                                        config['channels'], config['rate'], frames_per_buffer)
+
+        raise ValueError('Unknown audio source type', config['type'])
+
+    @staticmethod
+    def init_tracer(config):
+        """
+        :param config: dict with `enabled`, optional `metrics_path` to
+                       rewrite after every phrase and `metrics_format` of
+                       'prometheus' or 'json'
+        :return: Tracer
+        """
+        return Tracer(enabled=bool(config['enabled']) if 'enabled' in config else True,
+                      metrics_path=config['metrics_path'] if 'metrics_path' in config else None,
+                      metrics_format=config['metrics_format'] if 'metrics_format' in config else 'prometheus')
+
+    @staticmethod
+    def init_escalation_policy(behaviour):
+        """
+        :param behaviour: handler behaviour config with optional cloud budgets
+                          `cloud_requests_per_minute`, `cloud_bytes_per_minute`
+                          and circuit breaker `breaker_failures`,
+                          `breaker_latency` and `breaker_reset` in seconds
+        :return: EscalationPolicy
+        """
+        breaker = CircuitBreaker(
+            failure_threshold=int(behaviour['breaker_failures']) if 'breaker_failures' in behaviour else 3,
+            latency_threshold=behaviour['breaker_latency'] if 'breaker_latency' in behaviour else None,
+            reset_timeout=behaviour['breaker_reset'] if 'breaker_reset' in behaviour else 30)
+
+        return EscalationPolicy(
+            max_requests=behaviour['cloud_requests_per_minute'] if 'cloud_requests_per_minute' in behaviour else None,
+            max_bytes=behaviour['cloud_bytes_per_minute'] if 'cloud_bytes_per_minute' in behaviour else None,
+            breaker=breaker)
+
+    @staticmethod
+    def init_result_cache(config):
+        """
+        :param config: dict with optional `max_size`, `ttl` in seconds,
+                       `tolerance` in dB, `path` of the on-disk store and
+                       `save_delay` in seconds
+        :return: ResultCache
+        """
+        return ResultCache(max_size=int(config['max_size']) if 'max_size' in config else 256,
+                           ttl=config['ttl'] if 'ttl' in config else 3600,
+                           tolerance=float(config['tolerance']) if 'tolerance' in config else 2.0,
+                           path=config['path'] if 'path' in config else None,
+                           save_delay=float(config['save_delay']) if 'save_delay' in config else 5.0)
+
+    @staticmethod
+    def init_archive(config, audio):
+        """
+        :param config: dict with `path` and optional `format` of 'flac' or
+                       'wav', `sample_ratio`, `queue_size`, container
+                       rotation `max_file_seconds` and `max_file_bytes`,
+                       quotas `max_total_bytes` and `min_free_bytes`
+        :param audio: audio config of recorded phrases
+        :return: UtteranceArchive
+        """
+        return UtteranceArchive(
+            config['path'], channels=audio['channels'], rate=audio['rate'],
+            audio_format=config['format'] if 'format' in config else 'flac',
+            sample_ratio=float(config['sample_ratio']) if 'sample_ratio' in config else 1.0,
+            queue_size=int(config['queue_size']) if 'queue_size' in config else 16,
+            max_file_seconds=config['max_file_seconds'] if 'max_file_seconds' in config else 600,
+            max_file_bytes=int(config['max_file_bytes']) if 'max_file_bytes' in config else 16 * 2 ** 20,
+            max_total_bytes=int(config['max_total_bytes']) if 'max_total_bytes' in config else None,
+            min_free_bytes=int(config['min_free_bytes']) if 'min_free_bytes' in config else None)
 
     @staticmethod
     def init_service(config):
+        """
+        Creates the service named by `service_name`, its module is imported
+        on first use, see Plugins.SERVICES.
+        :param config: service config, optional `class` is a 'module.Class'
+                       path of a custom service
+        :return: service or None if the name is unknown
+        """
+        if 'class' in config:
+            SERVICES.register(config['service_name'], config['class'])
+
         service = None
-        if config['service_name'] == 'pocketsphinx':
-            service = MyPocketSphinx(config)
-        elif config['service_name'] == 'google':
-            service = GoogleCloudSpeechAPI(config)
+        if config['service_name'] in SERVICES:
+            service = SERVICES.create(config['service_name'], config)
 
         return service
 
     def command_handler(self):
-        confidence_threshold = self.config['handler_behaviour']['confidence_threshold']
+        # Timeline of the phrase, starts at the hotword detection.
+        trace = self.tracer.start_trace()
+        trace.event('hotword')
+
+        if self.pipeline is not None:
+            # Recorded and recognized by pipeline threads, the detector goes on.
+            self.pipeline.on_hotword(self.detector.detected_position, trace)
+            return
+
+        utterance = self.record_utterance(self.detector.detected_position, trace)
+        if utterance is not None:
+            self.process_utterance(utterance)
+
+    def record_utterance(self, start_position, trace=NULL_TRACE):
+        """
+        Records the phrase after the hotword, local streaming services
+        decode it meanwhile.
+        :param start_position: position in the audio source to record from
+        :return: Utterance or None if nothing was caught
+        """
+        # Local streaming services decode audio data while it is recorded.
+        # Speculative cloud streaming services upload it while recorded.
+        upload_services = []
+        # Streams of a phrase still dispatched in background must not be restarted.
+        # Budgets and the circuit breaker gate uploads as well as requests.
+        if self.dispatcher.speculative_cloud and not self.dispatcher.is_busy() and \
+                (self.pipeline is None or not self.pipeline.is_busy()) and self.dispatcher.may_escalate():
+            upload_services = [service for service in self.cloud_services
+                               if StreamingRecognition.is_streaming(service)]
+        streaming = StreamingRecognition(
+            [service for service in self.local_services if StreamingRecognition.is_streaming(service)],
+            partial_callback=self.notify_partial if self.is_partial_enabled() else None,
+            upload_services=upload_services,
+            trace=trace)
 
         # Listen audio data.
-        speech_data = self.voice_record.get_speech_data(num_phrases=1)
+        speech_data = self.voice_record.get_speech_data(num_phrases=1, listener=streaming,
+                                                        start_position=start_position)
         if not speech_data:
             # Nothing to do, nothing was caught.
-            return
+            return None
         # Concatenate all phrases.
         content = b''.join(speech_data)
+        stream = self.voice_record.stream_in
+        end_position = stream.tell() if hasattr(stream, 'tell') else None
+
+        return Utterance(content, streaming.get_results(), upload_services, trace, end_position)
+
+    def process_utterance(self, utterance):
+        content = utterance.content
+        trace = utterance.trace
+
+        # Repeated commands are answered from the cache, uploads are dropped.
+        if self.result_cache is not None:
+            with trace.span('cache'):
+                self.last_result = self.result_cache.get(content)
+            if self.last_result is not None:
+                for service in utterance.upload_services:
+                    if hasattr(service, 'cancel'):
+                        service.cancel()
+                self.notify_result(self.last_result, trace, content)
+                return
+
+        # Recognize with all services at once, cloud is used if local confidence is low.
+        # In background the hotword detector listens again while the cloud answers.
+        callback = lambda result: self.on_dispatch_result(content, result, trace)
+        if self.is_async_cloud():
+            self.dispatcher.dispatch_async(content, callback, results=utterance.results, trace=trace)
+        else:
+            callback(self.dispatcher.dispatch(content, results=utterance.results, trace=trace))
+
+    def on_dispatch_result(self, content, result, trace=NULL_TRACE):
+        self.last_result = result
+
+        # Cache only confident results, so a wrong transcript isn't repeated.
+        if self.result_cache is not None and \
+                self.dispatcher.get_max_confidence(result) >= self.dispatcher.confidence_threshold:
+            self.result_cache.put(content, result)
 
-        local_alternatives = []
-        # Recognize actions locally.
-        for local_service in self.local_services:
-            local_alternatives += local_service.transcribe(content)
+        # Notify the subscribers.
+        self.notify_result(result, trace, content)
 
-        max_local_confidence = 0
-        for alt in local_alternatives:
-            if alt['confidence'] > max_local_confidence:
-                max_local_confidence = alt['confidence']
+    def notify_result(self, result, trace=NULL_TRACE, content=None):
+        """
+        :param content: audio data of the phrase to archive
+        """
+        print('Notifying parent process')
+        trace.event('notify')
+        trace_dict = trace.finish()
+        self.send(ResultMessage.RESULT, result, trace_dict)
+        # Only queued, a slow disk doesn't delay the next phrase.
+        if self.archive is not None and content is not None:
+            self.archive.put(content, result, trace_dict)
+
+    def notify_partial(self, partial):
+        # Partial alternatives are marked with 'partial' key.
+        self.send(ResultMessage.PARTIAL, partial)
+
+    def send(self, kind, alternatives, trace=None):
+        """
+        :param trace: dict of trace events and spans to attach, if tracing is enabled
+        """
+        if self.publisher is not None:
+            self.publisher.publish(ResultMessage(kind, alternatives, trace=trace))
+            return
 
-        cloud_alternatives = []
-        # Send to cloud if confidence is low.
-        # if max_local_confidence < confidence_threshold:
-        #     for cloud_service in self.cloud_services:
-        #         cloud_alternatives += cloud_service.transcribe(content)
+        # Pipe consumers get the trace in every alternative.
+        if trace is not None:
+            alternatives = [dict(alternative, trace=trace) for alternative in alternatives]
+        # Results of background dispatch are sent from another thread.
+        with self.transport_lock:
+            self.transport.send(alternatives)
 
-        # Merge all results.
-        self.last_result = cloud_alternatives + local_alternatives
-        self.last_result = sorted(self.last_result, key=lambda k: k['confidence'], reverse=True)
+    def is_partial_enabled(self):
+        behaviour = self.config['handler_behaviour']
+        return 'notify_partial' in behaviour and behaviour['notify_partial']
 
-        # Notify the subscribers.
-        self.notify_result(self.last_result)
+    def is_pipeline_enabled(self):
+        # Other sources have a single read position, they can't be detected and recorded at once.
+        behaviour = self.config['handler_behaviour']
+        enabled = behaviour['pipeline'] if 'pipeline' in behaviour else True
+        return enabled and isinstance(self.audio_source, SharedCaptureSource)
 
-    def notify_result(self, result):
-        print('Notifying parent process')
-        self.transport.send(result)
+    def is_async_cloud(self):
+        behaviour = self.config['handler_behaviour']
+        return 'async_cloud' in behaviour and behaviour['async_cloud']
 
     def interrupt_callback(self):
         # Callback to check current state of interrupted flag.
@@ -163,7 +456,24 @@ class CommandRecognition(Process):
     def set_interrupted(self, value):
         self.interrupted.value = bool(value)
 
+    def wait_ready(self, timeout=None):
+        """
+        Waits until the hotword is listened, e.g. from the parent process.
+        :return: True if ready, False on timeout
+        """
+        return self.ready.wait(timeout)
+
+    def set_audio_source(self, audio_source):
+        """
+        Replaces the microphone with a replay source, e.g. BufferSource.
+        Must be called before the recognition loop starts.
+        """
+        self.audio_source = audio_source
+
     def get_stream_config(self):
+        if self.audio_source is not None:
+            return self.audio_source.get_config()
+
         if not self.detector.stream_in:
             return {}
 
@@ -176,7 +486,7 @@ class CommandRecognition(Process):
 
     def set_config_yaml(self, filepath):
         with open(filepath, 'r') as stream:
-            config = yaml.load(stream)
+            config = yaml.safe_load(stream)
             self.set_config(config)
 
     def set_config(self, config):
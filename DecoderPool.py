@@ -0,0 +1,85 @@
+import gc
+import threading
+from contextlib import contextmanager
+
+from six.moves import queue
+
+
+class DecoderPool:
+    """
+    Fixed size pool of pre-initialized decoders.
+
+    Decoders are created and warmed up once, on startup, so the first
+    phrase doesn't pay for model loading and lazy allocations. A decoder
+    handles one utterance at a time: checkout() takes a free one, waiting
+    if all are busy, checkin() returns it.
+
+    To share model memory between worker processes create the pool before
+    forking and call prepare_fork(): model pages loaded by the parent are
+    shared copy-on-write as long as nobody writes to them.
+    """
+
+    def __init__(self, factory, size=1, warm_up=None):
+        """
+        :param factory: function without arguments, creates a decoder
+        :param size: count of decoders
+        :param warm_up: function called with every new decoder
+        """
+        assert size > 0, 'Pool size must be positive'
+        self.size = size
+        self._free = queue.Queue()
+        self._lock = threading.Lock()
+        self._busy = 0
+        for _ in range(size):
+            decoder = factory()
+            if warm_up is not None:
+                warm_up(decoder)
+            self._free.put(decoder)
+
+    def checkout(self, timeout=None):
+        """
+        Takes a free decoder.
+        :param timeout: seconds to wait, forever by default
+        :return: decoder
+        :raises queue.Empty: no decoder got free in time
+        """
+        decoder = self._free.get(timeout=timeout)
+        with self._lock:
+            self._busy += 1
+
+        return decoder
+
+    def checkin(self, decoder):
+        """
+        Returns the decoder taken with checkout().
+        """
+        with self._lock:
+            self._busy -= 1
+        self._free.put(decoder)
+
+    @contextmanager
+    def decoder(self, timeout=None):
+        """
+        Holds a free decoder within `with` block.
+        """
+        decoder = self.checkout(timeout)
+        try:
+            yield decoder
+        finally:
+            self.checkin(decoder)
+
+    def get_busy_count(self):
+        with self._lock:
+            return self._busy
+
+    @staticmethod
+    def prepare_fork():
+        """
+        Call it in the parent right before forking workers. Moves objects
+        which exist now out of garbage collection, otherwise the collector
+        of a child writes to their headers and copies the shared pages.
+        """
+        gc.collect()
+        # Not available before Python 3.7.
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
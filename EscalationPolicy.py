@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import deque
+
+# Budgets and breaker timeouts must not jump with the wall clock.
+clock = getattr(time, 'monotonic', time.time)
+
+
+class CircuitBreaker:
+    """
+    Stops cloud requests after consecutive failures, falling back to local
+    results. A request slower than `latency_threshold` counts as a failure,
+    so a stalled network opens the breaker as well as errors do.
+
+    After `reset_timeout` seconds the open breaker lets one probe request
+    through (half-open): its success closes the breaker, failure opens it
+    again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, latency_threshold=None, reset_timeout=30):
+        """
+        :param failure_threshold: consecutive failures to open the breaker
+        :param latency_threshold: seconds, slower requests are failures
+        :param reset_timeout: seconds to wait before the probe request
+        """
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_time = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        :return: True if a request may be sent now
+        """
+        with self._lock:
+            if self.state == self.OPEN and clock() - self._opened_time >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                # Only one probe at a time.
+                if self._probing:
+                    return False
+                self._probing = True
+                return True
+
+            return self.state == self.CLOSED
+
+    def is_allowed(self):
+        """
+        :return: True if allow() would let a request through, the probe
+                 isn't taken
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                return clock() - self._opened_time >= self.reset_timeout
+            if self.state == self.HALF_OPEN:
+                return not self._probing
+
+            return True
+
+    def record_success(self, latency):
+        """
+        :param latency: seconds the request took
+        """
+        if self.latency_threshold is not None and latency > self.latency_threshold:
+            self.record_failure()
+            return
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """
+        Drops the probe request without result, e.g. when it's cancelled.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state == self.CLOSED:
+                    print('Cloud circuit breaker opened after {} failures'.format(self.failures))
+                self.state = self.OPEN
+                self._opened_time = clock()
+
+
+class EscalationPolicy:
+    """
+    Decides whether a phrase may be sent to cloud services: the circuit
+    breaker must be closed and requests and bytes sent within the last
+    minute must fit the budgets.
+    """
+    BUDGET_WINDOW = 60
+
+    def __init__(self, max_requests=None, max_bytes=None, breaker=None):
+        """
+        :param max_requests: cloud requests per minute, None for no limit
+        :param max_bytes: bytes of audio sent per minute, None for no limit
+        :param breaker: CircuitBreaker or None
+        """
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.breaker = breaker
+        # Times and sizes of requests within the budget window.
+        self._sent = deque()
+        self._sent_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'escalated': 0, 'over_budget': 0, 'breaker_open': 0}
+
+    def acquire(self, size):
+        """
+        Takes budget for a request if it's allowed.
+        :param size: bytes of audio to send
+        :return: True if the request may be sent
+        """
+        with self._lock:
+            now = clock()
+            if not self._fits_budget(now, size):
+                self.stats['over_budget'] += 1
+                return False
+
+            # Checked last, so a half-open probe isn't taken for nothing.
+            if self.breaker is not None and not self.breaker.allow():
+                self.stats['breaker_open'] += 1
+                return False
+
+            self._sent.append((now, size))
+            self._sent_bytes += size
+            self.stats['escalated'] += 1
+
+        return True
+
+    def is_allowed(self, size=0):
+        """
+        Checks the budgets and the breaker without taking anything, e.g.
+        before speculative upload of a phrase of unknown size.
+        :param size: bytes of audio to send
+        :return: True if acquire() would let the request through now
+        """
+        with self._lock:
+            if not self._fits_budget(clock(), size):
+                return False
+
+        return self.breaker is None or self.breaker.is_allowed()
+
+    def _fits_budget(self, now, size):
+        while self._sent and now - self._sent[0][0] >= self.BUDGET_WINDOW:
+            self._sent_bytes -= self._sent.popleft()[1]
+
+        return not ((self.max_requests is not None and len(self._sent) + 1 > self.max_requests)
+                    or (self.max_bytes is not None and self._sent_bytes + size > self.max_bytes))
+
+    def record(self, latency=None, success=True):
+        """
+        Reports result of a cloud request to the breaker.
+        :param latency: seconds the request took
+        :param success: False on error or timeout, None if cancelled
+        """
+        if self.breaker is None:
+            return
+        if success is None:
+            # Cancelled, nothing is known about the service.
+            self.breaker.release()
+        elif success:
+            self.breaker.record_success(latency)
+        else:
+            self.breaker.record_failure()
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+import argparse
+import random
+import time
+from concurrent import futures
+
+import grpc
+from google.cloud.proto.speech.v1beta1 import cloud_speech_pb2
+
+
+class FakeSpeechServer(cloud_speech_pb2.SpeechServicer):
+    """
+    Local Speech API endpoint which answers every request with the same
+    transcript. Use it with `insecure: true` google service config to run
+    the client without network and credentials.
+
+    Delays and failures can be injected to test timeouts and fallbacks,
+    attributes may be changed while serving.
+    """
+
+    def __init__(self, transcript='test', confidence=0.9, delay=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        """
+        :param transcript: transcript to answer with
+        :param confidence: confidence to answer with
+        :param delay: seconds to wait before the answer
+        :param jitter: max random seconds added to the delay
+        :param failure_rate: share of requests answered with UNAVAILABLE error
+        :param seed: random seed to make runs repeatable
+        """
+        self.transcript = transcript
+        self.confidence = confidence
+        self.delay = delay
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failures_count = 0
+        self._random = random.Random(seed)
+        self.requests_count = 0
+        self.bytes_received = 0
+        self._server = None
+
+    def get_result(self, is_final=True):
+        return cloud_speech_pb2.StreamingRecognitionResult(
+            alternatives=[cloud_speech_pb2.SpeechRecognitionAlternative(
+                transcript=self.transcript, confidence=self.confidence)],
+            is_final=is_final)
+
+    def wait_and_fail(self, context):
+        """
+        Sleeps for injected delay and decides on injected failure.
+        :return: True if the request must fail
+        """
+        time.sleep(self.delay + self._random.uniform(0, self.jitter))
+        if self._random.random() >= self.failure_rate:
+            return False
+
+        self.failures_count += 1
+        context.set_code(grpc.StatusCode.UNAVAILABLE)
+        context.set_details('Injected failure')
+
+        return True
+
+    def SyncRecognize(self, request, context):
+        self.requests_count += 1
+        self.bytes_received += len(request.audio.content)
+        if self.wait_and_fail(context):
+            return cloud_speech_pb2.SyncRecognizeResponse()
+
+        return cloud_speech_pb2.SyncRecognizeResponse(
+            results=[cloud_speech_pb2.SpeechRecognitionResult(
+                alternatives=[cloud_speech_pb2.SpeechRecognitionAlternative(
+                    transcript=self.transcript, confidence=self.confidence)])])
+
+    def StreamingRecognize(self, request_iterator, context):
+        self.requests_count += 1
+        for request in request_iterator:
+            if request.audio_content:
+                self.bytes_received += len(request.audio_content)
+                yield cloud_speech_pb2.StreamingRecognizeResponse(results=[self.get_result(is_final=False)])
+        if self.wait_and_fail(context):
+            return
+
+        yield cloud_speech_pb2.StreamingRecognizeResponse(results=[self.get_result()])
+
+    def start(self, port=0, max_workers=4):
+        """
+        Starts serving on localhost.
+        :param port: port to listen, 0 picks a free one
+        :return: listened port
+        """
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+        cloud_speech_pb2.add_SpeechServicer_to_server(self, self._server)
+        port = self._server.add_insecure_port('localhost:{}'.format(port))
+        self._server.start()
+
+        return port
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop(0)
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Google Cloud Speech API endpoint.')
+    parser.add_argument('--port', type=int, default=50051)
+    parser.add_argument('--transcript', default='test')
+    parser.add_argument('--confidence', type=float, default=0.9)
+    parser.add_argument('--delay', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeSpeechServer(args.transcript, args.confidence, args.delay, args.jitter, args.failure_rate, args.seed)
+    port = server.start(args.port)
+    print('Listening on localhost:{}'.format(port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,85 +1,355 @@
 #!/usr/bin/python
 
+import threading
+import time
+
+import grpc
 import google.auth
 import google.auth.transport.grpc
 import google.auth.transport.requests
 from google.cloud.proto.speech.v1beta1 import cloud_speech_pb2
+from six.moves import queue
+
+from Plugins import ENCODERS
 
 # Keep the request alive for this many seconds
 DEADLINE_SECS = 60
+# Wait for the connection this many seconds, a dead network fails fast.
+CONNECT_TIMEOUT_SECS = 5
 SPEECH_SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
 LANGUAGE_CODE = 'en-US'
+SPEECH_HOST = 'speech.googleapis.com'
+SPEECH_PORT = 443
+
+# Latency must not jump with the wall clock.
+clock = getattr(time, 'monotonic', time.time)
 
 
 class GoogleCloudSpeechAPI:
     """
-    TODO: Description.
+    Google Cloud Speech API client.
+
+    Channels are created once per target and shared by all instances, so
+    credentials lookup and TLS handshake are not repeated per utterance.
+    The auth plugin of a channel refreshes the access token when it expires.
+
+    In streaming mode audio is uploaded with StreamingRecognize while it is
+    recorded, see start_utterance(), feed() and finish(). The request is
+    connected and sent by a background thread, so recording doesn't wait
+    for the network. transcribe() then waits for the streamed result
+    instead of uploading the content again.
+
+    Latency of the last request is kept in `last_latency` as seconds spent
+    to connect, to upload audio and waiting for the server after upload.
+    Upload of a sync request can't be told apart from the server time, so
+    its upload is None.
+
+    Audio is compressed by `upload_encoding` encoder, FLAC or MULAW, see
+    AudioEncoder. Sizes and encode CPU time of the last request are kept
+    in `last_upload`.
     """
+    _channels = {}
+    _channels_lock = threading.Lock()
 
     def __init__(self, config):
         self._validate_config(config)
         self.config = config
-        self.encoding = config['audio']['encoding']
+        self.encoder = ENCODERS.create(config['upload_encoding'], config['audio'].get('channels', 1),
+                                       config['audio']['rate'])
+        self.encoding = self.encoder.ENCODING
         self.sample_rate = config['audio']['rate']
         self.language_code = config['language_code']
+        self.streaming = config['streaming']
+        self.last_latency = {}
+        self.last_upload = {}
+        # Stream being recorded and stream waited for by finish(), both may be cancelled.
+        self._stream = None
+        self._finishing = None
+        self._stream_lock = threading.Lock()
 
     @staticmethod
     def _validate_config(config):
         config['language_code'] = config['language_code'] if 'language_code' in config else LANGUAGE_CODE
         config['known_alternatives'] = config['known_alternatives'] if 'known_alternatives' in config else []
         config['filter_unknown'] = config['filter_unknown'] if 'filter_unknown' in config else False
+        config['host'] = config['host'] if 'host' in config else SPEECH_HOST
+        config['port'] = int(config['port']) if 'port' in config else SPEECH_PORT
+        config['insecure'] = bool(config['insecure']) if 'insecure' in config else False
+        config['streaming'] = bool(config['streaming']) if 'streaming' in config else False
+        config['interim_results'] = bool(config['interim_results']) if 'interim_results' in config else False
+        config['upload_encoding'] = str(config['upload_encoding']).upper() \
+            if 'upload_encoding' in config else 'LINEAR16'
+        config['verbose'] = bool(config['verbose']) if 'verbose' in config else False
 
     def make_channel(self, host, port):
         """Creates a secure channel with auth credentials from the environment."""
+        target = '{}:{}'.format(host, port)
+        # Local endpoints, e.g. FakeSpeechServer, don't need credentials.
+        if self.config['insecure']:
+            return grpc.insecure_channel(target)
+
         # Grab application default credentials from the environment
         credentials, _ = google.auth.default(scopes=[SPEECH_SCOPE])
 
         # Create a secure channel using the credentials.
         http_request = google.auth.transport.requests.Request()
-        target = '{}:{}'.format(host, port)
 
         return google.auth.transport.grpc.secure_authorized_channel(
             credentials, http_request, target)
 
+    def get_channel(self):
+        """Returns a shared channel for configured target, creates it on first use."""
+        # Secure and insecure channels to one target are different channels.
+        key = (self.config['host'], self.config['port'], self.config['insecure'])
+        with self._channels_lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self.make_channel(self.config['host'], self.config['port'])
+                self._channels[key] = channel
+
+        return channel
+
+    def get_service(self):
+        """
+        Connects to the service.
+        :return: service stub and seconds spent to connect
+        """
+        start_time = clock()
+        channel = self.get_channel()
+        # Ready channel returns at once, otherwise it waits for connection.
+        grpc.channel_ready_future(channel).result(timeout=CONNECT_TIMEOUT_SECS)
+
+        return cloud_speech_pb2.SpeechStub(channel), clock() - start_time
+
+    def get_recognition_config(self):
+        return cloud_speech_pb2.RecognitionConfig(
+            # There are a bunch of config options you can specify. See
+            # https://goo.gl/KPZn97 for the full list.
+            encoding=self.encoding,  # one of LINEAR16, FLAC, MULAW, AMR, AMR_WB
+            sample_rate=self.sample_rate,  # the rate in hertz
+            # See https://g.co/cloud/speech/docs/languages for a list of
+            # supported languages.
+            language_code=self.language_code,  # a BCP-47 language tag
+        )
+
     def transcribe(self, content):
         # TODO: Filter alternatives we don't know.
         # TODO: Send list of desired commands.
+        stream = self._take_stream()
+        if stream is not None:
+            # Content was uploaded while recorded.
+            return self._finish_stream(stream)
+
         return self.request_transcribe_sync(content)
 
     def request_transcribe_sync(self, content):
         """
-        TODO: Description.
-        :param content:
-        :return:
+        Recognizes content with a single SyncRecognize request.
+        :param content: audio data
+        :return: alternatives
         """
-        service = cloud_speech_pb2.SpeechStub(self.make_channel('speech.googleapis.com', 443))
+        service, connect_time = self.get_service()
 
         # The method and parameters can be inferred from the proto from which the
         # grpc client lib was generated. See:
         # https://github.com/googleapis/googleapis/blob/master/google/cloud/speech/v1beta1/cloud_speech.proto
+        start_time = clock()
         response = service.SyncRecognize(cloud_speech_pb2.SyncRecognizeRequest(
-            config=cloud_speech_pb2.RecognitionConfig(
-                # There are a bunch of config options you can specify. See
-                # https://goo.gl/KPZn97 for the full list.
-                encoding=self.encoding,  # one of LINEAR16, FLAC, MULAW, AMR, AMR_WB
-                sample_rate=self.sample_rate,  # the rate in hertz
-                # See https://g.co/cloud/speech/docs/languages for a list of
-                # supported languages.
-                language_code=self.language_code,  # a BCP-47 language tag
-            ),
+            config=self.get_recognition_config(),
             audio=cloud_speech_pb2.RecognitionAudio(
-                content=content,
+                content=self.encoder.encode(content),
             )
         ), DEADLINE_SECS)
+        self.set_last_latency(connect_time, None, clock() - start_time)
+        self.set_last_upload()
 
         # Print the recognition result alternatives and confidence scores.
         alternatives = []
         for result in response.results:
-            for alternative in result.alternatives:
-                alternatives.append({
-                    'service_name': self.config['service_name'],
-                    'confidence': alternative.confidence,
-                    'transcript': alternative.transcript
-                })
+            alternatives += self.get_alternatives(result)
+
+        return alternatives
+
+    def start_utterance(self):
+        """
+        Starts StreamingRecognize request, audio data is passed with feed().
+        Returns at once, audio is queued until the request is connected.
+        """
+        self.cancel()
+        stream = {
+            'requests': queue.Queue(),
+            'call': None,
+            'cancelled': False,
+            'connect': None,
+            'start': clock(),
+            'upload_end': None,
+            'end': None,
+            'final': [],
+            'partial': [],
+            'error': None,
+        }
+        stream['thread'] = threading.Thread(target=self._run_stream, args=(stream,))
+        stream['thread'].daemon = True
+        with self._stream_lock:
+            self._stream = stream
+        stream['thread'].start()
+        # FLAC stream header goes first.
+        self._put(stream, self.encoder.start())
+
+    def _run_stream(self, stream):
+        def request_iterator():
+            yield cloud_speech_pb2.StreamingRecognizeRequest(
+                streaming_config=cloud_speech_pb2.StreamingRecognitionConfig(
+                    config=self.get_recognition_config(),
+                    interim_results=self.config['interim_results']))
+            while True:
+                chunk = stream['requests'].get()
+                if chunk is None:
+                    stream['upload_end'] = clock()
+                    return
+                yield cloud_speech_pb2.StreamingRecognizeRequest(audio_content=chunk)
+
+        try:
+            service, stream['connect'] = self.get_service()
+            call = service.StreamingRecognize(request_iterator(), DEADLINE_SECS)
+            with self._stream_lock:
+                stream['call'] = call
+                cancelled = stream['cancelled']
+            # Cancelled while connecting.
+            if cancelled:
+                call.cancel()
+            for response in call:
+                partial = []
+                for result in response.results:
+                    if result.is_final:
+                        stream['final'] += self.get_alternatives(result)
+                    else:
+                        partial += self.get_alternatives(result, partial=True)
+                stream['partial'] = partial
+        except Exception as e:
+            # Connection timeout or RpcError, raised by finish().
+            stream['error'] = e
+        stream['end'] = clock()
+
+    def feed(self, chunk):
+        with self._stream_lock:
+            stream = self._stream
+        if stream is not None:
+            self._put(stream, self.encoder.encode_chunk(chunk))
+
+    @staticmethod
+    def _put(stream, data):
+        # Encoders buffer audio up to a whole block, nothing to send until then.
+        if data:
+            stream['requests'].put(data)
+
+    def get_partial(self):
+        with self._stream_lock:
+            stream = self._stream
+        return stream['partial'] if stream is not None else []
+
+    def finish(self):
+        """
+        Ends the upload and waits for final results.
+        :return: alternatives
+        """
+        stream = self._take_stream()
+
+        return self._finish_stream(stream) if stream is not None else []
+
+    def _take_stream(self):
+        """
+        :return: stream being recorded, it's still cancelled by cancel()
+        """
+        with self._stream_lock:
+            stream = self._stream
+            self._stream = None
+            if stream is not None:
+                self._finishing = stream
+
+        return stream
+
+    def _finish_stream(self, stream):
+        try:
+            self._put(stream, self.encoder.finish())
+            stream['requests'].put(None)
+            stream['thread'].join(DEADLINE_SECS)
+        finally:
+            with self._stream_lock:
+                if self._finishing is stream:
+                    self._finishing = None
+        if stream['error'] is not None:
+            raise stream['error']
+        if stream['thread'].is_alive():
+            self._cancel_stream(stream)
+            raise RuntimeError('Streaming recognition timed out')
+
+        upload_end = stream['upload_end'] if stream['upload_end'] is not None else stream['start']
+        end = stream['end'] if stream['end'] is not None else clock()
+        self.set_last_latency(stream['connect'] or 0.0, upload_end - stream['start'], end - upload_end)
+        self.set_last_upload()
+
+        return stream['final']
+
+    def cancel(self):
+        """
+        Cancels the streaming request in progress, if any, also while
+        finish() waits for it.
+        """
+        with self._stream_lock:
+            streams = [stream for stream in (self._stream, self._finishing) if stream is not None]
+            self._stream = None
+            self._finishing = None
+        for stream in streams:
+            self._cancel_stream(stream)
+
+    def _cancel_stream(self, stream):
+        with self._stream_lock:
+            stream['cancelled'] = True
+            call = stream['call']
+        if call is not None:
+            call.cancel()
+        stream['requests'].put(None)
+
+    def get_alternatives(self, result, partial=False):
+        alternatives = []
+        for alternative in result.alternatives:
+            item = {
+                'service_name': self.config['service_name'],
+                'confidence': alternative.confidence,
+                'transcript': alternative.transcript
+            }
+            if partial:
+                item['partial'] = True
+            alternatives.append(item)
 
         return alternatives
+
+    def set_last_latency(self, connect, upload, server):
+        self.last_latency = {
+            'connect': connect,
+            'upload': upload,
+            'server': server,
+        }
+        if self.config['verbose']:
+            print('Google latency: connect {:.3f}s, upload {}, server {:.3f}s'.format(
+                connect, '{:.3f}s'.format(upload) if upload is not None else '-', server))
+
+    def get_upload_size(self, size):
+        """
+        Estimates bytes on the wire before the phrase is encoded, by the
+        compression of the last upload.
+        :param size: bytes of PCM data
+        :return: bytes of encoded data
+        """
+        upload = self.last_upload
+        ratio = float(upload['bytes']) / upload['raw_bytes'] if upload.get('raw_bytes') else self.encoder.RATIO
+
+        return int(size * ratio)
+
+    def set_last_upload(self):
+        self.last_upload = dict(self.encoder.stats)
+        if self.config['verbose']:
+            print('Google upload: {} {} of {} bytes, encoded in {:.1f} ms'.format(
+                self.last_upload['encoding'], self.last_upload['bytes'], self.last_upload['raw_bytes'],
+                self.last_upload['cpu'] * 1000))
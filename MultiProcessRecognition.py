@@ -0,0 +1,328 @@
+import multiprocessing
+import time
+from multiprocessing import Process
+
+import pyaudio
+from six.moves import queue
+
+from AudioSource import MicrophoneSource
+from CommandRecognition import CommandRecognition
+from RecognitionDispatcher import RecognitionDispatcher
+from ResultTransport import ResultMessage, ResultPublisher
+from SharedAudioRing import SharedAudioRing
+from SpeechSegmenter import SpeechSegmenter
+from VoiceRecord import VoiceRecord
+from snowboy import snowboydecoder, snowboydetect
+
+# CPU time of the process, time.clock() in Python 2.
+process_time = getattr(time, 'process_time', None) or time.clock
+
+
+class CaptureStage(Process):
+    """
+    Reads the microphone or a replay source into the shared audio ring.
+    """
+
+    def __init__(self, config, ring, interrupted, stats):
+        Process.__init__(self)
+        self.config = config
+        self.ring = ring
+        self.interrupted = interrupted
+        self.stats = stats
+
+    def run(self):
+        if 'audio_source' in self.config:
+            source = CommandRecognition.init_audio_source(self.config['audio_source'])
+        else:
+            source = MicrophoneSource(self.ring.audio_format, self.ring.channels, self.ring.rate,
+                                      self.ring.frames_per_buffer)
+        assert source.get_config() == self.ring.get_config(), 'audio source format does not match the ring'
+
+        stages = self.config['stages'] if 'stages' in self.config else {}
+        # Replay sources are paced like a microphone, faster than it the ring overruns.
+        speed = stages['replay_speed'] if 'replay_speed' in stages else 1.0
+        chunk_duration = float(self.ring.frames_per_buffer) / self.ring.rate
+        pace = not source.is_live and speed > 0
+
+        stream = source.open()
+        start_time = time.time()
+        chunks = 0
+        while not self.interrupted.value:
+            data = stream.read(self.ring.frames_per_buffer)
+            if not data:
+                break
+            self.ring.write(data)
+            chunks += 1
+            if pace:
+                delay = start_time + chunks * chunk_duration / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+        stream.close()
+        source.terminate()
+        self.ring.finish()
+
+        self.stats.put({'stage': 'capture', 'cpu': process_time(), 'chunks': chunks})
+        self.ring.terminate()
+
+
+class DetectionStage(Process):
+    """
+    Detects the hotword and splits the phrase after it by VAD. Phrases are
+    sent to the recognition stage as ring positions, not audio.
+    """
+
+    def __init__(self, config, ring, phrases, ready, stats):
+        Process.__init__(self)
+        self.config = config
+        self.ring = ring
+        self.phrases = phrases
+        self.ready = ready
+        self.stats = stats
+
+    def run(self):
+        try:
+            self.detect()
+        finally:
+            # The recognition stage waits for the end of phrases even if detection fails.
+            self.phrases.put(None)
+            self.ring.terminate()
+
+    def detect(self):
+        hotword_config = self.config['hotword_detector']
+        detector = snowboydetect.SnowboyDetect(
+            resource_filename=snowboydecoder.RESOURCE_FILE.encode(),
+            model_str=hotword_config['model'].encode())
+        detector.SetSensitivity(str(hotword_config['sensitivity']).encode())
+
+        self.config['recorder']['audio'] = self.ring.get_config()
+        voice_record = VoiceRecord(self.config['recorder'], source=self.ring)
+        adaptive = self.config['recorder']['adaptive_threshold']
+        if 'bg_noise_samples' in self.config['recorder'] and not adaptive:
+            voice_record.threshold = voice_record.measure_background_noise(
+                num_samples=self.config['recorder']['bg_noise_samples'])
+        segmenter = voice_record.get_segmenter(voice_record.get_threshold())
+
+        self.ready.set()
+        stream = self.ring.open()
+        listening = False
+        silence = start = hotword_time = None
+        hotwords = phrases = 0
+        while True:
+            data = stream.read(self.ring.frames_per_buffer)
+            if not data:
+                break
+            position = stream.tell() - 1
+
+            if not listening:
+                ans = detector.RunDetection(data)
+                if ans > 0:
+                    hotwords += 1
+                    listening = True
+                    segmenter.reset(voice_record.get_threshold())
+                    silence = 0
+                    hotword_time = stream.timestamp
+                elif ans in (0, -2) and adaptive:
+                    voice_record.update_noise_floor(data)
+                continue
+
+            # Segmenter is driven by estimates only, phrase audio stays in the ring.
+            estimate = voice_record.get_vad_estimate(data) * voice_record.sensitivity
+            event = segmenter.push(estimate)
+            if event == SpeechSegmenter.SILENCE:
+                silence += 1
+                if adaptive:
+                    voice_record.noise_tracker.update(estimate)
+                    segmenter.threshold = voice_record.get_threshold()
+            elif event == SpeechSegmenter.START:
+                # Previous silent chunks are prepended to the phrase.
+                start = position - min(silence, segmenter.prev_len)
+            elif event == SpeechSegmenter.END:
+                phrases += 1
+                self.phrases.put((start, position, hotword_time))
+                listening = False
+            elif event == SpeechSegmenter.STOP:
+                listening = False
+
+        # End of audio, deliver what was recorded.
+        if listening and segmenter.started:
+            phrases += 1
+            self.phrases.put((start, stream.tell(), hotword_time))
+
+        self.stats.put({'stage': 'detection', 'cpu': process_time(), 'hotwords': hotwords, 'phrases': phrases,
+                        'dropped_chunks': stream.dropped_chunks})
+
+
+class RecognitionStage(Process):
+    """
+    Recognizes phrases copied from the ring and sends the results.
+    """
+
+    def __init__(self, config, ring, phrases, transport, stats):
+        Process.__init__(self)
+        self.config = config
+        self.ring = ring
+        self.phrases = phrases
+        self.transport = transport
+        self.stats = stats
+
+    def create_dispatcher(self):
+        self.config['audio'] = dict(self.ring.get_config(), encoding=VoiceRecord.ENCODING)
+        behaviour = self.config['handler_behaviour']
+        dispatcher = RecognitionDispatcher(
+            behaviour['confidence_threshold'],
+            deadline=behaviour['deadline'] if 'deadline' in behaviour else None,
+            policy=CommandRecognition.init_escalation_policy(behaviour))
+
+        for service_config in self.config.get('services', []):
+            service_config['audio'] = self.config['audio']
+            service = CommandRecognition.init_service(service_config)
+            if service:
+                timeout = service_config['timeout'] if 'timeout' in service_config else None
+                dispatcher.add_service(service, 'local' in service_config and service_config['local'], timeout)
+
+        return dispatcher
+
+    def run(self):
+        dispatcher = self.create_dispatcher()
+        publisher = None
+        if 'transport' in self.config and self.config['transport']['type'] == 'socket':
+            publisher = ResultPublisher(self.config['transport']['path'])
+        archive = None
+        if 'archive' in self.config:
+            archive = CommandRecognition.init_archive(self.config['archive'], self.config['audio'])
+            archive.start()
+
+        # Seconds from the end of the phrase and from the hotword to the result sent.
+        latencies = []
+        hotword_latencies = []
+        phrases = dropped = 0
+        while True:
+            job = self.phrases.get()
+            if job is None:
+                break
+            start, end, hotword_time = job
+            phrases += 1
+            end_time = self.ring.get_timestamp(end - 1)
+            content = self.ring.read_range(start, end)
+            if content is None:
+                print('Phrase is overwritten in the audio ring, recognition is too slow')
+                dropped += 1
+                continue
+
+            result = dispatcher.dispatch(content)
+            if publisher is not None:
+                publisher.publish(ResultMessage(ResultMessage.RESULT, result))
+            else:
+                self.transport.send(result)
+            if archive is not None:
+                archive.put(content, result)
+            now = time.time()
+            if end_time is not None:
+                latencies.append(now - end_time)
+            if hotword_time is not None:
+                hotword_latencies.append(now - hotword_time)
+
+        dispatcher.shutdown()
+        if publisher is not None:
+            publisher.close()
+        archive_stats = None
+        if archive is not None:
+            archive.stop()
+            archive_stats = archive.get_stats()
+
+        self.stats.put({'stage': 'recognition', 'cpu': process_time(), 'phrases': phrases,
+                        'dropped_phrases': dropped, 'latencies': latencies, 'hotword_latencies': hotword_latencies,
+                        'archive': archive_stats})
+        self.ring.terminate()
+
+
+class MultiProcessRecognition(CommandRecognition):
+    """
+    CommandRecognition with capture, hotword detection with VAD and
+    recognition in separate worker processes, so they don't share one
+    GIL. Audio goes through SharedAudioRing, only phrase positions and
+    results are pickled. When a stage dies the others are stopped.
+
+    Per-stage CPU time and latency of results are printed when the loop
+    stops and kept in `stage_stats`. The result cache, partial results
+    and speculative cloud are not supported in this mode.
+    """
+
+    # Seconds for the other stages to finish after one failed.
+    STOP_TIMEOUT = 10
+
+    def __init__(self):
+        CommandRecognition.__init__(self)
+        self.stage_stats = {}
+
+    def stop_stages(self, ring, phrases):
+        """
+        Stops the stages after one of them failed: capture is interrupted,
+        detection gets the end of audio and recognition the end of phrases,
+        in case the failed stage didn't send them.
+        """
+        print('A stage failed, stopping the others')
+        self.set_interrupted(True)
+        ring.finish()
+        phrases.put(None)
+
+    def start_recognize_loop(self):
+        print('Initializing...')
+        stages = self.config['stages'] if 'stages' in self.config else {}
+        # Snowboy audio format: 16 kHz, 16-bit, mono.
+        ring = SharedAudioRing(pyaudio.paInt16, 1, 16000,
+                               buffer_seconds=stages['ring_seconds'] if 'ring_seconds' in stages else 30)
+        phrases = multiprocessing.Queue()
+        stats = multiprocessing.Queue()
+        self.set_interrupted(False)
+
+        workers = [
+            RecognitionStage(self.config, ring, phrases, self.transport, stats),
+            DetectionStage(self.config, ring, phrases, self.ready, stats),
+            CaptureStage(self.config, ring, self.interrupted, stats),
+        ]
+        start_time = time.time()
+        for worker in workers:
+            worker.start()
+        while not self.ready.wait(0.5) and all(worker.is_alive() for worker in workers):
+            pass
+        if self.ready.is_set():
+            print('Listening...')
+
+        # Capture stops on interrupt or at the end of audio, then the others finish.
+        self.stage_stats = {}
+        stop_deadline = None
+        while any(worker.is_alive() for worker in workers) or not stats.empty():
+            if stop_deadline is None and any(worker.exitcode for worker in workers):
+                stop_deadline = time.time() + self.STOP_TIMEOUT
+                self.stop_stages(ring, phrases)
+            elif stop_deadline is not None and time.time() > stop_deadline:
+                for worker in workers:
+                    if worker.is_alive():
+                        print('Stage {} does not stop, terminating'.format(worker.name))
+                        worker.terminate()
+                stop_deadline = float('inf')
+            try:
+                result = stats.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.stage_stats[result.pop('stage')] = result
+        for worker in workers:
+            worker.join()
+        self.ready.clear()
+        ring.terminate()
+        wall = time.time() - start_time
+
+        print('Stop listening')
+        for name in ['capture', 'detection', 'recognition']:
+            if name not in self.stage_stats:
+                print('Stage {} failed'.format(name))
+                continue
+            result = self.stage_stats[name]
+            print('Stage {}: CPU {:.2f} s ({:.0f}% of a core)'.format(name, result['cpu'], result['cpu'] / wall * 100))
+        if self.stage_stats.get('recognition', {}).get('archive') is not None:
+            print('Archive: {}'.format(self.stage_stats['recognition']['archive']))
+        latencies = sorted(self.stage_stats['recognition']['latencies']) if 'recognition' in self.stage_stats else []
+        if latencies:
+            print('Phrase end to result: p50 {:.3f} s, max {:.3f} s'.format(latencies[len(latencies) // 2],
+                                                                             latencies[-1]))
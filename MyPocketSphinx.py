@@ -1,42 +1,136 @@
 #!/usr/bin/env python
-from io import BytesIO
+import os
+import re
+import tempfile
+
+import six
+from six.moves import queue
 
 from pocketsphinx.pocketsphinx import *
 
+from DecoderPool import DecoderPool
+
 
 class MyPocketSphinx:
     confidence_strategy = 'default'
+    streaming = True
+    # transcribe() may be called from several threads, each takes a decoder of the pool.
+    thread_safe = True
+    # Decoder search modes: n-gram language model, grammar or keyphrase
+    # spotting of known commands.
+    SEARCHES = ['lm', 'grammar', 'keyphrase']
+    # Words of a command, without JSGF operators and keyphrase threshold delimiter.
+    COMMAND_PATTERN = re.compile(r'^[^\s;=|*+<>()\[\]{}/\\"#]+(\s+[^\s;=|*+<>()\[\]{}/\\"#]+)*$')
 
     def __init__(self, config):
         # Validate and prepare config.
         self._validate_config(config)
-
+        self.set_confidence_strategy(config['confidence_strategy'])
+        self.buffer_size = config['buffer_size']
+        self.config = config
+        self.known_alternatives = set(config['known_alternatives'])
+
+        # Command search is loaded from a file, which is needed only while decoders are created.
+        self.search_file = self.make_search_file()
+        try:
+            # Decoders are loaded once, each handles one utterance at a time.
+            self.pool = DecoderPool(self.create_decoder, config['pool_size'],
+                                    warm_up=self.warm_up if config['warm_up'] else None)
+        finally:
+            if self.search_file is not None:
+                os.remove(self.search_file)
+                self.search_file = None
+        # Decoder of the streaming utterance.
+        self.decoder = None
+
+    def create_decoder(self):
         # Create a decoder with certain model.
         ps_config = Decoder.default_config()
 
         # Disable logging.
-        if not config['verbose']:
+        if not self.config['verbose']:
             ps_config.set_string('-logfn', '/dev/null')
 
         # Configure PocketSphinx decoder.
-        for name, value in config['decoder'].items():
+        for name, value in self.config['decoder'].items():
+            # Language model isn't loaded for command search, so decoding
+            # cost depends on the command set, not the vocabulary.
+            if name == '-lm' and self.config['search'] != 'lm':
+                continue
             ps_config.set_string(name, value)
 
-        # Decode streaming data.
-        self.decoder = Decoder(ps_config)
-        self.set_confidence_strategy(config['confidence_strategy'])
-        self.buffer_size = config['buffer_size']
-        self.config = config
-
-    @staticmethod
-    def _validate_config(config):
+        if self.config['search'] == 'grammar':
+            ps_config.set_string('-jsgf', self.config['grammar'] or self.search_file)
+        elif self.config['search'] == 'keyphrase':
+            ps_config.set_string('-kws', self.search_file)
+
+        return Decoder(ps_config)
+
+    def make_search_file(self):
+        """
+        Writes grammar or keyphrase list of known alternatives.
+        :return: file path or None if it's not needed
+        """
+        search = self.config['search']
+        if search == 'lm' or (search == 'grammar' and self.config['grammar']):
+            return None
+
+        commands = sorted(self.known_alternatives)
+        if search == 'grammar':
+            content = '#JSGF V1.0;\ngrammar commands;\npublic <command> = {};\n'.format(' | '.join(commands))
+        else:
+            content = ''.join('{} /{}/\n'.format(command, self.config['kws_threshold']) for command in commands)
+
+        fd, path = tempfile.mkstemp(suffix='.' + search)
+        try:
+            with os.fdopen(fd, 'w') as stream:
+                stream.write(content)
+        except Exception:
+            os.remove(path)
+            raise
+
+        return path
+
+    def warm_up(self, decoder):
+        # Decode a second of silence, so search structures are allocated
+        # before the first phrase and before forking.
+        decoder.start_utt()
+        decoder.process_raw(b'\x00' * 32000, False, True)
+        decoder.end_utt()
+
+    @classmethod
+    def _validate_config(cls, config):
         assert 'decoder' in config \
                and '-hmm' in config['decoder'] \
-               and '-lm' in config['decoder'] \
                and '-dict' in config['decoder']
+        # Known commands, lower case as in the dictionary. A single command may be a string.
+        commands = config.get('known_alternatives') or []
+        if isinstance(commands, six.string_types):
+            commands = [commands]
+        config['known_alternatives'] = [' '.join(command.lower().split()) for command in commands]
+        for command in config['known_alternatives']:
+            if not cls.COMMAND_PATTERN.match(command):
+                raise ValueError('Command {!r} must be words without grammar symbols'.format(command))
+        config['filter_unknown'] = bool(config['filter_unknown']) if 'filter_unknown' in config else False
+        config['grammar'] = config['grammar'] if 'grammar' in config else None
+        if 'search' not in config:
+            config['search'] = 'grammar' if config['known_alternatives'] or config['grammar'] else 'lm'
+        if config['search'] not in cls.SEARCHES:
+            raise ValueError('Unknown search type')
+        config['kws_threshold'] = float(config['kws_threshold']) if 'kws_threshold' in config else 1e-20
+        if config['search'] == 'lm':
+            assert '-lm' in config['decoder']
+        elif config['search'] == 'grammar':
+            assert config['grammar'] or config['known_alternatives'], 'Grammar search needs grammar or commands'
+        else:
+            assert config['known_alternatives'], 'Keyphrase search needs commands'
+
         config['buffer_size'] = int(config['buffer_size']) if 'buffer_size' in config else 1024
         config['verbose'] = bool(config['verbose']) if 'verbose' in config else False
         config['confidence_strategy'] = config['confidence_strategy'] if 'confidence_strategy' in config else 'default'
+        config['pool_size'] = int(config['pool_size']) if 'pool_size' in config else 1
+        config['checkout_timeout'] = float(config['checkout_timeout']) if 'checkout_timeout' in config else 0.1
+        config['warm_up'] = bool(config['warm_up']) if 'warm_up' in config else True
 
     def set_confidence_strategy(self, confidence_strategy_type):
         known_strategies = ['default', 'by_word']
@@ -46,44 +140,99 @@ class MyPocketSphinx:
             raise ValueError('Unknown confidence strategy type')
 
     def transcribe(self, content):
-        # Process audio data with PocketSphinx.
+        # Process audio data with PocketSphinx, safe to call from several threads.
+        with self.pool.decoder() as decoder:
+            decoder.start_utt()
+            for offset in range(0, len(content), self.buffer_size):
+                decoder.process_raw(content[offset:offset + self.buffer_size], False, False)
+            decoder.end_utt()
+
+            return self.get_alternatives(decoder)
+
+    def start_utterance(self):
+        """
+        Starts streaming recognition, audio data is passed with feed().
+        Holds a decoder of the pool until finish(). Called while audio is
+        captured, so it doesn't wait long for a busy decoder: the phrase
+        is decoded by transcribe() after recording then.
+        """
+        try:
+            self.decoder = self.pool.checkout(timeout=self.config['checkout_timeout'])
+        except queue.Empty:
+            raise RuntimeError('No free decoder, the phrase is decoded after recording')
         self.decoder.start_utt()
-        stream = BytesIO(content)
-        while True:
-            buf = stream.read(self.buffer_size)
-            if buf:
-                self.decoder.process_raw(buf, False, False)
-            else:
-                break
-        self.decoder.end_utt()
-        self.decoder.get_in_speech()
-        # Collect alternatives and confidence scores.
+
+    def feed(self, chunk):
+        """
+        Decodes next chunk of audio data while the utterance goes on.
+        """
+        self.decoder.process_raw(chunk, False, False)
+
+    def get_partial(self):
+        """
+        Hypothesis for audio data fed so far.
+        :return: alternatives marked as partial
+        """
         hypothesis = self.decoder.hyp()
+        if hypothesis is None:
+            return []
+
+        # Posterior probability is calculated only when the utterance ends.
+        return [{
+            'service_name': self.config['service_name'],
+            'confidence': 0,
+            'transcript': hypothesis.hypstr,
+            'partial': True
+        }]
+
+    def finish(self):
+        """
+        Ends streaming recognition.
+        :return: alternatives
+        """
+        decoder, self.decoder = self.decoder, None
+        try:
+            decoder.end_utt()
+            return self.get_alternatives(decoder)
+        finally:
+            self.pool.checkin(decoder)
+
+    def get_alternatives(self, decoder):
+        decoder.get_in_speech()
+        # Collect alternatives and confidence scores.
+        hypothesis = decoder.hyp()
+        if hypothesis is None:
+            return []
+        if self.config['filter_unknown'] and hypothesis.hypstr not in self.known_alternatives:
+            return []
+
         alternatives = [{
             'service_name': self.config['service_name'],
-            'confidence': self.get_confidence(hypothesis),
+            'confidence': self.get_confidence(decoder, hypothesis),
             'transcript': hypothesis.hypstr
         }]
 
         return alternatives
 
-    def get_confidence(self, hypothesis):
+    def get_confidence(self, decoder, hypothesis):
         if self.confidence_strategy == 'default':
-            return self.get_confidence_default(hypothesis)
+            return self.get_confidence_default(decoder, hypothesis)
         elif self.confidence_strategy == 'by_word':
-            return self.get_confidence_by_word(hypothesis)
+            return self.get_confidence_by_word(decoder, hypothesis)
         else:
             return 0
 
-    def get_confidence_default(self, hypothesis):
-        logmath = self.decoder.get_logmath()
+    @staticmethod
+    def get_confidence_default(decoder, hypothesis):
+        logmath = decoder.get_logmath()
         return logmath.exp(hypothesis.prob)
 
-    def get_confidence_by_word(self, hypothesis):
-        logmath = self.decoder.get_logmath()
+    @staticmethod
+    def get_confidence_by_word(decoder, hypothesis):
+        logmath = decoder.get_logmath()
         confidence_sum = 0
         count = 0
-        for seg in self.decoder.seg():
+        for seg in decoder.seg():
             if seg.word in hypothesis.hypstr or seg.word == '<sil>':
                 confidence_sum = confidence_sum + logmath.exp(seg.prob)
                 count = count + 1
@@ -0,0 +1,73 @@
+import threading
+from collections import deque
+
+
+class NoiseFloorTracker:
+    """
+    Online noise floor estimate of VAD values by minimum statistics.
+
+    Values are smoothed exponentially and the floor is the minimum of the
+    smoothed values over the last `window_len` chunks. Speech can't hold
+    the minimum up for long because of pauses, so the floor follows the
+    room noise both ways. The window is split into `subwindow_num` parts,
+    only the minimum of every part is kept, so memory is O(1).
+
+    Threshold is the floor multiplied by `margin`. Methods may be called
+    from several threads.
+    """
+
+    def __init__(self, window_len, margin=1.5, subwindow_num=4, smoothing=0.7):
+        """
+        :param window_len: chunks in the minimum search window
+        :param margin: threshold to floor ratio
+        :param subwindow_num: parts of the window
+        :param smoothing: weight of the previous smoothed value
+        """
+        self.margin = margin
+        self.smoothing = smoothing
+        self.subwindow_len = max(int(window_len // subwindow_num), 1)
+        self._subwindow_mins = deque(maxlen=subwindow_num)
+        self._current_min = None
+        self._current_count = 0
+        self._smoothed = None
+        self._lock = threading.Lock()
+
+    def update(self, value):
+        """
+        Adds VAD estimate of a chunk.
+        """
+        with self._lock:
+            self._update(value)
+
+    def _update(self, value):
+        if self._smoothed is None:
+            self._smoothed = value
+        else:
+            self._smoothed = self.smoothing * self._smoothed + (1 - self.smoothing) * value
+
+        if self._current_min is None or self._smoothed < self._current_min:
+            self._current_min = self._smoothed
+        self._current_count += 1
+
+        if self._current_count >= self.subwindow_len:
+            self._subwindow_mins.append(self._current_min)
+            self._current_min = None
+            self._current_count = 0
+
+    def is_ready(self):
+        """
+        :return: True after the first part of the window is complete
+        """
+        with self._lock:
+            return len(self._subwindow_mins) > 0
+
+    def get_floor(self):
+        with self._lock:
+            mins = list(self._subwindow_mins)
+            if self._current_min is not None:
+                mins.append(self._current_min)
+
+        return min(mins) if mins else 0
+
+    def get_threshold(self):
+        return self.get_floor() * self.margin
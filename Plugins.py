@@ -0,0 +1,82 @@
+import importlib
+
+
+class Registry:
+    """
+    Backends by config name, kept as 'module.Class' paths. A module is
+    imported on the first use of its backend only, so heavy dependencies,
+    e.g. gRPC or PyWavelets, aren't loaded unless the config names them.
+    """
+
+    def __init__(self, kind, paths):
+        """
+        :param kind: what the backends are, for error messages
+        :param paths: dict of backend name to 'module.Class' path
+        """
+        self.kind = kind
+        self._paths = dict(paths)
+        self._classes = {}
+
+    def __contains__(self, name):
+        return name in self._paths
+
+    def register(self, name, path):
+        """
+        Adds a backend or replaces a built-in one.
+        :param path: 'module.Class' path or the class itself
+        """
+        self._paths[name] = path
+        self._classes.pop(name, None)
+
+    def get_names(self):
+        return sorted(self._paths)
+
+    def is_loaded(self, name):
+        return name in self._classes
+
+    def get(self, name):
+        """
+        Imports the backend module if it isn't imported yet.
+        :return: backend class
+        """
+        if name not in self._classes:
+            if name not in self._paths:
+                raise KeyError('Unknown {}: {}'.format(self.kind, name))
+            self._classes[name] = load_class(self._paths[name])
+
+        return self._classes[name]
+
+    def create(self, name, *args, **kwargs):
+        return self.get(name)(*args, **kwargs)
+
+
+def load_class(path):
+    """
+    :param path: 'module.Class' path or the class itself
+    :return: class
+    """
+    if not isinstance(path, str):
+        return path
+    module_name, class_name = path.rsplit('.', 1)
+
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+# Speech recognition services by `service_name`.
+SERVICES = Registry('service', {
+    'pocketsphinx': 'MyPocketSphinx.MyPocketSphinx',
+    'google': 'GoogleCloudSpeechAPI.GoogleCloudSpeechAPI',
+})
+
+# VAD by recorder `vad`.
+VADS = Registry('VAD', {
+    'default': 'SimpleVAD.SimpleVAD',
+    'wavelet': 'WaveletVAD.WaveletVAD',
+})
+
+# Upload encoders of cloud services by `upload_encoding`.
+ENCODERS = Registry('encoder', {
+    'LINEAR16': 'AudioEncoder.LinearEncoder',
+    'FLAC': 'AudioEncoder.FlacEncoder',
+    'MULAW': 'AudioEncoder.MulawEncoder',
+})
@@ -0,0 +1,311 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from six.moves import queue
+
+from Tracing import NULL_TRACE
+
+# Deadlines must not jump with the wall clock.
+clock = getattr(time, 'monotonic', time.time)
+
+
+class RecognitionDispatcher:
+    """
+    Runs speech recognition services concurrently on the same content.
+
+    Local services are always started at once. Cloud services are started
+    either when local confidence is below the threshold or, in speculative
+    mode, together with local services. Speculative cloud requests are
+    abandoned as soon as local confidence clears the threshold.
+
+    Every service may have its own timeout, and the whole dispatch may
+    have a deadline. Results which are not ready in time are dropped.
+    Services with cancel() method are cancelled when dropped.
+    A service is never run by two threads at once: a timed out call
+    still holds its service until it returns, and the service is skipped
+    by dispatches meanwhile instead of taking a worker to wait for it.
+
+    Escalation policy may forbid cloud requests, e.g. over budget or when
+    the cloud is failing, then local results are returned. Outcomes of
+    cloud requests are reported to the policy.
+
+    dispatch_async() runs dispatch in a background worker, so the caller
+    doesn't wait for the cloud.
+    """
+
+    def __init__(self, confidence_threshold, deadline=None, speculative_cloud=False, max_workers=None,
+                 policy=None, queue_size=4):
+        """
+        :param policy: EscalationPolicy or None to always allow cloud
+        :param queue_size: phrases waiting for dispatch_async(), phrases over
+                           it are recognized at once by local services only
+        """
+        self.confidence_threshold = confidence_threshold
+        self.deadline = deadline
+        self.speculative_cloud = speculative_cloud
+        self.max_workers = max_workers
+        self.policy = policy
+        self.local_services = []
+        self.cloud_services = []
+        self._executor = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Phrases of dispatch_async() queued or running.
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._worker = None
+
+    def add_service(self, service, is_local, timeout=None):
+        """
+        Registers a service with transcribe(content) method.
+        :param service: recognition service
+        :param is_local: whether the service runs locally
+        :param timeout: seconds to wait for the service result, None to wait until deadline
+        """
+        entry = {
+            'service': service,
+            'timeout': timeout,
+            'lock': threading.Lock(),
+        }
+        if is_local:
+            self.local_services.append(entry)
+        else:
+            self.cloud_services.append(entry)
+        # Pool size depends on services count, recreate it on next dispatch.
+        self.shutdown()
+
+    def get_executor(self):
+        if self._executor is None:
+            max_workers = self.max_workers or max(len(self.local_services) + len(self.cloud_services), 1)
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        return self._executor
+
+    def shutdown(self):
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def dispatch_async(self, content, callback, results=None, trace=NULL_TRACE):
+        """
+        Queues content for dispatch() in the background worker.
+        :param callback: called with merged alternatives from the worker thread
+        """
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._work)
+            self._worker.daemon = True
+            self._worker.start()
+
+        self._add_in_flight(1)
+        try:
+            self._queue.put_nowait((content, callback, results, trace))
+        except queue.Full:
+            self._add_in_flight(-1)
+            print('Dispatch queue is full, using local services only')
+            callback(self.dispatch(content, results, allow_cloud=False, trace=trace))
+
+    def is_busy(self):
+        """
+        :return: True while dispatch_async() phrases are queued or running
+        """
+        with self._in_flight_lock:
+            return self._in_flight > 0
+
+    def _add_in_flight(self, count):
+        with self._in_flight_lock:
+            self._in_flight += count
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                content, callback, results, trace = job
+                callback(self.dispatch(content, results, trace=trace))
+            except Exception as e:
+                print('Dispatch failed: {}'.format(e))
+            finally:
+                self._add_in_flight(-1)
+
+    def dispatch(self, content, results=None, allow_cloud=True, trace=NULL_TRACE):
+        """
+        Recognizes content with all services.
+        :param content: audio data
+        :param results: dict of service to alternatives already recognized,
+                        e.g. by streaming, such services are not run again
+        :param allow_cloud: False to use local services only
+        :param trace: Trace to add recognizer and merge spans to
+        :return: merged alternatives sorted by confidence
+        """
+        trace.event('dispatch')
+        start_time = clock()
+        deadline = start_time + self.deadline if self.deadline is not None else None
+        results = results or {}
+
+        local_alternatives = []
+        cloud_alternatives = []
+        for entry in self.local_services:
+            local_alternatives += results.get(entry['service'], [])
+        for entry in self.cloud_services:
+            cloud_alternatives += results.get(entry['service'], [])
+
+        local_entries = [entry for entry in self.local_services if entry['service'] not in results]
+        cloud_entries = [entry for entry in self.cloud_services if entry['service'] not in results]
+        if not allow_cloud:
+            cloud_entries = []
+
+        pending = {}
+        self._submit(pending, local_entries, True, content, start_time, deadline, trace)
+        cloud_started = False
+        if self.speculative_cloud:
+            if self._escalate(cloud_entries, content):
+                self._submit(pending, cloud_entries, False, content, start_time, deadline, trace)
+            cloud_started = True
+
+        while True:
+            if not any(task['is_local'] for task in pending.values()):
+                # All local results are in, decide on cloud.
+                local_confident = self.get_max_confidence(local_alternatives) >= self.confidence_threshold
+                if cloud_started and local_confident:
+                    self._cancel(pending)
+                elif not cloud_started and not local_confident:
+                    if self._escalate(cloud_entries, content):
+                        self._submit(pending, cloud_entries, False, content, clock(), deadline, trace)
+                    cloud_started = True
+
+            if not pending:
+                break
+            self._collect(pending, local_alternatives, cloud_alternatives)
+
+        # Merge all results.
+        with trace.span('merge'):
+            result = cloud_alternatives + local_alternatives
+            return sorted(result, key=lambda k: k['confidence'], reverse=True)
+
+    def may_escalate(self):
+        """
+        :return: True if the policy lets cloud requests through now, e.g.
+                 to decide on speculative uploads while a phrase is recorded
+        """
+        return self.policy is None or self.policy.is_allowed()
+
+    def _escalate(self, cloud_entries, content):
+        """
+        :return: True if cloud services may be started
+        """
+        if not cloud_entries:
+            return False
+        if self.policy is None or self.policy.acquire(self.get_upload_size(cloud_entries, content)):
+            return True
+
+        if self.speculative_cloud:
+            # Phrases uploaded while recorded aren't collected, drop their streams.
+            for entry in cloud_entries:
+                if hasattr(entry['service'], 'cancel'):
+                    entry['service'].cancel()
+        return False
+
+    @staticmethod
+    def get_upload_size(cloud_entries, content):
+        """
+        :return: bytes sent by cloud services, encoded size for services
+                 which estimate it
+        """
+        size = 0
+        for entry in cloud_entries:
+            service = entry['service']
+            size += service.get_upload_size(len(content)) if hasattr(service, 'get_upload_size') else len(content)
+
+        return size
+
+    def _submit(self, pending, entries, is_local, content, start_time, deadline, trace):
+        executor = self.get_executor()
+        for entry in entries:
+            # Released by _transcribe() or when the task is cancelled before it runs.
+            if not entry['lock'].acquire(False):
+                print('Service {} is still busy, skipping'.format(entry['service'].config['service_name']))
+                continue
+            task_deadline = deadline
+            if entry['timeout'] is not None:
+                task_deadline = start_time + entry['timeout'] if deadline is None \
+                    else min(deadline, start_time + entry['timeout'])
+            future = executor.submit(self._transcribe, entry, content, trace)
+            pending[future] = {'entry': entry, 'is_local': is_local, 'deadline': task_deadline,
+                               'start_time': start_time}
+
+    @staticmethod
+    def _transcribe(entry, content, trace):
+        try:
+            with trace.span('recognize.' + entry['service'].config['service_name']):
+                return entry['service'].transcribe(content)
+        finally:
+            entry['lock'].release()
+
+    def _collect(self, pending, local_alternatives, cloud_alternatives):
+        """
+        Waits for the next finished task or the nearest deadline.
+        """
+        deadlines = [task['deadline'] for task in pending.values() if task['deadline'] is not None]
+        timeout = max(min(deadlines) - clock(), 0) if deadlines else None
+        done, _ = wait(list(pending.keys()), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            task = pending.pop(future)
+            service_name = task['entry']['service'].config['service_name']
+            try:
+                alternatives = future.result()
+            except Exception as e:
+                print('Service {} failed: {}'.format(service_name, e))
+                self._record(task, success=False)
+                continue
+            if task['is_local']:
+                local_alternatives += alternatives
+            else:
+                cloud_alternatives += alternatives
+                self._record(task, success=True)
+
+        now = clock()
+        for future, task in list(pending.items()):
+            if task['deadline'] is not None and now >= task['deadline']:
+                print('Service {} timed out'.format(task['entry']['service'].config['service_name']))
+                self._cancel_task(future, task)
+                self._record(task, success=False)
+                del pending[future]
+
+    def _cancel(self, pending):
+        for future, task in pending.items():
+            self._cancel_task(future, task)
+            self._record(task, success=None)
+        pending.clear()
+
+    def _record(self, task, success):
+        # Only cloud outcomes matter for escalation.
+        if self.policy is None or task['is_local']:
+            return
+        self.policy.record(clock() - task['start_time'], success)
+
+    @staticmethod
+    def _cancel_task(future, task):
+        if future.cancel():
+            # Never started, so it doesn't hold the service.
+            task['entry']['lock'].release()
+            return
+        # Running calls are cancelled by services which support it,
+        # results of other ones are abandoned.
+        service = task['entry']['service']
+        if hasattr(service, 'cancel'):
+            service.cancel()
+
+    @staticmethod
+    def get_max_confidence(alternatives):
+        max_confidence = 0
+        for alt in alternatives:
+            if alt['confidence'] > max_confidence:
+                max_confidence = alt['confidence']
+
+        return max_confidence
@@ -0,0 +1,378 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+import yaml
+from six.moves import socketserver
+
+from CommandRecognition import CommandRecognition
+from NoiseFloorTracker import NoiseFloorTracker
+from SpeechSegmenter import SpeechSegmenter
+from VoiceRecord import VoiceRecord
+from snowboy import snowboydecoder, snowboydetect
+
+# Snowboy models work with 16 kHz 16-bit mono audio, so do all streams.
+RATE = 16000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+FRAMES_PER_BUFFER = 2048
+
+
+class StreamSession:
+    """
+    Recognition state of one audio stream: own hotword detector, VAD and
+    phrase segmenter. Chunks are processed in order by one pool worker at
+    a time, decoding of phrases is scheduled to the decode pool. When
+    `queue_size` chunks wait for processing, push() blocks, so the
+    connection isn't read and a client sending too fast is slowed down.
+    """
+
+    def __init__(self, server, send):
+        """
+        :param server: RecognitionServer
+        :param send: function to send a message dict to the client
+        """
+        self.server = server
+        self.send = send
+        recorder = server.config['recorder']
+        self.vad = VoiceRecord.init_vad(recorder['vad'])
+        self.sensitivity = recorder['sensitivity']
+        self.detector = server.create_hotword_detector()
+        # Without hotword detector every phrase is recognized.
+        self.listening = self.detector is None
+
+        self.segmenter = server.create_segmenter(recorder['threshold'])
+        self.noise_tracker = None
+        if recorder['adaptive_threshold']:
+            self.noise_tracker = NoiseFloorTracker(int(recorder['noise_window'] * RATE / FRAMES_PER_BUFFER),
+                                                   margin=recorder['noise_margin'])
+
+        self._chunks = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._scheduled = False
+        self._idle = threading.Event()
+        self._idle.set()
+        # Decodes in progress, done ones are removed.
+        self._decodes = set()
+
+    def push(self, chunk):
+        """
+        Queues a chunk and schedules processing if it's not running, waits
+        while the queue is full.
+        """
+        with self._lock:
+            while len(self._chunks) >= self.server.queue_size:
+                self._not_full.wait()
+            self._chunks.append(chunk)
+            if self._scheduled:
+                return
+            self._scheduled = True
+            self._idle.clear()
+        self.server.executor.submit(self._run)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._chunks:
+                    self._scheduled = False
+                    self._idle.set()
+                    return
+                chunk = self._chunks.popleft()
+                self._not_full.notify()
+            try:
+                self.process(chunk)
+            except Exception as e:
+                print('Stream processing failed: {}'.format(e))
+
+    def process(self, chunk):
+        if not self.listening:
+            ans = self.detector.RunDetection(chunk)
+            if ans > 0:
+                self.listening = True
+                self.segmenter.reset(self.get_threshold())
+                self.send({'type': 'hotword', 'index': ans})
+            elif ans in (0, -2) and self.noise_tracker is not None:
+                self.noise_tracker.update(self.get_estimate(chunk))
+            return
+
+        estimate = self.get_estimate(chunk)
+        event = self.segmenter.push(estimate, chunk)
+        if event == SpeechSegmenter.END:
+            self.decode(self.segmenter.get_phrase())
+            self.stop_listening()
+        elif event == SpeechSegmenter.STOP:
+            self.stop_listening()
+        elif event == SpeechSegmenter.SILENCE and self.noise_tracker is not None:
+            self.noise_tracker.update(estimate)
+            self.segmenter.threshold = self.get_threshold()
+
+    def get_estimate(self, chunk):
+        if not self.vad:
+            return 1
+        return self.vad.estimate(numpy.frombuffer(chunk, dtype=numpy.int16)) * self.sensitivity
+
+    def get_threshold(self):
+        if self.noise_tracker is not None and self.noise_tracker.is_ready():
+            return self.noise_tracker.get_threshold()
+
+        return self.server.config['recorder']['threshold']
+
+    def stop_listening(self):
+        self.segmenter.reset(self.get_threshold())
+        if self.detector is not None:
+            self.listening = False
+
+    def decode(self, phrase):
+        future = self.server.decode_executor.submit(self._decode, phrase)
+        with self._lock:
+            self._decodes.add(future)
+        future.add_done_callback(self._on_decoded)
+
+    def _on_decoded(self, future):
+        with self._lock:
+            self._decodes.discard(future)
+
+    def _decode(self, phrase):
+        alternatives = self.server.transcribe(phrase)
+        self.send({'type': 'result', 'alternatives': alternatives})
+
+    def close(self):
+        """
+        Waits for queued chunks and decoding, recognizes unfinished phrase.
+        """
+        self._idle.wait()
+        if self.listening and self.segmenter.started:
+            self.decode(self.segmenter.get_phrase())
+        with self._lock:
+            decodes = list(self._decodes)
+        for future in decodes:
+            future.result()
+
+
+class RecognitionServer:
+    """
+    Serves many concurrent audio streams in one process.
+
+    Each connection sends a JSON header line with `rate`, `channels` and
+    `sample_width` of its audio, then raw PCM data until it shuts down
+    writing. The server answers with JSON lines of `hotword` and `result`
+    messages and the `end` message after the last result.
+
+    Hotword detection and VAD of all streams run on one bounded worker
+    pool. Phrases are decoded on a separate pool of `decoders` threads, so
+    decoding doesn't hold workers of live streams. Local recognition
+    services are loaded once and shared by all streams: PocketSphinx keeps
+    `decoders` decoders in its pool, services which aren't thread safe
+    decode one phrase at a time. Cloud services are not used in server
+    mode.
+    """
+
+    def __init__(self, config, workers=4, decoders=None, queue_size=64):
+        """
+        :param config: recognition config, see recognition.config.yml
+        :param workers: threads in the worker pool
+        :param decoders: phrases decoded at once, `workers` by default
+        :param queue_size: chunks of a stream waiting for processing
+        """
+        self.config = config
+        self.audio_config = {
+            'format': None,
+            'channels': CHANNELS,
+            'rate': RATE,
+            'frames_per_buffer': FRAMES_PER_BUFFER,
+            'encoding': VoiceRecord.ENCODING,
+        }
+        self.config['recorder']['audio'] = self.audio_config
+        VoiceRecord._validate_config(self.config['recorder'])
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+        self.decoders = decoders or workers
+        self.decode_executor = ThreadPoolExecutor(max_workers=self.decoders)
+        self.services = self.create_services()
+        self._server = None
+
+    def create_services(self):
+        """
+        :return: list of local services and locks of the ones which aren't thread safe
+        """
+        services = []
+        for service_config in self.config.get('services', []):
+            if not service_config.get('local'):
+                continue
+            # A decoder of the pool for every decode thread.
+            service_config = dict(service_config, audio=self.audio_config, pool_size=self.decoders)
+            service = CommandRecognition.init_service(service_config)
+            if service:
+                lock = None if getattr(service, 'thread_safe', False) else threading.Lock()
+                services.append((service, lock))
+
+        return services
+
+    def create_hotword_detector(self):
+        if 'hotword_detector' not in self.config:
+            return None
+        hotword_config = self.config['hotword_detector']
+        detector = snowboydetect.SnowboyDetect(
+            resource_filename=snowboydecoder.RESOURCE_FILE.encode(),
+            model_str=hotword_config['model'].encode())
+        detector.SetSensitivity(str(hotword_config['sensitivity']).encode())
+
+        return detector
+
+    @staticmethod
+    def create_segmenter(threshold):
+        rel = int(RATE / FRAMES_PER_BUFFER)
+        return SpeechSegmenter(threshold,
+                               window_len=int(VoiceRecord.SILENCE_LIMIT * rel),
+                               prev_len=int(VoiceRecord.PREV_AUDIO * rel),
+                               silence_stop_len=int(VoiceRecord.SILENCE_STOP_LIMIT * rel),
+                               recording_stop_len=int(VoiceRecord.RECORDING_STOP_LIMIT * rel))
+
+    def transcribe(self, content):
+        """
+        Recognizes content with all local services.
+        :return: alternatives sorted by confidence
+        """
+        alternatives = []
+        for service, lock in self.services:
+            if lock is None:
+                alternatives += service.transcribe(content)
+                continue
+            with lock:
+                alternatives += service.transcribe(content)
+
+        return sorted(alternatives, key=lambda k: k['confidence'], reverse=True)
+
+    def handle(self, connection):
+        """
+        Serves one connection until the client stops sending.
+        """
+        reader = connection.makefile('rb')
+        header = json.loads(reader.readline().decode('utf-8'))
+        send_lock = threading.Lock()
+
+        def send(message):
+            data = (json.dumps(message) + '\n').encode('utf-8')
+            with send_lock:
+                connection.sendall(data)
+
+        if header.get('rate') != RATE or header.get('channels') != CHANNELS \
+                or header.get('sample_width') != SAMPLE_WIDTH:
+            send({'type': 'error', 'message': 'Audio must be {} Hz, {} channel, {} bytes per sample'.format(
+                RATE, CHANNELS, SAMPLE_WIDTH)})
+            return
+
+        session = StreamSession(self, send)
+        chunk_size = FRAMES_PER_BUFFER * CHANNELS * SAMPLE_WIDTH
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            if len(chunk) < chunk_size:
+                chunk += b'\x00' * (chunk_size - len(chunk))
+            session.push(chunk)
+        session.close()
+        send({'type': 'end'})
+
+    def serve(self, host='localhost', port=0, unix_socket=None):
+        """
+        Starts serving in a background thread.
+        :return: listened address
+        """
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                server.handle(self.request)
+
+        if unix_socket:
+            self._server = socketserver.ThreadingUnixStreamServer(unix_socket, Handler)
+        else:
+            self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return self._server.server_address
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.executor.shutdown()
+        self.decode_executor.shutdown()
+
+
+class RecognitionClient:
+    """
+    Streams audio to RecognitionServer and collects its messages.
+    """
+
+    def __init__(self, address):
+        """
+        :param address: (host, port) tuple or unix socket path
+        """
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.connect(address)
+        self.connection.sendall((json.dumps({
+            'rate': RATE, 'channels': CHANNELS, 'sample_width': SAMPLE_WIDTH
+        }) + '\n').encode('utf-8'))
+        self._reader = self.connection.makefile('rb')
+
+    def send(self, data):
+        self.connection.sendall(data)
+
+    def finish(self):
+        """
+        Stops sending audio.
+        """
+        self.connection.shutdown(socket.SHUT_WR)
+
+    def receive(self):
+        """
+        :return: next message dict or None when the connection is closed
+        """
+        line = self._reader.readline()
+        return json.loads(line.decode('utf-8')) if line else None
+
+    def close(self):
+        self._reader.close()
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-stream recognition server.')
+    parser.add_argument('--config', default='./recognition.config.yml')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--unix-socket', default=None)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--decoders', type=int, default=None)
+    parser.add_argument('--queue-size', type=int, default=64, help='chunks of a stream waiting for processing')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as stream:
+        config = yaml.safe_load(stream)
+
+    server = RecognitionServer(config, workers=args.workers, decoders=args.decoders, queue_size=args.queue_size)
+    address = server.serve(args.host, args.port, args.unix_socket)
+    print('Listening on {}'.format(address))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
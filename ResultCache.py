@@ -0,0 +1,238 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of recognition results with expiration, keyed by an
+    acoustic fingerprint of audio data.
+
+    The fingerprint is a quantized spectrogram: energies of FFT frames in
+    logarithmic bands, with silence around the phrase trimmed, averaged
+    to a fixed time grid, in dB relative to the loudest cell. It doesn't
+    depend on gain and phrase duration, so the same command recorded
+    again gives a close fingerprint. A lookup matches the closest entry
+    with mean level difference within `tolerance` and similar duration.
+
+    Entries are optionally stored to a JSON file and loaded on start, so
+    they survive restarts. The file is written by a timer thread
+    `save_delay` seconds after a change, many changes in a row are saved
+    at once, and by close().
+    """
+    FRAME_LEN = 512
+    HOP_LEN = 256
+    BANDS = 16
+    STEPS = 32
+    # Frames quieter than the loudest one by this ratio are trimmed.
+    SILENCE_RATIO = 1e-3
+    # Levels in dB of the fingerprint.
+    DYNAMIC_RANGE = 40
+    LEVEL_STEP = 2
+    # Max relative difference of content lengths of matching entries.
+    LENGTH_TOLERANCE = 0.3
+
+    def __init__(self, max_size=256, ttl=3600, tolerance=2.0, path=None, save_delay=5.0):
+        """
+        :param max_size: max count of entries, least recently used are evicted
+        :param ttl: seconds an entry lives, None for no expiration
+        :param tolerance: max mean level difference in dB, 0 for exact match only
+        :param path: JSON file to store entries to
+        :param save_delay: seconds from a change to saving the file
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.tolerance = tolerance
+        self.path = path
+        self.save_delay = save_delay
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Serializes writers of the file, entries are copied under _lock.
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._dirty = False
+        self._window = numpy.hanning(self.FRAME_LEN)
+        # Band start edges in FFT bins.
+        self._band_edges = numpy.geomspace(4, self.FRAME_LEN // 2 + 1, self.BANDS + 1).astype(int)[:-1]
+
+        if self.path is not None and os.path.exists(self.path):
+            self.load()
+
+    def fingerprint(self, content):
+        """
+        :param content: 16-bit audio data
+        :return: fingerprint bytes
+        """
+        samples = numpy.frombuffer(content, dtype=numpy.int16).astype(numpy.float64)
+        if len(samples) < self.FRAME_LEN:
+            samples = numpy.pad(samples, (0, self.FRAME_LEN - len(samples)), 'constant')
+
+        frame_num = (len(samples) - self.FRAME_LEN) // self.HOP_LEN + 1
+        indexes = numpy.arange(self.FRAME_LEN)[None, :] + self.HOP_LEN * numpy.arange(frame_num)[:, None]
+        spectrum = numpy.abs(numpy.fft.rfft(samples[indexes] * self._window, axis=1)) ** 2
+        energies = numpy.add.reduceat(spectrum, self._band_edges, axis=1)
+
+        # Silence around the phrase varies between recordings, trim frames
+        # far below the loudest one.
+        loudness = energies.sum(axis=1)
+        loud = numpy.nonzero(loudness >= loudness.max() * self.SILENCE_RATIO)[0]
+        energies = energies[loud[0]:loud[-1] + 1]
+
+        # Average to a fixed grid of STEPS cells in time.
+        frame_num = len(energies)
+        bounds = numpy.linspace(0, frame_num, self.STEPS + 1)
+        starts = numpy.minimum(bounds[:-1].astype(int), frame_num - 1)
+        ends = numpy.maximum(bounds[1:].astype(int), starts + 1)
+        sums = numpy.concatenate([numpy.zeros((1, energies.shape[1])), numpy.cumsum(energies, axis=0)])
+        grid = 10 * numpy.log10((sums[ends] - sums[starts]) / (ends - starts)[:, None] + 1e-10)
+
+        # Levels relative to the loudest cell don't depend on gain, bands
+        # under the dynamic range, e.g. with noise only, are equal.
+        grid = numpy.maximum(grid - grid.max(), -self.DYNAMIC_RANGE)
+
+        return numpy.round(grid / self.LEVEL_STEP).astype(numpy.int8).tobytes()
+
+    def get(self, content):
+        """
+        :return: cached alternatives marked with 'cached' key or None
+        """
+        key = self.fingerprint(content)
+        with self._lock:
+            self._expire()
+            if key not in self._entries:
+                key = self._find_similar(key, len(content))
+            if key is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            # Move to the end as recently used, move_to_end() is missing in Python 2.
+            self._entries[key] = self._entries.pop(key)
+            alternatives = self._entries[key]['alternatives']
+
+        return [dict(alternative, cached=True) for alternative in alternatives]
+
+    def put(self, content, alternatives):
+        """
+        Stores alternatives of the content.
+        """
+        key = self.fingerprint(content)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                'length': len(content),
+                'time': time.time(),
+                'alternatives': [dict((name, value) for name, value in alternative.items() if name != 'cached')
+                                 for alternative in alternatives],
+            }
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._schedule_save()
+
+    def _find_similar(self, key, length):
+        if not self.tolerance or not self._entries:
+            return None
+
+        keys = list(self._entries.keys())
+        fingerprints = numpy.frombuffer(b''.join(keys), dtype=numpy.int8).reshape(len(keys), -1)
+        levels = numpy.frombuffer(key, dtype=numpy.int8)
+        distances = numpy.abs(fingerprints.astype(numpy.int16) - levels).mean(axis=1) * self.LEVEL_STEP
+        for i in numpy.argsort(distances):
+            if distances[i] > self.tolerance:
+                break
+            entry_length = self._entries[keys[i]]['length']
+            if abs(entry_length - length) <= self.LENGTH_TOLERANCE * max(entry_length, length):
+                return keys[i]
+
+        return None
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        expired_time = time.time() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry['time'] < expired_time]:
+            del self._entries[key]
+
+    def get_stats(self):
+        """
+        :return: dict of hits, misses, hit rate and size
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / total if total else 0.0,
+                'size': len(self._entries),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._schedule_save()
+
+    def _schedule_save(self):
+        # Called with _lock held, the recognition thread doesn't wait for the disk.
+        if self.path is None:
+            return
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self._save_later)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_later(self):
+        with self._lock:
+            self._save_timer = None
+        try:
+            self.save()
+        except (IOError, OSError) as e:
+            print('Result cache save failed: {}'.format(e))
+
+    def save(self):
+        with self._lock:
+            self._dirty = False
+            entries = [dict(entry, fingerprint=key.hex() if hasattr(key, 'hex') else key.encode('hex'))
+                       for key, entry in self._entries.items()]
+
+        # Write and rename, so a crash never leaves a broken file.
+        with self._save_lock:
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w') as stream:
+                json.dump(entries, stream)
+            os.rename(temp_path, self.path)
+
+    def close(self):
+        """
+        Saves pending changes, call it on shutdown.
+        """
+        with self._lock:
+            timer = self._save_timer
+            self._save_timer = None
+            dirty = self._dirty
+        if timer is not None:
+            timer.cancel()
+        if dirty:
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as stream:
+                entries = json.load(stream)
+        except ValueError as e:
+            print('Result cache {} is broken, starting empty: {}'.format(self.path, e))
+            return
+
+        with self._lock:
+            for entry in entries:
+                key = bytes(bytearray.fromhex(entry.pop('fingerprint')))
+                self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._expire()
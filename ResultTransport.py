@@ -0,0 +1,243 @@
+import json
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+
+class ResultMessage:
+    """
+    Recognition result or partial hypothesis sent to subscribers.
+
+    Binary layout, network byte order: version, kind, timestamp and count
+    of alternatives, then for each alternative confidence, flags,
+    service name and transcript as UTF-8 with 32-bit length prefix.
+    Optional trace of the phrase follows as length-prefixed JSON.
+    """
+    VERSION = 2
+    RESULT = 1
+    PARTIAL = 2
+
+    # Flags of an alternative.
+    FLAG_PARTIAL = 1
+    FLAG_CACHED = 2
+
+    _header = struct.Struct('!BBdH')
+    _alternative = struct.Struct('!dB')
+    _length = struct.Struct('!I')
+
+    def __init__(self, kind, alternatives, timestamp=None, trace=None):
+        """
+        :param kind: RESULT or PARTIAL
+        :param alternatives: list of alternative dicts
+        :param timestamp: publish time, now by default
+        :param trace: dict of trace events and spans, see Tracing.Trace
+        """
+        self.kind = kind
+        self.alternatives = alternatives
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.trace = trace
+
+    def encode(self):
+        parts = [self._header.pack(self.VERSION, self.kind, self.timestamp, len(self.alternatives))]
+        for alternative in self.alternatives:
+            flags = (self.FLAG_PARTIAL if alternative.get('partial') else 0) | \
+                    (self.FLAG_CACHED if alternative.get('cached') else 0)
+            service_name = self._to_bytes(alternative['service_name'])
+            transcript = self._to_bytes(alternative['transcript'])
+            parts += [self._alternative.pack(alternative['confidence'], flags),
+                      self._length.pack(len(service_name)), service_name,
+                      self._length.pack(len(transcript)), transcript]
+        if self.trace is not None:
+            trace = json.dumps(self.trace).encode('utf-8')
+            parts += [self._length.pack(len(trace)), trace]
+
+        return b''.join(parts)
+
+    @classmethod
+    def decode(cls, data):
+        version, kind, timestamp, count = cls._header.unpack_from(data, 0)
+        if version != cls.VERSION:
+            raise ValueError('Unknown result message version', version)
+        offset = cls._header.size
+
+        alternatives = []
+        for _ in range(count):
+            confidence, flags = cls._alternative.unpack_from(data, offset)
+            offset += cls._alternative.size
+            service_name, offset = cls._unpack_text(data, offset)
+            transcript, offset = cls._unpack_text(data, offset)
+
+            alternative = {'service_name': service_name, 'confidence': confidence, 'transcript': transcript}
+            if flags & cls.FLAG_PARTIAL:
+                alternative['partial'] = True
+            if flags & cls.FLAG_CACHED:
+                alternative['cached'] = True
+            alternatives.append(alternative)
+
+        trace = None
+        if offset < len(data):
+            trace, offset = cls._unpack_text(data, offset)
+            trace = json.loads(trace)
+
+        return cls(kind, alternatives, timestamp, trace)
+
+    @classmethod
+    def _unpack_text(cls, data, offset):
+        """
+        :return: length-prefixed UTF-8 text at `offset` and offset after it
+        """
+        size, = cls._length.unpack_from(data, offset)
+        start = offset + cls._length.size
+
+        return data[start:start + size].decode('utf-8'), start + size
+
+    @staticmethod
+    def _to_bytes(text):
+        return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+class ResultPublisher:
+    """
+    Sends result messages to every connected subscriber over a Unix socket
+    as length-prefixed frames. A subscriber which doesn't read for
+    `send_timeout` seconds is dropped, so it can't stall recognition.
+    """
+    _length = struct.Struct('!I')
+
+    def __init__(self, path, send_timeout=1.0):
+        """
+        :param path: Unix socket path, an old socket file is replaced
+        :param send_timeout: seconds to wait for a slow subscriber
+        """
+        self.path = path
+        self.send_timeout = send_timeout
+        if os.path.exists(path):
+            os.remove(path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(path)
+        self._socket.listen(8)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._accept_thread = threading.Thread(target=self._accept)
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except (socket.error, OSError):
+                # Closed.
+                return
+            connection.settimeout(self.send_timeout)
+            with self._lock:
+                self._subscribers.append(connection)
+
+    def get_subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, message):
+        """
+        :param message: ResultMessage
+        """
+        payload = message.encode()
+        frame = self._length.pack(len(payload)) + payload
+        with self._lock:
+            for connection in list(self._subscribers):
+                try:
+                    connection.sendall(frame)
+                except (socket.error, socket.timeout) as e:
+                    print('Dropping result subscriber: {}'.format(e))
+                    self._subscribers.remove(connection)
+                    connection.close()
+
+    def close(self):
+        try:
+            # Wakes up the blocked accept().
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except (socket.error, OSError):
+            pass
+        self._socket.close()
+        with self._lock:
+            for connection in self._subscribers:
+                connection.close()
+            self._subscribers = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ResultSubscriber:
+    """
+    Receives result messages of ResultPublisher.
+
+    receive() waits with a timeout, receive_nowait() doesn't wait at all.
+    fileno() gets readable when a message arrives, so the subscriber can be
+    watched with select(), asyncio loop.add_reader() or QSocketNotifier.
+    """
+
+    def __init__(self, path, connect_timeout=10.0):
+        """
+        :param path: Unix socket path of the publisher
+        :param connect_timeout: seconds to wait for the publisher to start
+        """
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        deadline = time.time() + connect_timeout
+        while True:
+            try:
+                self._socket.connect(path)
+                break
+            except (socket.error, OSError):
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.05)
+        self._buffer = bytearray()
+        self._closed = False
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def receive(self, timeout=None):
+        """
+        :param timeout: seconds to wait, None to wait forever
+        :return: ResultMessage or None if nothing came in time
+        :raises EOFError: the publisher is closed
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            message = self._pop_message()
+            if message is not None:
+                return message
+            if self._closed:
+                raise EOFError('Result publisher is closed')
+
+            wait_time = max(deadline - time.time(), 0) if deadline is not None else None
+            readable, _, _ = select.select([self._socket], [], [], wait_time)
+            if not readable:
+                return None
+            data = self._socket.recv(65536)
+            if not data:
+                self._closed = True
+            self._buffer += data
+
+    def receive_nowait(self):
+        return self.receive(0)
+
+    def _pop_message(self):
+        length_size = ResultPublisher._length.size
+        if len(self._buffer) < length_size:
+            return None
+        length, = ResultPublisher._length.unpack_from(self._buffer, 0)
+        if len(self._buffer) < length_size + length:
+            return None
+
+        message = ResultMessage.decode(bytes(self._buffer[length_size:length_size + length]))
+        del self._buffer[:length_size + length]
+
+        return message
+
+    def close(self):
+        self._socket.close()
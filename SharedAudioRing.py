@@ -0,0 +1,217 @@
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+
+from AudioSource import AudioSource
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Before Python 3.8 anonymous memory is shared with forked processes only.
+    shared_memory = None
+
+
+class SharedAudioRing(AudioSource):
+    """
+    Ring of audio chunks in shared memory, written by a capture process and
+    read by other processes at their own positions, so audio is never
+    pickled between processes. A position is the sequence number of a
+    chunk.
+
+    Every slot keeps the sequence number, capture time and length of its
+    chunk, the last chunk of a replayed source may be short.
+    A reader which lags behind more than the ring length skips the lost
+    chunks, a chunk overwritten while it is copied is detected by its
+    sequence number. The ring is passed to worker processes as a Process
+    argument.
+    """
+    is_live = True
+
+    # Count of written chunks and end of audio flag.
+    _header = struct.Struct('=QQ')
+    # Sequence number, capture time and data length of a slot.
+    _slot = struct.Struct('=QdQ')
+    # Sequence number of a slot being written.
+    _WRITING = 2 ** 64 - 1
+
+    def __init__(self, audio_format, channels, rate, frames_per_buffer=2048, buffer_seconds=30):
+        """
+        :param buffer_seconds: audio kept for lagging readers
+        """
+        AudioSource.__init__(self, audio_format, channels, rate, frames_per_buffer)
+        self.chunk_size = frames_per_buffer * self.frame_size
+        self.slots = max(int(buffer_seconds * rate / frames_per_buffer), 1)
+        self._stride = self._slot.size + self.chunk_size
+        size = self._header.size + self.slots * self._stride
+        if shared_memory is not None:
+            self._memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._memory = mmap.mmap(-1, size)
+        self._owner_pid = os.getpid()
+        self._cond = multiprocessing.Condition()
+        self._buf = self._get_buffer()
+
+    def _get_buffer(self):
+        return self._memory.buf if shared_memory is not None else self._memory
+
+    def __getstate__(self):
+        # Shared memory is attached by name in spawned processes.
+        state = self.__dict__.copy()
+        del state['_buf']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._buf = self._get_buffer()
+
+    def _get_offset(self, position):
+        return self._header.size + (position % self.slots) * self._stride
+
+    def tell(self):
+        """
+        :return: position of the next written chunk
+        """
+        return self._header.unpack_from(self._buf, 0)[0]
+
+    def is_finished(self):
+        return bool(self._header.unpack_from(self._buf, 0)[1])
+
+    def write(self, data, timestamp=None):
+        """
+        Adds a chunk, overwrites the oldest one. Called by one process only.
+        :param data: audio data of frames_per_buffer frames, less at the end of audio
+        :param timestamp: capture time, now by default
+        """
+        assert len(data) <= self.chunk_size, 'chunk is longer than a slot'
+        position = self.tell()
+        offset = self._get_offset(position)
+        self._slot.pack_into(self._buf, offset, self._WRITING, 0, 0)
+        start = offset + self._slot.size
+        self._buf[start:start + len(data)] = data
+        self._slot.pack_into(self._buf, offset, position, time.time() if timestamp is None else timestamp,
+                             len(data))
+        with self._cond:
+            self._header.pack_into(self._buf, 0, position + 1, 0)
+            self._cond.notify_all()
+
+    def finish(self):
+        """
+        Marks the end of audio, readers get empty data after the last chunk.
+        """
+        with self._cond:
+            self._header.pack_into(self._buf, 0, self.tell(), 1)
+            self._cond.notify_all()
+
+    def wait(self, position, timeout=None):
+        """
+        Blocks until the chunk at `position` is written.
+        :return: True if it is written
+        """
+        with self._cond:
+            if self.tell() <= position and not self.is_finished():
+                self._cond.wait(timeout)
+            return self.tell() > position
+
+    def read_at(self, position):
+        """
+        Blocks until the chunk at `position` is written and copies it.
+        :return: data, its actual position, which is later than requested
+                 if the chunk was overwritten, and its capture time.
+                 Empty data at the end of audio.
+        """
+        with self._cond:
+            while self.tell() <= position and not self.is_finished():
+                self._cond.wait()
+
+        while True:
+            written = self.tell()
+            if written <= position:
+                return b'', position, None
+            # Reader lagged behind, the audio is lost.
+            position = max(position, written - self.slots)
+            offset = self._get_offset(position)
+            start = offset + self._slot.size
+            sequence, timestamp, length = self._slot.unpack_from(self._buf, offset)
+            data = bytes(self._buf[start:start + length])
+            # The slot may be rewritten while copied, its length with it.
+            if sequence == position and self._slot.unpack_from(self._buf, offset)[0] == position:
+                return data, position, timestamp
+            # Overwritten while copied.
+            position += 1
+
+    def read_range(self, start, end):
+        """
+        Copies chunks from `start` to `end` position, e.g. a phrase.
+        :return: audio data or None if any chunk is overwritten
+        """
+        chunks = []
+        for position in range(start, end):
+            data, actual, _ = self.read_at(position)
+            if actual != position or not data:
+                return None
+            chunks.append(data)
+
+        return b''.join(chunks)
+
+    def get_timestamp(self, position):
+        """
+        :return: capture time of the chunk at `position` or None if it's overwritten
+        """
+        sequence, timestamp, _ = self._slot.unpack_from(self._buf, self._get_offset(position))
+
+        return timestamp if sequence == position else None
+
+    def open(self, position=None):
+        """
+        :param position: chunk position to start reading from,
+                         by default the next written chunk
+        :return: SharedRingReader
+        """
+        return SharedRingReader(self, self.tell() if position is None else position)
+
+    def terminate(self):
+        """
+        Detaches the shared memory in this process, the creator also frees it.
+        """
+        self._buf = None
+        self._memory.close()
+        if shared_memory is not None and os.getpid() == self._owner_pid:
+            self._memory.unlink()
+
+
+class SharedRingReader(object):
+    """
+    Stream of SharedAudioRing with its own read position.
+    """
+
+    def __init__(self, ring, position):
+        self.ring = ring
+        self.position = position
+        self.timestamp = None
+        self.dropped_chunks = 0
+
+    def read(self, num_frames):
+        """
+        :param num_frames: frames_per_buffer of the ring, chunks aren't split
+        """
+        data, position, timestamp = self.ring.read_at(self.position)
+        if data:
+            self.dropped_chunks += position - self.position
+            self.position = position + 1
+            self.timestamp = timestamp
+
+        return data
+
+    def wait(self, num_frames, timeout=None):
+        return self.ring.wait(self.position, timeout)
+
+    def tell(self):
+        """
+        :return: position of the next chunk to read
+        """
+        return self.position
+
+    def close(self):
+        pass
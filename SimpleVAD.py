@@ -1,7 +1,13 @@
 import numpy
 
+from VAD import VAD
 
-class SimpleVAD:
+
+class SimpleVAD(VAD):
     def estimate(self, data):
         assert type(data) is numpy.ndarray
-        return numpy.sqrt(numpy.absolute(data.mean()))
\ No newline at end of file
+        return numpy.sqrt(numpy.absolute(data.mean()))
+
+    def estimate_batch(self, frames):
+        assert type(frames) is numpy.ndarray and frames.ndim == 2
+        return numpy.sqrt(numpy.absolute(frames.mean(axis=1)))
\ No newline at end of file
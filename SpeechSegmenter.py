@@ -0,0 +1,173 @@
+class SpeechSegmenter:
+    """
+    State machine which splits a stream of audio chunks into phrases
+    by their VAD estimates, see VoiceRecord.get_speech_data().
+
+    Every push() keeps O(1) state: a running count of estimates over the
+    threshold in the sliding window, a ring of previous chunks and a phrase
+    arena, both preallocated once and reused by the following phrases.
+    Audio data is optional, so the state machine can be driven by
+    estimates only.
+    """
+    # Events returned by push().
+    SILENCE = 'silence'
+    START = 'start'
+    SPEECH = 'speech'
+    END = 'end'
+    STOP = 'stop'
+
+    def __init__(self, threshold, window_len, prev_len, silence_stop_len, recording_stop_len):
+        """
+        :param threshold: estimate which counts as speech
+        :param window_len: chunks in sliding window, a phrase goes on while
+                           any of them passes the threshold
+        :param prev_len: chunks before the phrase start to prepend
+        :param silence_stop_len: chunks of silence to stop listening
+        :param recording_stop_len: max chunks in a phrase
+        """
+        self.threshold = threshold
+        self.window_len = window_len
+        self.prev_len = prev_len
+        self.silence_stop_len = silence_stop_len
+        self.recording_stop_len = recording_stop_len
+
+        # Sliding window of threshold passes and count of them.
+        self._window = [False] * window_len
+        self._window_pos = 0
+        self._pass_num = 0
+
+        # Buffers are allocated on the first chunk, when its size is known.
+        self._chunk_size = None
+        self._prev = None
+        self._arena = None
+
+        self.started = False
+        self.recording_limit_passed = False
+        self.recorded_chunks = 0
+        self._phrase_chunks = 0
+        self._prev_count = 0
+        self._prev_pos = 0
+        self._phrase_size = 0
+        self._prev_size = 0
+        self._end_size = 0
+
+    def reset(self, threshold=None):
+        """
+        Drops current state to start listening again, keeps buffers.
+        """
+        if threshold is not None:
+            self.threshold = threshold
+        self.started = False
+        self.recorded_chunks = 0
+        self._reset_phrase()
+
+    def _reset_phrase(self):
+        for i in range(self.window_len):
+            self._window[i] = False
+        self._window_pos = 0
+        self._pass_num = 0
+        self._prev_count = 0
+        self._prev_pos = 0
+        self._phrase_chunks = 0
+
+    def _allocate(self, chunk_size):
+        self._chunk_size = chunk_size
+        self._prev = bytearray(self.prev_len * chunk_size)
+        self._arena = bytearray((self.prev_len + self.recording_stop_len) * chunk_size)
+
+    def push(self, estimate, data=None):
+        """
+        Processes the next chunk.
+        :param estimate: VAD estimate of the chunk
+        :param data: audio data of the chunk
+        :return: event, one of SILENCE, START, SPEECH, END or STOP
+        """
+        if data is not None and len(data) != self._chunk_size:
+            self._allocate(len(data))
+
+        self.recorded_chunks += 1
+        # VAD estimates are numpy scalars, count plain booleans.
+        self._slide(bool(estimate >= self.threshold))
+
+        # Check if we are over the allowed limit.
+        self.recording_limit_passed = self.recorded_chunks > self.recording_stop_len
+
+        # If it's not some random peak, don't start recording.
+        if self._pass_num > 0 and not self.recording_limit_passed:
+            event = self.SPEECH
+            if not self.started:
+                self.started = True
+                self._start_phrase()
+                event = self.START
+            self._append_phrase(data)
+            self._phrase_chunks += 1
+            self.recorded_chunks = self._phrase_chunks
+            return event
+
+        if self.started:
+            # Phrase is over, the chunk itself is dropped.
+            self.started = False
+            self.recorded_chunks = 0
+            self._end_size = self._phrase_size
+            self._reset_phrase()
+            return self.END
+
+        # Exit on long silence.
+        if self.recorded_chunks > self.silence_stop_len:
+            return self.STOP
+
+        self._append_prev(data)
+        return self.SILENCE
+
+    def _slide(self, passed):
+        if not self.window_len:
+            return
+        self._pass_num += passed - self._window[self._window_pos]
+        self._window[self._window_pos] = passed
+        self._window_pos = (self._window_pos + 1) % self.window_len
+
+    def _append_prev(self, data):
+        if data is None or not self.prev_len:
+            return
+        start = self._prev_pos * self._chunk_size
+        self._prev[start:start + self._chunk_size] = data
+        self._prev_pos = (self._prev_pos + 1) % self.prev_len
+        self._prev_count = min(self._prev_count + 1, self.prev_len)
+
+    def _start_phrase(self):
+        # Copy previous chunks to the arena start in order, oldest first.
+        self._phrase_size = 0
+        self._prev_size = 0
+        if self._chunk_size is None:
+            return
+        oldest = (self._prev_pos - self._prev_count) % self.prev_len if self.prev_len else 0
+        for i in range(self._prev_count):
+            start = ((oldest + i) % self.prev_len) * self._chunk_size
+            self._arena[self._phrase_size:self._phrase_size + self._chunk_size] = \
+                memoryview(self._prev)[start:start + self._chunk_size]
+            self._phrase_size += self._chunk_size
+        self._prev_size = self._phrase_size
+
+    def _append_phrase(self, data):
+        if data is None:
+            return
+        self._arena[self._phrase_size:self._phrase_size + self._chunk_size] = data
+        self._phrase_size += self._chunk_size
+
+    def get_prev_audio(self):
+        """
+        :return: view of audio prepended to the phrase, valid until the next phrase
+        """
+        return memoryview(self._arena)[:self._prev_size] if self._arena is not None else memoryview(b'')
+
+    def get_phrase(self):
+        """
+        Copies the recorded phrase with prepended audio. Call it on END
+        event or while the phrase is started, e.g. at the end of audio.
+        :return: phrase audio data
+        """
+        if self._arena is None:
+            return b''
+        size = self._phrase_size if self.started else self._end_size
+
+        return bytes(self._arena[:size])
@@ -0,0 +1,99 @@
+from Tracing import NULL_TRACE
+
+
+class StreamingRecognition:
+    """
+    Feeds phrase audio to streaming services while it is being recorded,
+    so decoding overlaps with capture. Passed to
+    VoiceRecord.get_speech_data() as a listener.
+
+    A streaming service implements start_utterance(), feed(chunk),
+    get_partial() and finish(), and has `streaming` attribute set. A
+    service which fails, e.g. on a dead network, is dropped for the rest
+    of the phrase and recording goes on, the dispatcher recognizes the
+    phrase with it as usual.
+    """
+
+    def __init__(self, services, partial_callback=None, upload_services=None, trace=NULL_TRACE):
+        """
+        :param services: streaming services finished at the phrase end
+        :param partial_callback: called with partial alternatives each time
+                                 a partial transcript changes
+        :param upload_services: streaming services which only get audio
+                                while recorded, their results are collected
+                                later by transcribe()
+        :param trace: Trace to mark speech start, end and recognizer spans in
+        """
+        self.services = services
+        self.upload_services = upload_services or []
+        self.partial_callback = partial_callback
+        self.results = {}
+        self.trace = trace
+        self._partial_transcripts = {}
+        self._spans = {}
+        self._failed = set()
+
+    @staticmethod
+    def is_streaming(service):
+        return getattr(service, 'streaming', False)
+
+    def on_phrase_start(self):
+        self.trace.event('speech_start')
+        self._partial_transcripts = {}
+        for service in self.services:
+            self._spans[service] = self.trace.start_span('recognize.' + service.config['service_name'])
+        for service in self.services + self.upload_services:
+            self._call(service, service.start_utterance)
+
+    def on_phrase_data(self, data):
+        for service in self._get_active():
+            self._call(service, service.feed, data)
+
+        if self.partial_callback is None:
+            return
+        partial = []
+        changed = False
+        for service in self._get_active():
+            alternatives = service.get_partial()
+            transcripts = [alt['transcript'] for alt in alternatives]
+            if transcripts != self._partial_transcripts.get(service):
+                self._partial_transcripts[service] = transcripts
+                changed = True
+            partial += alternatives
+        if changed and partial:
+            self.partial_callback(partial)
+
+    def on_phrase_end(self):
+        self.trace.event('speech_end')
+        for service in self.services:
+            if service not in self._failed:
+                alternatives = self._call(service, service.finish)
+                if service not in self._failed:
+                    self.results[service] = self.results.get(service, []) + alternatives
+            self.trace.end_span(self._spans.pop(service, None))
+
+    def _get_active(self):
+        return [service for service in self.services + self.upload_services if service not in self._failed]
+
+    def _call(self, service, method, *args):
+        """
+        Calls a method of a streaming service, a failed service is
+        cancelled and dropped for the phrase.
+        """
+        if service in self._failed:
+            return None
+        try:
+            return method(*args)
+        except Exception as e:
+            print('Streaming {} failed: {}'.format(service.config['service_name'], e))
+            self._failed.add(service)
+            self.results.pop(service, None)
+            if hasattr(service, 'cancel'):
+                service.cancel()
+            return None
+
+    def get_results(self):
+        """
+        :return: dict of service to alternatives of all recorded phrases
+        """
+        return self.results
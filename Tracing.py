@@ -0,0 +1,207 @@
+import itertools
+import json
+import os
+import threading
+import time
+
+# Spans must not jump with the wall clock.
+clock = getattr(time, 'monotonic', time.time)
+
+
+class Histogram:
+    """
+    Cumulative histogram of durations in seconds, as Prometheus keeps them.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {
+            'buckets': dict(('{:g}'.format(bound), count) for bound, count in zip(self.buckets, self.counts)),
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class Trace:
+    """
+    Timeline of one phrase: instant events, e.g. hotword detection, and
+    spans, e.g. work of a recognizer. Times are seconds of the monotonic
+    clock, reported relative to the trace start.
+    """
+
+    def __init__(self, tracer, trace_id):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.start_time = clock()
+        self.events = []
+        self.spans = []
+
+    def event(self, name):
+        self.events.append((name, clock()))
+
+    def start_span(self, name):
+        """
+        :return: span to pass to end_span()
+        """
+        span = [name, clock(), None]
+        self.spans.append(span)
+        return span
+
+    def end_span(self, span):
+        span[2] = clock()
+
+    def span(self, name):
+        """
+        Measures a `with` block.
+        """
+        return _SpanContext(self, name)
+
+    def finish(self):
+        """
+        Adds the trace to the tracer metrics.
+        :return: dict of events and spans
+        """
+        self.tracer.record(self)
+        return self.to_dict()
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'events': [{'name': name, 'time': timestamp - self.start_time} for name, timestamp in self.events],
+            'spans': [{'name': name, 'start': start - self.start_time,
+                       'duration': end - start if end is not None else None}
+                      for name, start, end in self.spans],
+        }
+
+
+class _SpanContext:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.span = None
+
+    def __enter__(self):
+        self.span = self.trace.start_span(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.trace.end_span(self.span)
+
+
+class NullTrace:
+    """
+    Trace of the disabled tracer, every call does nothing.
+    """
+    trace_id = None
+
+    def event(self, name):
+        pass
+
+    def start_span(self, name):
+        return None
+
+    def end_span(self, span):
+        pass
+
+    def span(self, name):
+        return _NULL_SPAN
+
+    def finish(self):
+        return None
+
+
+class _NullSpanContext:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_SPAN = _NullSpanContext()
+NULL_TRACE = NullTrace()
+
+
+class Tracer:
+    """
+    Creates a trace per phrase and keeps histograms of span durations and
+    of event times since the trace start. Disabled tracer hands out
+    NULL_TRACE, so instrumented code costs a no-op call.
+
+    Metrics are dumped as Prometheus text or JSON, optionally to a file
+    after every trace.
+    """
+
+    def __init__(self, enabled=False, metrics_path=None, metrics_format='prometheus'):
+        """
+        :param enabled: False to make tracing free
+        :param metrics_path: file to rewrite with metrics after every trace
+        :param metrics_format: 'prometheus' or 'json'
+        """
+        self.enabled = enabled
+        self.metrics_path = metrics_path
+        self.metrics_format = metrics_format
+        self.spans = {}
+        self.events = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start_trace(self):
+        if not self.enabled:
+            return NULL_TRACE
+
+        return Trace(self, next(self._ids))
+
+    def record(self, trace):
+        with self._lock:
+            for name, start, end in trace.spans:
+                if end is not None:
+                    self.spans.setdefault(name, Histogram()).observe(end - start)
+            for name, timestamp in trace.events:
+                self.events.setdefault(name, Histogram()).observe(timestamp - trace.start_time)
+
+        if self.metrics_path is not None:
+            self.save(self.metrics_path)
+
+    def dump_json(self):
+        with self._lock:
+            return json.dumps({
+                'spans': dict((name, histogram.to_dict()) for name, histogram in self.spans.items()),
+                'events': dict((name, histogram.to_dict()) for name, histogram in self.events.items()),
+            }, indent=2, sort_keys=True)
+
+    def dump_prometheus(self):
+        lines = []
+        with self._lock:
+            for metric, label, histograms in [('recognition_span_seconds', 'span', self.spans),
+                                              ('recognition_event_seconds', 'event', self.events)]:
+                lines.append('# TYPE {} histogram'.format(metric))
+                for name in sorted(histograms):
+                    histogram = histograms[name]
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('{}_bucket{{{}="{}",le="{:g}"}} {}'.format(metric, label, name, bound, count))
+                    lines.append('{}_bucket{{{}="{}",le="+Inf"}} {}'.format(metric, label, name, histogram.count))
+                    lines.append('{}_sum{{{}="{}"}} {}'.format(metric, label, name, histogram.sum))
+                    lines.append('{}_count{{{}="{}"}} {}'.format(metric, label, name, histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        # Write and rename, so a scraper never reads a half written file.
+        content = self.dump_json() if self.metrics_format == 'json' else self.dump_prometheus()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as stream:
+            stream.write(content)
+        os.rename(temp_path, path)
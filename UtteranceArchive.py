@@ -0,0 +1,259 @@
+import json
+import os
+import random
+import threading
+import time
+import wave
+
+from six.moves import queue
+
+from AudioEncoder import FlacEncoder
+
+
+class UtteranceArchive:
+    """
+    Archive of recognized phrases with their alternatives for offline
+    tuning, written by a background thread.
+
+    put() only queues a phrase and never blocks: phrases over a full
+    queue, when the writer is slow, are dropped. Phrases are appended to
+    a container, FLAC or WAV, which is rotated by duration and size, and
+    described in a JSONL index next to it: time, position and length in
+    samples, alternatives and trace. Oldest containers are deleted over
+    `max_total_bytes`, phrases are dropped while free disk space is below
+    `min_free_bytes` or writing fails.
+    """
+    FORMATS = ('flac', 'wav')
+    PREFIX = 'utterances-'
+    EXTENSIONS = ('.flac', '.wav', '.jsonl')
+
+    def __init__(self, path, channels=1, rate=16000, audio_format='flac', sample_ratio=1.0, queue_size=16,
+                 max_file_seconds=600, max_file_bytes=16 * 2 ** 20, max_total_bytes=None, min_free_bytes=None):
+        """
+        :param path: directory of containers, created if missing
+        :param channels: channels of 16-bit audio data
+        :param rate: sample rate of audio data
+        :param audio_format: 'flac' or 'wav' container
+        :param sample_ratio: fraction of phrases archived, chosen at random
+        :param queue_size: phrases waiting for the writer, others are dropped
+        :param max_file_seconds: audio in a container before it's rotated
+        :param max_file_bytes: size of a container before it's rotated
+        :param max_total_bytes: size of the archive, None for no limit
+        :param min_free_bytes: free disk space to keep, None for no limit
+        """
+        assert audio_format in self.FORMATS, 'archive format must be one of {}'.format(self.FORMATS)
+        self.path = path
+        self.channels = channels
+        self.rate = rate
+        self.audio_format = audio_format
+        self.sample_ratio = sample_ratio
+        self.max_file_seconds = max_file_seconds
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.min_free_bytes = min_free_bytes
+        self._random = random.Random()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        # Closed containers, oldest first, as [path without extension, size],
+        # and the one being written.
+        self._files = []
+        self._current = None
+        self._sequence = 0
+        self.stats = {
+            'archived': 0,
+            'skipped': 0,
+            'dropped_queue': 0,
+            'dropped_disk': 0,
+            'errors': 0,
+            'deleted_files': 0,
+        }
+
+    def start(self):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        # Containers of previous runs count to the archive size.
+        for name in sorted(os.listdir(self.path)):
+            if name.startswith(self.PREFIX) and name.endswith('.jsonl'):
+                base = os.path.join(self.path, name[:-len('.jsonl')])
+                self._files.append([base, self._get_size(base)])
+
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """
+        Writes queued phrases and closes the container.
+        :param timeout: seconds to wait for a slow disk
+        """
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            print('Archive writer is stalled, queued phrases are lost')
+        self._thread.join(timeout)
+        self._thread = None
+
+    def put(self, content, alternatives, trace=None):
+        """
+        Queues a phrase, never blocks.
+        :param content: 16-bit audio data
+        :param alternatives: recognition result of the phrase
+        :param trace: dict of trace events and spans
+        :return: True if the phrase is queued
+        """
+        if self.sample_ratio < 1 and self._random.random() >= self.sample_ratio:
+            self.stats['skipped'] += 1
+            return False
+
+        try:
+            self._queue.put_nowait((time.time(), content, alternatives, trace))
+        except queue.Full:
+            self.stats['dropped_queue'] += 1
+            return False
+
+        return True
+
+    def get_stats(self):
+        return dict(self.stats, queue_depth=self._queue.qsize())
+
+    def _write_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                if not self._has_free_space():
+                    self.stats['dropped_disk'] += 1
+                    continue
+                self._write(*job)
+                self.stats['archived'] += 1
+            except (IOError, OSError) as e:
+                # E.g. disk is full or the directory is gone, the container may be broken, start a new one.
+                print('Archive write failed: {}'.format(e))
+                self.stats['errors'] += 1
+                self._close_container()
+                continue
+            try:
+                self._enforce_quota()
+            except (IOError, OSError) as e:
+                print('Archive cleanup failed: {}'.format(e))
+                self.stats['errors'] += 1
+
+        self._close_container()
+
+    def _has_free_space(self):
+        if self.min_free_bytes is None or not hasattr(os, 'statvfs'):
+            return True
+        stat = os.statvfs(self.path)
+
+        return stat.f_bavail * stat.f_frsize >= self.min_free_bytes
+
+    def _write(self, timestamp, content, alternatives, trace):
+        # Odd trailing byte isn't a sample.
+        frame_size = 2 * self.channels
+        content = content[:len(content) // frame_size * frame_size]
+        samples = len(content) // frame_size
+        current = self._current
+        if current is not None and (current['samples'] + samples > self.max_file_seconds * self.rate or
+                                    current['bytes'] >= self.max_file_bytes):
+            self._close_container()
+        if self._current is None:
+            self._open_container(timestamp)
+        current = self._current
+
+        if self.audio_format == 'flac':
+            current['audio'].write(current['encoder'].encode_chunk(content))
+            current['audio'].flush()
+        else:
+            current['audio'].writeframes(content)
+
+        entry = {
+            'time': timestamp,
+            'offset': current['samples'],
+            'samples': samples,
+            'alternatives': alternatives,
+        }
+        if trace is not None:
+            entry['trace'] = trace
+        current['index'].write(json.dumps(entry, default=self._to_json) + '\n')
+        current['index'].flush()
+        current['samples'] += samples
+        if self.audio_format == 'flac':
+            audio_bytes = current['audio'].tell()
+        else:
+            audio_bytes = 44 + current['samples'] * frame_size
+        current['bytes'] = audio_bytes + current['index'].tell()
+
+    @staticmethod
+    def _to_json(value):
+        # Confidences may be numpy numbers.
+        if hasattr(value, 'item'):
+            return value.item()
+
+        return str(value)
+
+    def _open_container(self, timestamp):
+        # Names sort by time, the sequence tells apart containers of one second.
+        while True:
+            base = os.path.join(self.path, '{}{}-{:03d}'.format(
+                self.PREFIX, time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp)), self._sequence % 1000))
+            self._sequence += 1
+            if not os.path.exists(base + '.jsonl'):
+                break
+        current = {'base': base, 'samples': 0, 'bytes': 0}
+        if self.audio_format == 'flac':
+            current['encoder'] = FlacEncoder(self.channels, self.rate)
+            current['audio'] = open(base + '.flac', 'wb')
+            current['audio'].write(current['encoder'].start())
+        else:
+            current['audio'] = wave.open(base + '.wav', 'wb')
+            current['audio'].setnchannels(self.channels)
+            current['audio'].setsampwidth(2)
+            current['audio'].setframerate(self.rate)
+        current['index'] = open(base + '.jsonl', 'w')
+        self._current = current
+
+    def _close_container(self):
+        current = self._current
+        if current is None:
+            return
+        self._current = None
+        try:
+            if self.audio_format == 'flac':
+                current['audio'].write(current['encoder'].finish())
+                # Total samples are known now, some readers require them.
+                current['audio'].seek(4)
+                current['audio'].write(current['encoder'].get_stream_info(current['samples']))
+            current['audio'].close()
+            current['index'].close()
+        except (IOError, OSError) as e:
+            print('Archive close failed: {}'.format(e))
+            self.stats['errors'] += 1
+        self._files.append([current['base'], self._get_size(current['base'])])
+
+    def _enforce_quota(self):
+        if self.max_total_bytes is None:
+            return
+        total = sum(size for _, size in self._files) + (self._current['bytes'] if self._current is not None else 0)
+        while self._files and total > self.max_total_bytes:
+            base, size = self._files.pop(0)
+            total -= size
+            for extension in self.EXTENSIONS:
+                try:
+                    os.remove(base + extension)
+                except OSError:
+                    # Already deleted by hand.
+                    pass
+            self.stats['deleted_files'] += 1
+
+    def _get_size(self, base):
+        size = 0
+        for extension in self.EXTENSIONS:
+            try:
+                size += os.path.getsize(base + extension)
+            except OSError:
+                pass
+
+        return size
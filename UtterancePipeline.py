@@ -0,0 +1,164 @@
+import threading
+
+from six.moves import queue
+
+
+class Utterance:
+    """
+    Recorded phrase of a command on its way to recognition.
+    """
+
+    def __init__(self, content, results=None, upload_services=None, trace=None, end_position=None):
+        """
+        :param content: audio data of the phrase
+        :param results: dict of service to alternatives recognized while recording
+        :param upload_services: cloud services which uploaded the phrase while recording
+        :param trace: Trace of the phrase
+        :param end_position: byte position in the audio source after the phrase
+        """
+        self.content = content
+        self.results = results
+        self.upload_services = upload_services or []
+        self.trace = trace
+        self.end_position = end_position
+
+
+class UtterancePipeline:
+    """
+    Hotword detection, phrase recording and recognition as stages
+    connected by queues, so detection goes on while a command is recorded
+    and decoded, and back-to-back commands don't wait for each other.
+
+    The detector calls on_hotword() and returns to live audio at once.
+    The recorder thread records the phrase from the hotword position of a
+    shared audio source, the decoder thread recognizes recorded phrases in
+    order. A hotword detected inside an already recorded phrase is
+    skipped. Hotwords or phrases over a full queue are dropped and
+    counted, as well as audio lost by lagging readers of the source.
+    """
+
+    def __init__(self, record, process, queue_size=4, source=None):
+        """
+        :param record: function of hotword position and trace, records
+                       the phrase and returns Utterance or None
+        :param process: function recognizing an Utterance
+        :param queue_size: hotwords and phrases waiting in each queue
+        :param source: SharedCaptureSource to report dropped audio of
+        """
+        self.record = record
+        self.process = process
+        self.source = source
+        self._hotwords = queue.Queue(maxsize=queue_size)
+        self._utterances = queue.Queue(maxsize=queue_size)
+        self._recorded_position = None
+        # Phrases queued for or in recognition.
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._threads = []
+        self.stats = {
+            'hotwords': 0,
+            'utterances': 0,
+            'skipped_hotwords': 0,
+            'dropped_hotwords': 0,
+            'dropped_utterances': 0,
+            'max_queue_depth': 0,
+        }
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._record_loop), threading.Thread(target=self._decode_loop)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """
+        Finishes queued phrases and stops the stages. The audio source must
+        be terminated first, or the phrase being recorded is finished.
+        """
+        self._hotwords.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def on_hotword(self, position, trace):
+        """
+        Queues recording from the hotword, called by the detector.
+        :param position: byte position in the audio source after the hotword
+        """
+        self.stats['hotwords'] += 1
+        try:
+            self._hotwords.put_nowait((position, trace))
+        except queue.Full:
+            print('Hotword queue is full, dropping the command')
+            self.stats['dropped_hotwords'] += 1
+
+    def get_queue_depth(self):
+        """
+        :return: hotwords and phrases waiting for their stages
+        """
+        return self._hotwords.qsize() + self._utterances.qsize()
+
+    def is_busy(self):
+        """
+        :return: True while recorded phrases are queued or recognized
+        """
+        with self._in_flight_lock:
+            return self._in_flight > 0
+
+    def get_stats(self):
+        stats = dict(self.stats, queue_depth=self.get_queue_depth())
+        if self.source is not None:
+            stats['dropped_audio_bytes'] = self.source.dropped_bytes
+
+        return stats
+
+    def _record_loop(self):
+        while True:
+            job = self._hotwords.get()
+            if job is None:
+                self._utterances.put(None)
+                return
+            position, trace = job
+            if position is not None and self._recorded_position is not None and position < self._recorded_position:
+                # The hotword was said inside the previous command.
+                self.stats['skipped_hotwords'] += 1
+                continue
+
+            try:
+                utterance = self.record(position, trace)
+            except Exception as e:
+                print('Recording failed: {}'.format(e))
+                continue
+            if utterance is None:
+                continue
+            self._recorded_position = utterance.end_position
+
+            span = trace.start_span('queue')
+            self._add_in_flight(1)
+            try:
+                self._utterances.put_nowait((utterance, span))
+            except queue.Full:
+                self._add_in_flight(-1)
+                print('Utterance queue is full, dropping the command')
+                self.stats['dropped_utterances'] += 1
+                continue
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self._utterances.qsize())
+
+    def _decode_loop(self):
+        while True:
+            job = self._utterances.get()
+            if job is None:
+                return
+            try:
+                utterance, span = job
+                utterance.trace.end_span(span)
+                self.stats['utterances'] += 1
+                self.process(utterance)
+            except Exception as e:
+                print('Recognition failed: {}'.format(e))
+            finally:
+                self._add_in_flight(-1)
+
+    def _add_in_flight(self, count):
+        with self._in_flight_lock:
+            self._in_flight += count
@@ -0,0 +1,26 @@
+import numpy
+
+
+class VAD(object):
+    """
+    Voice Activity Detection interface. Estimates how likely a chunk
+    of audio data contains speech, the bigger the value the likelier.
+    """
+
+    def estimate(self, data):
+        """
+        Estimates a single chunk.
+        :param data: 1-D numpy array of audio samples
+        :return: estimate value
+        """
+        raise NotImplementedError()
+
+    def estimate_batch(self, frames):
+        """
+        Estimates many chunks of the same size at once. Implementations
+        should override it with a vectorized version.
+        :param frames: 2-D numpy array, one chunk per row
+        :return: 1-D numpy array of estimates, one per row
+        """
+        assert type(frames) is numpy.ndarray and frames.ndim == 2
+        return numpy.array([self.estimate(row) for row in frames], dtype=numpy.float64)
@@ -1,8 +1,9 @@
 import pyaudio
-from collections import deque
 import numpy
-import SimpleVAD
-import WaveletVAD
+from AudioSource import MicrophoneSource
+from SpeechSegmenter import SpeechSegmenter
+from NoiseFloorTracker import NoiseFloorTracker
+from Plugins import VADS
 
 
 class VoiceRecord:
@@ -24,21 +25,36 @@ class VoiceRecord:
     # of the phrase.
     PREV_AUDIO = 0.5
 
-    def __init__(self, config):
+    def __init__(self, config, source=None):
         self._validate_config(config)
-        self.audio = pyaudio.PyAudio()
         self.vad = self.init_vad(config['vad'])
         self.threshold = config['threshold']
         self.verbose = config['verbose']
         self.sensitivity = config['sensitivity']
 
         self.stream_in = None
+        self._segmenter = None
         # Set format configs for PyAudio audio stream.
         self._audio_format = config['audio']['format']
         self._channels = config['audio']['channels']
         self._rate = config['audio']['rate']
         self._chunk = config['audio']['frames_per_buffer']  # CHUNKS of bytes to read each time from mic
 
+        # Threshold follows the room noise instead of one-shot measurement.
+        self.noise_tracker = None
+        # VAD keeps per-instance buffers, noise floor is updated from the
+        # detector thread while a phrase is recorded, so it has its own.
+        self.noise_vad = None
+        if config['adaptive_threshold']:
+            self.noise_tracker = NoiseFloorTracker(int(config['noise_window'] * self._rate / self._chunk),
+                                                   margin=config['noise_margin'])
+            self.noise_vad = self.init_vad(config['vad'])
+
+        # Microphone by default, replay sources let run without a sound card.
+        if source is None:
+            source = MicrophoneSource(self._audio_format, self._channels, self._rate, self._chunk)
+        self.source = source
+
     @staticmethod
     def _validate_config(config):
         assert 'audio' in config \
@@ -52,26 +68,26 @@ class VoiceRecord:
         config['vad'] = config['vad'] if 'vad' in config else 'default'
         config['bg_noise_samples'] = int(config['bg_noise_samples']) if 'bg_noise_samples' in config else 20
         config['sensitivity'] = float(config['sensitivity']) if 'sensitivity' in config else 1.0
+        config['adaptive_threshold'] = bool(config['adaptive_threshold']) if 'adaptive_threshold' in config else False
+        config['noise_margin'] = float(config['noise_margin']) if 'noise_margin' in config else 1.5
+        config['noise_window'] = float(config['noise_window']) if 'noise_window' in config else 5
 
-    def init_vad(self, vad_type):
+    @staticmethod
+    def init_vad(vad_type):
+        # VAD module is imported on first use, see Plugins.VADS.
         vad = None
-        if vad_type == 'default':
-            vad = SimpleVAD.SimpleVAD()
-        elif vad_type == 'wavelet':
-            vad = WaveletVAD.WaveletVAD()
+        if vad_type in VADS:
+            vad = VADS.create(vad_type)
 
         return vad
 
-    def stream_open(self):
+    def stream_open(self, position=None):
         """
         Opens audio stream.
+        :param position: position in the audio source to start from, if supported
         :return:
         """
-        self.stream_in = self.audio.open(format=self._audio_format,
-                                         channels=self._channels,
-                                         rate=self._rate,
-                                         input=True,
-                                         frames_per_buffer=self._chunk)
+        self.stream_in = self.source.open(position)
         return self.stream_in
 
     def measure_background_noise(self, num_samples=50):
@@ -84,9 +100,18 @@ class VoiceRecord:
 
         stream = self.stream_open()
 
-        values = [self.get_vad_estimate(stream.read(self._chunk)) for _ in range(num_samples)]
+        chunks = [stream.read(self._chunk) for _ in range(num_samples)]
+        # Replay source may end before all samples are read.
+        chunks = [chunk for chunk in chunks if chunk]
+        num_samples = len(chunks)
+        if not num_samples:
+            stream.close()
+            return self.threshold
+
+        values = self.get_vad_estimate_batch(chunks)
         values = sorted(values, reverse=True)
-        r = sum(values[:int(num_samples * 0.2)]) / int(num_samples * 0.2)
+        top_num = max(int(num_samples * 0.2), 1)
+        r = sum(values[:top_num]) / top_num
 
         stream.close()
 
@@ -95,87 +120,125 @@ class VoiceRecord:
 
         return r
 
-    def get_speech_data(self, threshold=None, num_phrases=-1):
+    def get_speech_data(self, threshold=None, num_phrases=-1, listener=None, start_position=None):
         """
         Listens to Microphone, extracts phrases from it. A "phrase" is sound
         surrounded by silence (according to threshold). num_phrases controls
         how many phrases to process before finishing the listening process
         (-1 for infinite).
+
+        listener receives phrase audio chunk by chunk while it is recorded
+        with on_phrase_start(), on_phrase_data(data) and on_phrase_end().
+
+        start_position is a position in a shared audio source to start
+        recording from, e.g. the end of a hotword.
+
+        With adaptive threshold and no threshold given, silence between
+        phrases updates the noise floor and the threshold follows it.
         """
 
         # Open stream
-        stream = self.stream_open()
+        stream = self.stream_open(start_position)
+        adaptive = threshold is None and self.noise_tracker is not None
         if threshold is None:
-            threshold = self.threshold
+            threshold = self.get_threshold()
 
         self.log("* Listening mic. ")
-        recorded_phrase = []
-        rel = int(self._rate / self._chunk)
-        slid_win_maxlen = int(self.SILENCE_LIMIT * rel)
-        prev_audio_maxlen = int(self.PREV_AUDIO * rel)
-        slid_win = deque(maxlen=slid_win_maxlen)
+        segmenter = self.get_segmenter(threshold)
 
-        # Calculate recorded size in bytes for limits.
-        silence_stop_len = int(self.SILENCE_STOP_LIMIT * rel)
-        recording_stop_len = int(self.RECORDING_STOP_LIMIT * rel)
-
-        # Prepend audio from 0.5 seconds before noise was detected
-        prev_audio = deque(maxlen=prev_audio_maxlen)
-
-        # Set initial recording values.
-        started = False
         n = num_phrases
         speech_data = []
-        recorded_chunks = 0
 
         while num_phrases == -1 or n > 0:
             # Current chunk of audio data.
             cur_data = stream.read(self._chunk)
-            recorded_chunks += 1
+            if not cur_data:
+                # End of replayed audio, deliver what was recorded.
+                self.log("End of audio source")
+                if segmenter.started:
+                    speech_data.append(segmenter.get_phrase())
+                    if listener is not None:
+                        listener.on_phrase_end()
+                break
             estimate = self.get_vad_estimate(cur_data) * self.sensitivity
-            slid_win.append(estimate)
-            threshold_pass_num = sum([x >= threshold for x in slid_win])
-
-            # Check if we are over the allowed limit.
-            recording_limit_passed = recorded_chunks > recording_stop_len
-
-            # If it's not some random peak, don't start recording.
-            if threshold_pass_num > 0 and not recording_limit_passed:
-                if not started:
-                    self.log("Starting recording of a phrase")
-                    started = True
-                recorded_phrase.append(cur_data)
-                recorded_chunks = len(recorded_phrase)
-
-            elif started is True:
+            event = segmenter.push(estimate, cur_data)
+
+            if event == SpeechSegmenter.START:
+                self.log("Starting recording of a phrase")
+                if listener is not None:
+                    listener.on_phrase_start()
+                    prev_audio = segmenter.get_prev_audio()
+                    if len(prev_audio):
+                        listener.on_phrase_data(prev_audio.tobytes())
+            if event in (SpeechSegmenter.START, SpeechSegmenter.SPEECH):
+                if listener is not None:
+                    listener.on_phrase_data(cur_data)
+
+            elif event == SpeechSegmenter.END:
                 self.log("Finished")
-                if recording_limit_passed:
+                if segmenter.recording_limit_passed:
                     self.log("Stopped recording over {} seconds".format(self.RECORDING_STOP_LIMIT))
 
                 # The limit was reached, finish capture and deliver.
-                speech_data.append(b''.join(list(prev_audio) + recorded_phrase))
-                # Reset all.
-                started = False
-                recorded_chunks = 0
-                slid_win = deque(maxlen=slid_win_maxlen)
-                prev_audio = deque(maxlen=prev_audio_maxlen)
-                recorded_phrase = []
+                speech_data.append(segmenter.get_phrase())
+                if listener is not None:
+                    listener.on_phrase_end()
                 n -= 1
                 if n > 0 or n == -1:
                     self.log("Listening ...")
-            else:
+
+            elif event == SpeechSegmenter.STOP:
                 # Exit loop on long silence.
-                if recorded_chunks > silence_stop_len:
-                    self.log("Stop on long silence")
-                    break
-                else:
-                    prev_audio.append(cur_data)
+                self.log("Stop on long silence")
+                break
+
+            elif event == SpeechSegmenter.SILENCE and adaptive:
+                self.noise_tracker.update(estimate)
+                segmenter.threshold = self.get_threshold()
 
         self.log("* Done recording")
         stream.close()
 
         return speech_data
 
+    def get_segmenter(self, threshold):
+        """
+        Returns phrase segmenter reset for a new listening, its buffers
+        are allocated once and reused.
+        """
+        rel = int(self._rate / self._chunk)
+        if self._segmenter is None:
+            self._segmenter = SpeechSegmenter(threshold,
+                                              window_len=int(self.SILENCE_LIMIT * rel),
+                                              prev_len=int(self.PREV_AUDIO * rel),
+                                              silence_stop_len=int(self.SILENCE_STOP_LIMIT * rel),
+                                              recording_stop_len=int(self.RECORDING_STOP_LIMIT * rel))
+        self._segmenter.reset(threshold)
+
+        return self._segmenter
+
+    def get_threshold(self):
+        """
+        :return: adaptive threshold once the noise floor is known, configured one otherwise
+        """
+        if self.noise_tracker is not None and self.noise_tracker.is_ready():
+            return self.noise_tracker.get_threshold()
+
+        return self.threshold
+
+    def update_noise_floor(self, data):
+        """
+        Updates adaptive threshold with a chunk of non-speech audio data,
+        e.g. audio checked for the hotword. Safe to call while a phrase is
+        recorded by another thread.
+        """
+        if self.noise_tracker is None:
+            return
+        estimate = 1
+        if self.noise_vad:
+            estimate = self.noise_vad.estimate(self.bytestring_to_numpy_array(data))
+        self.noise_tracker.update(estimate * self.sensitivity)
+
     def get_vad_estimate(self, data):
         if self.vad:
             numpydata = self.bytestring_to_numpy_array(data)
@@ -183,6 +246,18 @@ class VoiceRecord:
 
         return 1
 
+    def get_vad_estimate_batch(self, chunks):
+        """
+        Estimates many chunks of equal size in one VAD pass.
+        :param chunks: list of audio byte strings
+        :return: numpy array of estimates
+        """
+        if self.vad:
+            numpydata = self.bytestring_to_numpy_array(b''.join(chunks))
+            return self.vad.estimate_batch(numpydata.reshape(len(chunks), -1))
+
+        return numpy.ones(len(chunks))
+
     def log(self, *args):
         if self.verbose:
             print(' '.join(args))
@@ -194,7 +269,7 @@ class VoiceRecord:
         :return: numpy representation
         """
         dtype = self.get_numpy_type_for_audio_format(self._audio_format)
-        return numpy.fromstring(data, dtype=dtype)
+        return numpy.frombuffer(data, dtype=dtype)
 
     def get_numpy_type_for_audio_format(self, audio_format):
         """
@@ -1,44 +1,148 @@
 import numpy
 import pywt
+from numpy.lib.stride_tricks import as_strided
 
+from VAD import VAD
 
-class WaveletVAD:
-    def __init__(self, wavelet_type='db4', layer_level=3):
+
+class WaveletVAD(VAD):
+    # Sub-band length from which ACF is calculated with FFT instead of
+    # direct correlation. Direct correlation is O(n^2) and loses beyond it.
+    FFT_THRESHOLD = 512
+
+    def __init__(self, wavelet_type='db4', layer_level=3, fft_threshold=FFT_THRESHOLD):
         self.wavelet_type = wavelet_type
+        self.wavelet = pywt.Wavelet(wavelet_type)
         self.layer_level = layer_level
+        self.fft_threshold = fft_threshold
+        # Buffers prepared per chunk length and type, see make_plan().
+        self._plans = {}
 
     def estimate(self, data):
+        subbands = self.decompose(data)
+
+        plan_key = (len(data), data.dtype)
+        plan = self._plans.get(plan_key)
+        if plan is None:
+            plan = self._plans[plan_key] = self.make_plan(subbands)
+
+        sae = numpy.float64()
+        for s, p in zip(subbands, plan):
+            ts = self.teo(s, out=p['teo'], scratch=p['scratch'])
+            if len(ts):
+                acf = self.acf(ts, nfft=p['nfft'])
+                sae += self.mdsacf(acf)
+
+        return sae
+
+    def estimate_batch(self, frames):
+        assert type(frames) is numpy.ndarray and frames.ndim == 2
+        # Every step below works along the last axis, one chunk per row.
+        subbands = self.decompose(frames)
+
+        sae = numpy.zeros(len(frames), dtype=numpy.float64)
+        for s in subbands:
+            ts = self.teo(s)
+            if ts.shape[-1]:
+                acf = self.acf(ts)
+                sae += self.mdsacf(acf)
+
+        return sae
+
+    def decompose(self, data):
+        """
+        Splits data into detail sub-bands D1..Dn and the last scale An.
+        Multi-row data is decomposed row by row along the last axis.
+        """
         subbands = []
 
         data_to_process = data
         while len(subbands) < self.layer_level:
-            cA, cD = pywt.dwt(data_to_process, self.wavelet_type)
+            cA, cD = pywt.dwt(data_to_process, self.wavelet, axis=-1)
             subbands.append(cD)
             data_to_process = cA
         # Add the last appropriated scale A.
         subbands.append(data_to_process)
 
-        t = [self.teo(s) for s in subbands]
-        sae = numpy.float64()
-        for ts in t:
-            if len(ts):
-                acf = self.acf(ts)
-                sae += self.mdsacf(acf)
+        return subbands
 
-        return sae
+    def make_plan(self, subbands):
+        """
+        Prepares reusable buffers for chunks decomposed into given sub-bands.
+        Chunk size never changes while recording, so a plan is made once.
+        """
+        plan = []
+        for s in subbands:
+            teo_len = max(len(s) - 2, 0)
+            plan.append({
+                'teo': numpy.empty(teo_len, dtype=s.dtype),
+                'scratch': numpy.empty(teo_len, dtype=s.dtype),
+                'nfft': self.get_nfft(teo_len),
+            })
+
+        return plan
+
+    def get_nfft(self, n):
+        """ FFT size for ACF of n samples or None to use direct correlation. """
+        if n < self.fft_threshold:
+            return None
 
-    def teo(self, x):
+        return self.get_fft_size(n)
+
+    def get_fft_size(self, n):
+        """ Power of 2 FFT size for ACF of n samples. """
+        # Padding to 2n-1 avoids circular wrap of the correlation.
+        nfft = 1
+        while nfft < 2 * n - 1:
+            nfft *= 2
+
+        return nfft
+
+    def teo(self, x, out=None, scratch=None):
         """ Applies Teager Kaiser energy operator to dataset. """
         # TEO(X[n]) = X[n]^2 - X[n+1] * X[n-1]
-        return numpy.multiply(x[1:-1], x[1:-1]) - numpy.multiply(x[2:], x[0:-2])
+        if out is None or scratch is None:
+            return numpy.multiply(x[..., 1:-1], x[..., 1:-1]) - numpy.multiply(x[..., 2:], x[..., 0:-2])
+
+        numpy.multiply(x[..., 1:-1], x[..., 1:-1], out=out)
+        numpy.multiply(x[..., 2:], x[..., 0:-2], out=scratch)
+        return numpy.subtract(out, scratch, out=out)
 
     def mean_operator(self, x):
         assert type(x) is numpy.ndarray
-        return numpy.absolute(x).mean()
+        return numpy.absolute(x).mean(axis=-1)
 
-    def acf(self, x):
-        """ Auto-Correlation function. """
-        return numpy.correlate(x, x, mode='full')[-len(x):]
+    def acf(self, x, nfft=None):
+        """
+        Auto-Correlation function for non-negative lags.
+
+        Parameters
+        ----------
+        x : array_like
+            Input data, multi-row data is processed along the last axis.
+        nfft : number
+            FFT size, by default chosen with get_nfft().
+            None means direct correlation.
+
+        Returns
+        -------
+        acf :
+            ndarray
+            Returns ACF for lags 0..n-1.
+        """
+        n = x.shape[-1]
+        if nfft is None:
+            nfft = self.get_nfft(n)
+        if nfft is None:
+            if x.ndim == 1:
+                return numpy.correlate(x, x, mode='full')[-n:]
+            # Direct correlation is 1-D only, rows are correlated with FFT.
+            nfft = self.get_fft_size(n)
+
+        # Wiener-Khinchin: ACF is inverse FFT of the power spectrum.
+        spectrum = numpy.fft.rfft(x, nfft, axis=-1)
+        power = numpy.square(spectrum.real) + numpy.square(spectrum.imag)
+        return numpy.fft.irfft(power, nfft, axis=-1)[..., :n]
 
     def mdsacf(self, acf, m=3):
         """
@@ -47,7 +151,8 @@ class WaveletVAD:
         Parameters
         ----------
         acf : array_like
-            Auto-Correlation function data.
+            Auto-Correlation function data, multi-row data is
+            processed along the last axis.
         m : number
             M-sample neighborhood (lag)
 
@@ -58,23 +163,22 @@ class WaveletVAD:
             Returns MDSACF.
         """
         assert type(acf) is numpy.ndarray
-        n = len(acf)
+        n = acf.shape[-1]
         # Precalculate R0 and squared sum for M range.
-        R0 = acf[0]
+        R0 = acf[..., :1, numpy.newaxis]
         # Arrange M for further calculations.
         mvals = numpy.arange(-m, m + 1, 1, dtype=numpy.float64)
 
+        # Zero-pad ACF by M on both sides, so ACF(k+m) out of range is 0.
+        padded = numpy.zeros(acf.shape[:-1] + (n + 2 * m,), dtype=numpy.float64)
+        padded[..., m:m + n] = acf
+        # Window view of (..., n, 2m+1) shape: row k is ACF(k-m..k+m), no copy.
+        stride = padded.strides[-1]
+        Rk = as_strided(padded, shape=acf.shape[:-1] + (n, 2 * m + 1),
+                        strides=padded.strides[:-1] + (stride, stride))
+
         # Calculate Delta Subband Auto-Correlation Function (DSACF).
-        Rm = numpy.zeros(n, dtype=numpy.float64)
-        for k, val in enumerate(Rm):
-            # Generate ACF(k+m) vector.
-            Rk = mvals.copy()
-            for ri, rm in enumerate(Rk):
-                i = int(k + rm)
-                Rk[ri] = acf[i] if 0 <= i < n else numpy.float64(0.0)
-            # Generate DSACF vector.
-            Rm[k] = (mvals.copy() * Rk / R0).sum()
-        # Calculate DSACF.
+        Rm = (mvals * Rk / R0).sum(axis=-1)
         Rm /= numpy.square(mvals).sum()
 
         # Calculate Mean-Delta over Delta Subband Auto-Correlation Function
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+import argparse
+import time
+import wave
+
+import yaml
+
+from MyPocketSphinx import MyPocketSphinx
+
+
+def read_labels(filename):
+    """
+    Reads lines of `file.wav<TAB>command`.
+    :return: list of (audio data, command) tuples
+    """
+    samples = []
+    with open(filename, 'r') as stream:
+        for line in stream:
+            if not line.strip():
+                continue
+            path, command = line.rstrip('\n').split('\t', 1)
+            wav = wave.open(path, 'rb')
+            assert wav.getframerate() == 16000 and wav.getnchannels() == 1 and wav.getsampwidth() == 2, \
+                'WAV must be 16 kHz 16-bit mono'
+            samples.append((wav.readframes(wav.getnframes()), command.strip().lower()))
+            wav.close()
+
+    return samples
+
+
+def measure(service, samples, repeat):
+    """
+    :return: best decode time of all samples in seconds, accuracy and mean
+             confidence of right and wrong transcripts
+    """
+    cost = None
+    right = []
+    wrong = []
+    for _ in range(repeat):
+        start_time = time.time()
+        results = [service.transcribe(data) for data, _ in samples]
+        elapsed = time.time() - start_time
+        cost = elapsed if cost is None else min(cost, elapsed)
+
+    for (_, command), alternatives in zip(samples, results):
+        transcript = alternatives[0]['transcript'] if alternatives else ''
+        confidence = alternatives[0]['confidence'] if alternatives else 0
+        (right if transcript == command else wrong).append(confidence)
+
+    return cost, float(len(right)) / len(samples), mean(right), mean(wrong)
+
+
+def mean(values):
+    return sum(values) / len(values) if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode time and accuracy of command search against language model.')
+    parser.add_argument('labels', help='file with lines of `file.wav<TAB>command`')
+    parser.add_argument('--config', default='./recognition.config.yml')
+    parser.add_argument('--commands', nargs='+', default=None, help='known commands, labels by default')
+    parser.add_argument('--searches', nargs='+', choices=MyPocketSphinx.SEARCHES, default=MyPocketSphinx.SEARCHES)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as stream:
+        config = yaml.safe_load(stream)
+    service_config = [service for service in config['services'] if service['service_name'] == 'pocketsphinx'][0]
+    samples = read_labels(args.labels)
+    commands = args.commands or sorted(set(command for _, command in samples))
+    duration = sum(len(data) for data, _ in samples) / 32000.0
+
+    print('{} samples, {:.1f} s of audio, {} commands'.format(len(samples), duration, len(commands)))
+    print('{:<12}{:>10}{:>10}{:>12}{:>16}{:>16}'.format(
+        'search', 'cost, s', 'RTF', 'accuracy', 'conf. right', 'conf. wrong'))
+    for search in args.searches:
+        service = MyPocketSphinx(dict(service_config, search=search, known_alternatives=commands))
+        cost, accuracy, right, wrong = measure(service, samples, args.repeat)
+        print('{:<12}{:>10.3f}{:>10.3f}{:>12.2f}{:>16.3f}{:>16.3f}'.format(
+            search, cost, cost / duration, accuracy, right, wrong))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import os
+import threading
+import time
+import wave
+
+import yaml
+
+from DecoderPool import DecoderPool
+from MyPocketSphinx import MyPocketSphinx
+
+
+def read_wav(filename):
+    wav = wave.open(filename, 'rb')
+    assert wav.getframerate() == 16000 and wav.getnchannels() == 1 and wav.getsampwidth() == 2, \
+        'WAV must be 16 kHz 16-bit mono'
+    data = wav.readframes(wav.getnframes())
+    wav.close()
+
+    return data
+
+
+def get_memory(pid='self'):
+    """
+    :return: dict of resident, proportional and private memory in MB.
+             Proportional memory divides shared pages between processes
+             which map them, so it sums up to the real usage.
+    """
+    memory = {'rss': 0.0, 'pss': 0.0, 'private': 0.0}
+    keys = {'Rss:': 'rss', 'Pss:': 'pss', 'Private_Clean:': 'private', 'Private_Dirty:': 'private'}
+    try:
+        with open('/proc/{}/smaps_rollup'.format(pid)) as stream:
+            for line in stream:
+                fields = line.split()
+                if fields[0] in keys:
+                    memory[keys[fields[0]]] += int(fields[1]) / 1024.0
+    except IOError:
+        # Old kernels: resident size only.
+        with open('/proc/{}/status'.format(pid)) as stream:
+            for line in stream:
+                if line.startswith('VmRSS:'):
+                    memory['rss'] = memory['pss'] = memory['private'] = int(line.split()[1]) / 1024.0
+
+    return memory
+
+
+def decode(service, data, repeat):
+    for _ in range(repeat):
+        service.transcribe(data)
+
+
+def run_threads(service_config, data, size, repeat):
+    """
+    One process, pool of `size` decoders used by as many threads.
+    """
+    before = get_memory()
+    service = MyPocketSphinx(dict(service_config, pool_size=size))
+    after = get_memory()
+
+    threads = [threading.Thread(target=decode, args=(service, data, repeat)) for _ in range(size)]
+    start_time = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.time() - start_time
+
+    per_worker = (after['rss'] - before['rss']) / size
+    return {'rss': per_worker, 'private': per_worker, 'wall': wall}
+
+
+def run_fork(service_config, data, size, repeat):
+    """
+    Decoder loaded by the parent, `size` forked workers share its pages.
+    """
+    service = MyPocketSphinx(dict(service_config, pool_size=1))
+    DecoderPool.prepare_fork()
+
+    workers = []
+    start_time = time.time()
+    for _ in range(size):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            decode(service, data, repeat)
+            os.write(write_fd, json.dumps(get_memory()).encode('utf-8'))
+            os._exit(0)
+        os.close(write_fd)
+        workers.append((pid, read_fd))
+
+    memories = []
+    for pid, read_fd in workers:
+        with os.fdopen(read_fd, 'rb') as stream:
+            memories.append(json.loads(stream.read().decode('utf-8')))
+        os.waitpid(pid, 0)
+    wall = time.time() - start_time
+
+    return {
+        'rss': sum(memory['rss'] for memory in memories) / size,
+        'private': sum(memory['private'] for memory in memories) / size,
+        'wall': wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory per worker and decode throughput of PocketSphinx pool.')
+    parser.add_argument('wav', help='16 kHz 16-bit mono WAV file with a phrase')
+    parser.add_argument('--config', default='./recognition.config.yml')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--mode', choices=['threads', 'fork'], default='fork')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as stream:
+        config = yaml.safe_load(stream)
+    service_config = [service for service in config['services'] if service['service_name'] == 'pocketsphinx'][0]
+    data = read_wav(args.wav)
+    duration = len(data) / 32000.0
+
+    run = run_fork if args.mode == 'fork' else run_threads
+    print('{:>6}{:>16}{:>20}{:>10}{:>20}'.format('size', 'rss/worker, MB', 'private/worker, MB', 'wall, s',
+                                                   'audio s per second'))
+    for size in args.sizes:
+        stat = run(service_config, data, size, args.repeat)
+        print('{:>6}{:>16.1f}{:>20.1f}{:>10.2f}{:>20.1f}'.format(
+            size, stat['rss'], stat['private'], stat['wall'], duration * args.repeat * size / stat['wall']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+import argparse
+import wave
+
+from Plugins import ENCODERS
+
+# Chunk of the recorder in streaming upload.
+FRAMES_PER_BUFFER = 2048
+
+
+def read_wav(filename):
+    wav = wave.open(filename, 'rb')
+    assert wav.getsampwidth() == 2, 'WAV must be 16-bit'
+    data = wav.readframes(wav.getnframes())
+    channels, rate = wav.getnchannels(), wav.getframerate()
+    wav.close()
+
+    return data, channels, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Size and encode CPU of cloud upload encodings.')
+    parser.add_argument('wav', help='16-bit WAV with a phrase')
+    parser.add_argument('--encodings', nargs='+', default=ENCODERS.get_names())
+    parser.add_argument('--kbps', type=float, nargs='+', default=[64, 256, 1024],
+                        help='uplink speeds to estimate upload time')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data, channels, rate = read_wav(args.wav)
+    duration = float(len(data)) / (2 * channels * rate)
+    chunk_size = FRAMES_PER_BUFFER * 2 * channels
+
+    print('{:<10}{:>10}{:>8}{:>14}{:>14}'.format('encoding', 'bytes', 'ratio', 'phrase, ms/s', 'stream, ms/s') +
+          ''.join('{:>14}'.format('{:g} kbps, s'.format(kbps)) for kbps in args.kbps))
+    for name in args.encodings:
+        encoder = ENCODERS.create(name, channels, rate)
+        phrase_cpu = stream_cpu = 0.0
+        for _ in range(args.repeat):
+            encoder.encode(data)
+            phrase_cpu += encoder.stats['cpu']
+
+            encoder.start()
+            for offset in range(0, len(data), chunk_size):
+                encoder.encode_chunk(data[offset:offset + chunk_size])
+            encoder.finish()
+            stream_cpu += encoder.stats['cpu']
+        size = encoder.stats['bytes']
+
+        print('{:<10}{:>10}{:>8.2f}{:>14.2f}{:>14.2f}'.format(
+            name, size, float(size) / len(data),
+            phrase_cpu / args.repeat / duration * 1000, stream_cpu / args.repeat / duration * 1000) +
+            ''.join('{:>14.2f}'.format(size * 8 / (kbps * 1000)) for kbps in args.kbps))
+
+
+if __name__ == '__main__':
+    main()
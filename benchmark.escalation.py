@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+import argparse
+import threading
+import time
+
+from EscalationPolicy import CircuitBreaker, EscalationPolicy
+from FakeSpeechServer import FakeSpeechServer
+from GoogleCloudSpeechAPI import GoogleCloudSpeechAPI
+from RecognitionDispatcher import RecognitionDispatcher
+
+# Cloud conditions of the scenario: name, delay, failure rate.
+PHASES = [
+    ('healthy', 0.1, 0.0),
+    ('stalled', 2.0, 0.0),
+    ('failing', 0.1, 1.0),
+    ('recovered', 0.1, 0.0),
+]
+
+
+class LocalService:
+    """
+    Local service stand-in with low confidence, so every phrase escalates.
+    """
+
+    def __init__(self, confidence=0.1):
+        self.config = {'service_name': 'local'}
+        self.confidence = confidence
+
+    def transcribe(self, content):
+        return [{'service_name': 'local', 'confidence': self.confidence, 'transcript': 'local'}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cloud escalation against a fake endpoint with injected faults.')
+    parser.add_argument('--phrases', type=int, default=10, help='phrases per phase')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between phrases')
+    parser.add_argument('--timeout', type=float, default=1.0, help='cloud service timeout')
+    parser.add_argument('--requests-per-minute', type=int, default=None)
+    parser.add_argument('--bytes-per-minute', type=int, default=None)
+    parser.add_argument('--breaker-latency', type=float, default=0.5)
+    parser.add_argument('--breaker-reset', type=float, default=3)
+    parser.add_argument('--sync', action='store_true', help='wait for the cloud before the next phrase')
+    args = parser.parse_args()
+
+    server = FakeSpeechServer(seed=0)
+    port = server.start()
+    cloud = GoogleCloudSpeechAPI({
+        'service_name': 'google', 'host': 'localhost', 'port': port, 'insecure': True,
+        'audio': {'encoding': 'LINEAR16', 'rate': 16000}})
+    policy = EscalationPolicy(args.requests_per_minute, args.bytes_per_minute,
+                              CircuitBreaker(latency_threshold=args.breaker_latency, reset_timeout=args.breaker_reset))
+    dispatcher = RecognitionDispatcher(0.5, policy=policy)
+    dispatcher.add_service(LocalService(), True)
+    dispatcher.add_service(cloud, False, timeout=args.timeout)
+
+    content = b'\x00' * 32000
+    lock = threading.Lock()
+
+    print('{:<12}{:>14}{:>12}{:>12}{:>14}'.format('phase', 'blocked, ms', 'cloud', 'local only', 'breaker'))
+    for name, delay, failure_rate in PHASES:
+        server.delay = delay
+        server.failure_rate = failure_rate
+        counts = {'cloud': 0, 'local': 0}
+
+        def on_result(result):
+            with lock:
+                counts['cloud' if any(alt['service_name'] == 'google' for alt in result) else 'local'] += 1
+
+        blocked = 0
+        for _ in range(args.phrases):
+            # Time the hotword detector would wait before listening again.
+            start_time = time.time()
+            if args.sync:
+                on_result(dispatcher.dispatch(content))
+            else:
+                dispatcher.dispatch_async(content, on_result)
+            blocked += time.time() - start_time
+            time.sleep(args.interval)
+        while dispatcher.is_busy():
+            time.sleep(0.01)
+
+        print('{:<12}{:>14.1f}{:>12}{:>12}{:>14}'.format(
+            name, blocked / args.phrases * 1000, counts['cloud'], counts['local'], policy.breaker.state))
+
+    print('Escalation: {}, server requests: {}, failures: {}'.format(
+        policy.stats, server.requests_count, server.failures_count))
+    dispatcher.shutdown()
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
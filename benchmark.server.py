@@ -0,0 +1,123 @@
+#!/usr/bin/python
+
+import argparse
+import threading
+import time
+import wave
+
+import yaml
+
+from RecognitionServer import RecognitionServer, RecognitionClient, FRAMES_PER_BUFFER, RATE
+
+# Process CPU time is missing in Python 2.
+process_time = getattr(time, 'process_time', None) or time.clock
+
+
+def read_wav(filename):
+    wav = wave.open(filename, 'rb')
+    assert wav.getframerate() == RATE and wav.getnchannels() == 1 and wav.getsampwidth() == 2, \
+        'WAV must be 16 kHz 16-bit mono'
+    data = wav.readframes(wav.getnframes())
+    wav.close()
+
+    return data
+
+
+def replay(address, data, realtime, stats):
+    """
+    Streams audio to the server, in real time if requested, and records
+    the lag between the end of audio and the end of recognition.
+    """
+    client = RecognitionClient(address)
+    results = []
+
+    def receive():
+        while True:
+            message = client.receive()
+            if message is None or message['type'] == 'end':
+                break
+            if message['type'] == 'result':
+                results.append(message)
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+
+    chunk_size = FRAMES_PER_BUFFER * 2
+    chunk_duration = float(FRAMES_PER_BUFFER) / RATE
+    start_time = time.time()
+    for i, offset in enumerate(range(0, len(data), chunk_size)):
+        if realtime:
+            delay = start_time + i * chunk_duration - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        client.send(data[offset:offset + chunk_size])
+    end_time = time.time()
+    client.finish()
+    receiver.join()
+    client.close()
+
+    stats.append({'lag': time.time() - end_time, 'results': len(results)})
+
+
+def run(address, data, streams, realtime):
+    stats = []
+    threads = [threading.Thread(target=replay, args=(address, data, realtime, stats)) for _ in range(streams)]
+    start_time = time.time()
+    start_cpu = process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.time() - start_time
+
+    lags = sorted(stat['lag'] for stat in stats)
+    return {
+        'streams': streams,
+        'wall': wall,
+        # Valid when the server runs in this process.
+        'cores': (process_time() - start_cpu) / wall,
+        'lag_mean': sum(lags) / len(lags),
+        'lag_p95': lags[min(int(len(lags) * 0.95), len(lags) - 1)],
+        'results': sum(stat['results'] for stat in stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for RecognitionServer, measures streams per core.')
+    parser.add_argument('wav', nargs='+', help='16 kHz 16-bit mono WAV files to replay, joined')
+    parser.add_argument('--config', default='./recognition.config.yml')
+    parser.add_argument('--address', default=None, help='host:port of a running server, in-process by default')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--streams', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--max-lag', type=float, default=1.0, help='seconds of lag a stream keeps up with')
+    parser.add_argument('--fast', action='store_true', help='send audio as fast as possible')
+    args = parser.parse_args()
+
+    data = b''.join(read_wav(filename) for filename in args.wav)
+
+    server = None
+    if args.address:
+        host, port = args.address.rsplit(':', 1)
+        address = (host, int(port))
+    else:
+        with open(args.config, 'r') as stream:
+            config = yaml.safe_load(stream)
+        server = RecognitionServer(config, workers=args.workers)
+        address = server.serve()
+
+    print('{:>8}{:>10}{:>12}{:>12}{:>10}{:>10}{:>16}'.format(
+        'streams', 'wall, s', 'lag, s', 'lag95, s', 'cores', 'results', 'streams/core'))
+    for streams in args.streams:
+        stat = run(address, data, streams, not args.fast)
+        kept_up = stat['lag_p95'] <= args.max_lag
+        per_core = streams / stat['cores'] if server is not None and stat['cores'] else float('nan')
+        print('{:>8}{:>10.2f}{:>12.3f}{:>12.3f}{:>10.2f}{:>10}{:>16}'.format(
+            streams, stat['wall'], stat['lag_mean'], stat['lag_p95'], stat['cores'], stat['results'],
+            '{:.2f}'.format(per_core) if kept_up else 'behind'))
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
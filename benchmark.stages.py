@@ -0,0 +1,50 @@
+#!/usr/bin/python
+
+import argparse
+import time
+
+import yaml
+
+from MultiProcessRecognition import MultiProcessRecognition
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU per stage and result latency of multi-process recognition.')
+    parser.add_argument('wav', help='16 kHz 16-bit mono WAV with hotwords and commands')
+    parser.add_argument('--config', default='./recognition.config.yml')
+    parser.add_argument('--speeds', type=float, nargs='+', default=[1, 2, 4],
+                        help='replay speeds, over real time the stages may fall behind')
+    args = parser.parse_args()
+
+    print('{:<8}{:>10}{:>12}{:>14}{:>14}{:>10}{:>12}{:>12}{:>10}'.format(
+        'speed', 'wall, s', 'capture, %', 'detection, %', 'recognize, %', 'phrases',
+        'p50, ms', 'p90, ms', 'dropped'))
+    for speed in args.speeds:
+        with open(args.config, 'r') as stream:
+            config = yaml.safe_load(stream)
+        config['audio_source'] = {'type': 'wav', 'path': args.wav}
+        config.setdefault('stages', {})['replay_speed'] = speed
+
+        recognition = MultiProcessRecognition()
+        recognition.set_config(config)
+        start_time = time.time()
+        recognition.start_recognize_loop()
+        wall = time.time() - start_time
+
+        stats = recognition.stage_stats
+        latencies = stats['recognition']['latencies']
+        print('{:<8}{:>10.2f}{:>12.1f}{:>14.1f}{:>14.1f}{:>10}{:>12.1f}{:>12.1f}{:>10}'.format(
+            speed, wall,
+            stats['capture']['cpu'] / wall * 100, stats['detection']['cpu'] / wall * 100,
+            stats['recognition']['cpu'] / wall * 100, stats['recognition']['phrases'],
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.9) * 1000,
+            stats['detection']['dropped_chunks'] + stats['recognition']['dropped_phrases']))
+
+
+if __name__ == '__main__':
+    main()
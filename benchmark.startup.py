@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+
+# Counted from here, the interpreter start is measured by the parent.
+START_TIME = time.time()
+
+# Modules of backends, imported only if the config names them.
+HEAVY_MODULES = ['grpc', 'google.auth', 'pocketsphinx', 'pywt']
+
+
+def run_child(config_path, timeout):
+    """
+    Starts recognition on replayed silence in this fresh interpreter.
+    :return: dict of startup times in seconds
+    """
+    import numpy
+    import pyaudio
+    from AudioSource import BufferSource
+
+    class RealtimeSource(BufferSource):
+        """
+        Replays audio at the speed of a microphone, so background noise is
+        measured as long as on a device.
+        """
+
+        def read_bytes(self, size):
+            data = BufferSource.read_bytes(self, size)
+            time.sleep(float(len(data)) / self.frame_size / self.rate)
+            return data
+
+    import_start = time.time()
+    from CommandRecognition import CommandRecognition
+    import_time = time.time() - import_start
+
+    recognition = CommandRecognition()
+    recognition.set_config_yaml(config_path)
+    silence = numpy.random.RandomState(0).normal(0, 30, 16000 * 60).astype(numpy.int16).tobytes()
+    recognition.set_audio_source(RealtimeSource(silence, pyaudio.paInt16, 1, 16000))
+
+    loop_start = time.time()
+    thread = threading.Thread(target=recognition.start_recognize_loop)
+    thread.start()
+    ready = recognition.wait_ready(timeout)
+    ready_time = time.time()
+    recognition.stop_recognize_loop()
+    thread.join()
+
+    return {
+        'import': import_time,
+        'init': ready_time - loop_start,
+        'ready': ready_time - START_TIME,
+        'start_time': START_TIME,
+        'timed_out': not ready,
+        'modules': len(sys.modules),
+        'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time from start to the hotword listened.')
+    parser.add_argument('--config', default='./recognition.config.yml')
+    parser.add_argument('--repeat', type=int, default=3, help='cold starts to run')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for ready state')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Result is the last line, recognition prints before it.
+        print(json.dumps(run_child(args.config, args.timeout)))
+        return
+
+    print('{:<6}{:>12}{:>12}{:>12}{:>16}{:>10}  {}'.format(
+        'run', 'total, s', 'import, s', 'init, s', 'interpreter, s', 'modules', 'backends imported'))
+    for i in range(args.repeat):
+        spawn_time = time.time()
+        output = subprocess.check_output([sys.executable, __file__, '--child', '--config', args.config,
+                                          '--timeout', str(args.timeout)])
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        if result['timed_out']:
+            print('{:<6} not ready in {} s'.format(i + 1, args.timeout))
+            continue
+        # Same wall clock in both processes, stop of the child isn't counted.
+        interpreter = result['start_time'] - spawn_time
+        print('{:<6}{:>12.3f}{:>12.3f}{:>12.3f}{:>16.3f}{:>10}  {}'.format(
+            i + 1, interpreter + result['ready'], result['import'], result['init'], interpreter, result['modules'],
+            ', '.join(result['heavy_modules']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
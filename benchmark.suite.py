@@ -0,0 +1,262 @@
+#!/usr/bin/python
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import wave
+
+import numpy
+
+import SimpleVAD
+import WaveletVAD
+from SpeechSegmenter import SpeechSegmenter
+
+# Optional in Python 2.
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# CPU time of the process, time.clock() in Python 2.
+process_time = getattr(time, 'process_time', None) or time.clock
+
+RATE = 16000
+FRAMES_PER_BUFFER = 2048
+# Key metric of every case, compared between runs.
+KEY_METRIC = 'cpu_per_chunk_ms'
+
+
+def make_synthetic(seconds=30, seed=0):
+    """
+    Generates reproducible 16-bit audio: quiet noise with voiced bursts of
+    0.3-1.5 seconds, as phrases of commands separated by pauses.
+    :return: audio data
+    """
+    rng = numpy.random.RandomState(seed)
+    samples = rng.normal(0, 50, seconds * RATE)
+    position = RATE
+    while position < len(samples) - 2 * RATE:
+        length = int(rng.uniform(0.3, 1.5) * RATE)
+        t = numpy.arange(length) / float(RATE)
+        pitch = rng.uniform(100, 250)
+        burst = sum(numpy.sin(2 * numpy.pi * pitch * h * t) / h for h in range(1, 20))
+        samples[position:position + length] += burst * numpy.hanning(length) * rng.uniform(1000, 6000) + 2000
+        position += length + int(rng.uniform(1.0, 3.0) * RATE)
+
+    return numpy.clip(samples, -32768, 32767).astype(numpy.int16).tobytes()
+
+
+def read_wav(filename):
+    wav = wave.open(filename, 'rb')
+    assert wav.getframerate() == RATE and wav.getnchannels() == 1 and wav.getsampwidth() == 2, \
+        'WAV must be 16 kHz 16-bit mono'
+    data = wav.readframes(wav.getnframes())
+    wav.close()
+
+    return data
+
+
+def split_chunks(data):
+    chunk_size = FRAMES_PER_BUFFER * 2
+    data += b'\x00' * (-len(data) % chunk_size)
+    return [data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size)]
+
+
+def measure(run, chunk_num, duration, repeat):
+    """
+    Runs the case once to warm up, then `repeat` times, keeping the best.
+    Allocations are traced in a separate run, tracing slows it down.
+    :return: dict of metrics
+    """
+    run()
+    wall = cpu = None
+    for _ in range(repeat):
+        start_wall = time.time()
+        start_cpu = process_time()
+        run()
+        cpu = process_time() - start_cpu if cpu is None else min(cpu, process_time() - start_cpu)
+        wall = time.time() - start_wall if wall is None else min(wall, time.time() - start_wall)
+
+    metrics = {
+        'chunks': chunk_num,
+        'audio_seconds': duration,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'rtf': cpu / duration,
+        KEY_METRIC: cpu / chunk_num * 1000,
+    }
+    if tracemalloc is not None:
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        metrics['alloc_peak_kb'] = peak / 1024.0
+        metrics['alloc_blocks_alive'] = sum(stat.count for stat in snapshot.statistics('filename'))
+
+    return metrics
+
+
+def bench_vad(vad, chunks, batch=False):
+    frames = [numpy.frombuffer(chunk, dtype=numpy.int16) for chunk in chunks]
+    if batch:
+        matrix = numpy.vstack(frames)
+        return lambda: vad.estimate_batch(matrix)
+
+    return lambda: [vad.estimate(frame) for frame in frames]
+
+
+def bench_segmenter(chunks, threshold):
+    estimates = SimpleVAD.SimpleVAD().estimate_batch(
+        numpy.vstack([numpy.frombuffer(chunk, dtype=numpy.int16) for chunk in chunks]))
+    rel = int(RATE / FRAMES_PER_BUFFER)
+    segmenter = SpeechSegmenter(threshold, window_len=rel, prev_len=int(0.5 * rel),
+                                silence_stop_len=10 * rel, recording_stop_len=8 * rel)
+
+    def run():
+        segmenter.reset()
+        for estimate, chunk in zip(estimates, chunks):
+            if segmenter.push(estimate, chunk) == SpeechSegmenter.END:
+                segmenter.get_phrase()
+
+    return run
+
+
+def bench_voice_record(data, threshold):
+    # Needs pyaudio module for audio formats, but no sound device.
+    import pyaudio
+    from AudioSource import BufferSource
+    from VoiceRecord import VoiceRecord
+
+    source = BufferSource(data, pyaudio.paInt16, 1, RATE, FRAMES_PER_BUFFER)
+    voice_record = VoiceRecord({'vad': 'default', 'threshold': threshold, 'verbose': False,
+                                'audio': source.get_config()}, source=source)
+
+    def run():
+        source.rewind()
+        while source.position < len(source.data):
+            voice_record.get_speech_data()
+
+    return run
+
+
+def bench_pocketsphinx(config_path, phrases):
+    import yaml
+    from MyPocketSphinx import MyPocketSphinx
+
+    with open(config_path, 'r') as stream:
+        config = yaml.safe_load(stream)
+    service_config = [service for service in config['services'] if service['service_name'] == 'pocketsphinx'][0]
+    for name in ['-hmm', '-lm', '-dict']:
+        path = service_config['decoder'].get(name)
+        if path is not None and not os.path.exists(path):
+            raise IOError('Model file is missing: {}'.format(path))
+    service = MyPocketSphinx(service_config)
+
+    return lambda: [service.transcribe(phrase) for phrase in phrases]
+
+
+def get_meta():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'date': datetime.datetime.utcnow().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 if resource else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints change of the key metric against the baseline.
+    :return: True if no case got slower by more than `threshold`
+    """
+    passed = True
+    print('\n{:<32}{:>14}{:>14}{:>10}'.format('case', 'baseline, ms', 'current, ms', 'change'))
+    for name, metrics in sorted(results.items()):
+        old = baseline['results'].get(name, {})
+        if KEY_METRIC not in metrics or KEY_METRIC not in old:
+            continue
+        change = metrics[KEY_METRIC] / old[KEY_METRIC] - 1
+        regressed = change > threshold
+        passed = passed and not regressed
+        print('{:<32}{:>14.4f}{:>14.4f}{:>+9.1f}%{}'.format(
+            name, old[KEY_METRIC], metrics[KEY_METRIC], change * 100, ' REGRESSION' if regressed else ''))
+
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of VAD, segmentation and recognizers without '
+                                                 'sound card and network.')
+    parser.add_argument('--wav', nargs='*', default=[], help='16 kHz 16-bit mono WAV fixtures')
+    parser.add_argument('--seconds', type=int, default=30, help='length of synthetic audio')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=30, help='VAD threshold of segmentation')
+    parser.add_argument('--config', default='./recognition.config.yml', help='config with pocketsphinx model')
+    parser.add_argument('--output', default=None, help='JSON file to save results to')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed slowdown of the key metric, exits with 1 over it')
+    args = parser.parse_args()
+
+    fixtures = [('synthetic', make_synthetic(args.seconds))]
+    fixtures += [(os.path.basename(filename), read_wav(filename)) for filename in args.wav]
+
+    results = {}
+    for fixture, data in fixtures:
+        chunks = split_chunks(data)
+        duration = len(data) / 2.0 / RATE
+        cases = [
+            ('vad.simple', lambda: bench_vad(SimpleVAD.SimpleVAD(), chunks)),
+            ('vad.simple.batch', lambda: bench_vad(SimpleVAD.SimpleVAD(), chunks, batch=True)),
+            ('vad.wavelet', lambda: bench_vad(WaveletVAD.WaveletVAD(), chunks)),
+            ('vad.wavelet.batch', lambda: bench_vad(WaveletVAD.WaveletVAD(), chunks, batch=True)),
+            ('segmenter', lambda: bench_segmenter(chunks, args.threshold)),
+            ('voice_record', lambda: bench_voice_record(data, args.threshold)),
+            ('pocketsphinx', lambda: bench_pocketsphinx(args.config, [data[:RATE * 2 * 3]])),
+        ]
+        for case, make_run in cases:
+            name = '{}/{}'.format(case, fixture)
+            try:
+                run = make_run()
+            # Missing module, model or service config, or a model the decoder can't load.
+            except (ImportError, IOError, OSError, IndexError, KeyError, RuntimeError, ValueError) as e:
+                results[name] = {'skipped': str(e)}
+                print('{:<32} skipped: {}'.format(name, e))
+                continue
+            results[name] = measure(run, len(chunks), duration, args.repeat)
+            print('{:<32} {:>10.4f} ms/chunk  RTF {:.4f}'.format(name, results[name][KEY_METRIC],
+                                                                 results[name]['rtf']))
+
+    report = {'meta': get_meta(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(report, stream, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as stream:
+            baseline = json.load(stream)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
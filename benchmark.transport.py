@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import pickle
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Pipe
+
+from ResultTransport import ResultMessage, ResultPublisher, ResultSubscriber
+
+ALTERNATIVES = [
+    {'service_name': 'google', 'confidence': 0.93, 'transcript': u'включи свет'},
+    {'service_name': 'pocketsphinx', 'confidence': 0.41, 'transcript': u'включи свет', 'cached': True},
+]
+
+
+def publish_pipe(connections, count, interval):
+    for _ in range(count):
+        timestamp = time.time()
+        for connection in connections:
+            connection.send((timestamp, ALTERNATIVES))
+        time.sleep(interval)
+    for connection in connections:
+        connection.close()
+
+
+def publish_socket(path, subscribers, count, interval):
+    publisher = ResultPublisher(path)
+    while publisher.get_subscriber_count() < subscribers:
+        time.sleep(0.01)
+    for _ in range(count):
+        publisher.publish(ResultMessage(ResultMessage.RESULT, ALTERNATIVES))
+        time.sleep(interval)
+    publisher.close()
+
+
+def receive_pipe(connection, latencies):
+    while True:
+        try:
+            timestamp, _ = connection.recv()
+        except EOFError:
+            return
+        latencies.append(time.time() - timestamp)
+
+
+def receive_socket(subscriber, latencies):
+    while True:
+        try:
+            message = subscriber.receive()
+        except EOFError:
+            return
+        latencies.append(time.time() - message.timestamp)
+
+
+def run(transport, subscribers, count, interval):
+    """
+    Publishes from another process to `subscribers` receiving threads.
+    :return: sorted latencies in seconds
+    """
+    latencies = []
+    if transport == 'pipe':
+        pipes = [Pipe() for _ in range(subscribers)]
+        publisher = Process(target=publish_pipe, args=([child for _, child in pipes], count, interval))
+        publisher.start()
+        for _, child in pipes:
+            child.close()
+        threads = [threading.Thread(target=receive_pipe, args=(parent, latencies)) for parent, _ in pipes]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'results.sock')
+        publisher = Process(target=publish_socket, args=(path, subscribers, count, interval))
+        publisher.start()
+        threads = [threading.Thread(target=receive_socket, args=(ResultSubscriber(path), latencies))
+                   for _ in range(subscribers)]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    publisher.join()
+
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish to receive latency of result transports.')
+    parser.add_argument('--count', type=int, default=1000, help='messages to publish')
+    parser.add_argument('--interval', type=float, default=0.001, help='seconds between messages')
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    print('Message size: pickle {} bytes, binary {} bytes'.format(
+        len(pickle.dumps((time.time(), ALTERNATIVES), pickle.HIGHEST_PROTOCOL)),
+        len(ResultMessage(ResultMessage.RESULT, ALTERNATIVES).encode()) + 4))
+    print('{:<8}{:>13}{:>12}{:>12}{:>12}{:>12}'.format(
+        'type', 'subscribers', 'received', 'mean, us', 'p50, us', 'p99, us'))
+    for subscribers in args.subscribers:
+        for transport in ['pipe', 'socket']:
+            latencies = run(transport, subscribers, args.count, args.interval)
+            print('{:<8}{:>13}{:>12}{:>12.1f}{:>12.1f}{:>12.1f}'.format(
+                transport, subscribers, len(latencies), sum(latencies) / len(latencies) * 1e6,
+                latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6))
+
+
+if __name__ == '__main__':
+    main()
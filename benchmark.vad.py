@@ -0,0 +1,55 @@
+#!/usr/bin/python
+
+import argparse
+import timeit
+
+import numpy
+
+import SimpleVAD
+import WaveletVAD
+
+
+def make_chunk(frames_per_buffer, seed=0):
+    """
+    Generates a chunk of 16-bit noise similar to a quiet microphone input.
+    :param frames_per_buffer: number of samples in a chunk
+    :param seed: random seed to make runs comparable
+    :return: numpy array of int16
+    """
+    rng = numpy.random.RandomState(seed)
+    return rng.randint(-3000, 3000, frames_per_buffer).astype(numpy.int16)
+
+
+def measure(vad, chunk, repeat):
+    """
+    Measures the best time of a single estimate() call in seconds.
+    """
+    timer = timeit.Timer(lambda: vad.estimate(chunk))
+    return min(timer.repeat(repeat=repeat, number=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-chunk VAD cost against real-time budget.')
+    parser.add_argument('--rate', type=int, default=16000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--chunks', type=int, nargs='+', default=[1024, 2048, 4096, 8192])
+    args = parser.parse_args()
+
+    vads = [
+        ('default', SimpleVAD.SimpleVAD()),
+        ('wavelet', WaveletVAD.WaveletVAD()),
+    ]
+
+    print('{:<10}{:>8}{:>14}{:>14}{:>10}'.format('vad', 'chunk', 'cost, ms', 'budget, ms', 'load, %'))
+    for frames_per_buffer in args.chunks:
+        chunk = make_chunk(frames_per_buffer)
+        # Real-time budget is the duration of one chunk.
+        budget = float(frames_per_buffer) / args.rate
+        for name, vad in vads:
+            cost = measure(vad, chunk, args.repeat)
+            print('{:<10}{:>8}{:>14.3f}{:>14.3f}{:>10.2f}'.format(
+                name, frames_per_buffer, cost * 1000, budget * 1000, cost / budget * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,25 @@
 #!/usr/bin/python
 
 from CommandRecognition import CommandRecognition
+from ResultTransport import ResultMessage
+
 
 class CommandHandler:
-    def __init__(self, transport):
-        self.transport = transport
+    def __init__(self, subscriber):
+        self.subscriber = subscriber
         self.n = 0
 
     def dummy_loop(self):
         while self.n < 3:
             print('Waiting for command')
-            alternatives = self.transport.recv()
-            self.print_alternatives(alternatives)
+            try:
+                message = self.subscriber.receive(timeout=1.0)
+            except EOFError:
+                break
+            # Nothing came in time, the loop may do other work meanwhile.
+            if message is None or message.kind != ResultMessage.RESULT:
+                continue
+            self.print_alternatives(message.alternatives)
             self.n += 1
 
         print('Stopped dummy loop')
@@ -19,26 +27,28 @@ class CommandHandler:
     def print_alternatives(self, alternatives):
         print("Handler alternatives: ")
         for alternative in alternatives:
-            print(alternative['transcript'].decode('utf-8'), u': ', str(alternative['confidence']).decode('utf-8'))
+            print(alternative['transcript'], ': ', alternative['confidence'])
 
 
 def main():
 
     # Init recognition service.
     recognition = CommandRecognition()
-    handler_transport = recognition.get_external_transport()
     recognition.set_config_yaml('./recognition.config.yml')
-
-    # Received commands handler.
-    handler = CommandHandler(handler_transport)
+    # Results are published to a socket instead of the pipe, several subscribers may connect.
+    recognition.config['transport'] = {'type': 'socket', 'path': '/tmp/recognition.sock'}
 
     # Start recognizing.
     recognition.start()
 
+    # Received commands handler.
+    handler = CommandHandler(recognition.subscribe())
+
     # Listen for transport to receive commands or transcription.
     handler.dummy_loop()
 
     # Shutdown recognition service.
+    handler.subscriber.close()
     recognition.stop_process()
 
 
@@ -1,6 +1,6 @@
 import sys
 from CommandRecognition import CommandRecognition
-from threading import Thread
+from ResultTransport import ResultMessage
 if sys.version_info > (3, 0):
     from PyQt5 import QtCore
 else:
@@ -24,40 +24,49 @@ class CommandHandler(QtCore.QObject):
             QtCore.QCoreApplication.instance().quit()
 
 
-class CommandReceiver(QtCore.QObject, Thread):
+class CommandReceiver(QtCore.QObject):
+    """
+    Emits results of socket transport from Qt event loop, no thread needed.
+    """
     received_signal = QtCore.pyqtSignal('PyQt_PyObject')
 
-    def __init__(self, transport):
+    def __init__(self, subscriber):
         QtCore.QObject.__init__(self)
-        Thread.__init__(self)
-        self.transport = transport
+        self.subscriber = subscriber
+        self.notifier = None
 
     def _emit(self, alternatives):
         self.received_signal.emit(alternatives)
 
-    def run(self):
-        while True:
-            try:
-                alternatives = self.transport.recv()
-            except EOFError:
-                # TODO: Shutdown gracefully.
-                break
-            else:
-                print("Emitter received")
-                self._emit(alternatives)
+    def start(self):
+        self.notifier = QtCore.QSocketNotifier(self.subscriber.fileno(), QtCore.QSocketNotifier.Read)
+        self.notifier.activated.connect(self.receive)
+
+    def receive(self):
+        try:
+            message = self.subscriber.receive_nowait()
+            while message is not None:
+                if message.kind == ResultMessage.RESULT:
+                    print("Emitter received")
+                    self._emit(message.alternatives)
+                message = self.subscriber.receive_nowait()
+        except EOFError:
+            self.notifier.setEnabled(False)
 
 
 def main():
     # Init recognition service.
     recognition = CommandRecognition()
-    handler_transport = recognition.get_external_transport()
     recognition.set_config_yaml('./recognition.config.yml')
-    # Received commands handler.
-    receiver = CommandReceiver(handler_transport)
+    # Results are sent to a socket instead of the pipe.
+    recognition.config['transport'] = {'type': 'socket', 'path': '/tmp/recognition.sock'}
 
     # Start recognizing.
     recognition.start()
 
+    # Received commands handler.
+    receiver = CommandReceiver(recognition.subscribe())
+
     app = QtCore.QCoreApplication(sys.argv)
     # Received commands handler. Saving a variable is required for Qt to work.
     handler = CommandHandler(receiver)
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+
+import sys
+import time
+import wave
+
+from CommandRecognition import CommandRecognition
+
+
+def print_alternatives(alternatives):
+    print("Handler alternatives: ")
+    for alternative in alternatives:
+        print(alternative['transcript'], ': ', alternative['confidence'])
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: {} <file.wav>'.format(sys.argv[0]))
+        sys.exit(1)
+    filename = sys.argv[1]
+
+    wav = wave.open(filename, 'rb')
+    duration = float(wav.getnframes()) / wav.getframerate()
+    wav.close()
+
+    # Init recognition service replaying a WAV file instead of microphone.
+    recognition = CommandRecognition()
+    handler_transport = recognition.get_external_transport()
+    recognition.set_config_yaml('./recognition.config.yml')
+    recognition.config['audio_source'] = {'type': 'wav', 'path': filename}
+
+    start_time = time.time()
+    recognition.start()
+
+    # The process stops by itself at the end of the file.
+    while recognition.is_alive() or handler_transport.poll():
+        if handler_transport.poll(0.1):
+            print_alternatives(handler_transport.recv())
+    recognition.join()
+
+    elapsed = time.time() - start_time
+    print('Replayed {:.1f}s of audio in {:.1f}s, real-time factor {:.3f}'.format(
+        duration, elapsed, elapsed / duration))
+
+
+if __name__ == '__main__':
+    main()
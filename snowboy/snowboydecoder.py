@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
-import collections
 import logging
 import os
+import threading
 import time
 import wave
 
@@ -21,20 +21,79 @@ DETECT_DONG = os.path.join(TOP_DIR, "resources/dong.wav")
 
 
 class RingBuffer(object):
-    """Ring buffer to hold audio from PortAudio"""
+    """Ring buffer to hold audio from PortAudio.
+
+    Keeps the last `size` bytes in a preallocated bytearray, the oldest data
+    is overwritten when it's full. Writes come from the PortAudio thread,
+    a reader blocks in wait() until they come.
+    """
 
     def __init__(self, size=4096):
-        self._buf = collections.deque(maxlen=size)
+        self._size = size
+        self._buf = bytearray(size)
+        self._out = bytearray(size)
+        self._start = 0
+        self._len = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._woken = False
+
+    def __len__(self):
+        return self._len
 
     def extend(self, data):
         """Adds data to the end of buffer"""
-        self._buf.extend(data)
+        data = memoryview(data)
+        if len(data) > self._size:
+            data = data[-self._size:]
+        n = len(data)
+        with self._cond:
+            end = (self._start + self._len) % self._size
+            first = min(n, self._size - end)
+            self._buf[end:end + first] = data[:first]
+            self._buf[:n - first] = data[first:]
+            self._len += n
+            if self._len > self._size:
+                self._start = (self._start + self._len - self._size) % self._size
+                self._len = self._size
+            self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Blocks until the buffer has data, `timeout` seconds pass or
+        wakeup() is called. Returns True if the buffer has data."""
+        with self._cond:
+            if self._len == 0 and not self._woken:
+                self._cond.wait(timeout)
+            self._woken = False
+            return self._len > 0
+
+    def wakeup(self):
+        """Releases a reader blocked in wait()."""
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def _read(self, out):
+        """Copies buffered data to `out`, clears the buffer and returns
+        data length."""
+        with self._cond:
+            n = self._len
+            first = min(n, self._size - self._start)
+            out[:first] = self._buf[self._start:self._start + first]
+            out[first:n] = self._buf[:n - first]
+            self._start = 0
+            self._len = 0
+        return n
 
     def get(self):
         """Retrieves data from the beginning of buffer and clears it"""
-        tmp = bytes(bytearray(self._buf))
-        self._buf.clear()
-        return tmp
+        n = self._read(self._out)
+        return bytes(self._out[:n])
+
+    def get_view(self):
+        """Same as get(), but returns a memoryview of an internal buffer,
+        which is valid until the next get_view() call."""
+        n = self._read(self._out)
+        return memoryview(self._out)[:n]
 
 
 def play_audio_file(fname=DETECT_DING):
@@ -71,17 +130,23 @@ class HotwordDetector(object):
                               decoder. If an empty list is provided, then the
                               default sensitivity in the model will be used.
     :param audio_gain: multiply input volume by this factor.
+    :param audio_source: source with `open(position)` returning a stream to
+                         detect in instead of own microphone stream, e.g.
+                         a capture shared with the recorder. Replay sources
+                         are read as fast as detection runs, until they
+                         return no data.
     """
 
     def __init__(self, decoder_model,
                  resource=RESOURCE_FILE,
                  sensitivity=[],
-                 audio_gain=1):
+                 audio_gain=1,
+                 audio_source=None):
 
         def audio_callback(in_data, frame_count, time_info, status):
             self.ring_buffer.extend(in_data)
-            play_data = chr(0) * len(in_data)
-            return play_data, pyaudio.paContinue
+            # Input-only stream has no data to play.
+            return None, pyaudio.paContinue
 
         tm = type(decoder_model)
         ts = type(sensitivity)
@@ -108,6 +173,17 @@ class HotwordDetector(object):
 
         self.ring_buffer = RingBuffer(
             self.detector.NumChannels() * self.detector.SampleRate() * 5)
+        self.audio_source = audio_source
+        # Position in audio_source right after the last detected hotword.
+        self.detected_position = None
+        self.audio = None
+        self.stream_in = None
+        if audio_source is not None:
+            assert audio_source.rate == self.detector.SampleRate() \
+                and audio_source.channels == self.detector.NumChannels(), \
+                "audio source format does not match the detector"
+            return
+
         self.audio = pyaudio.PyAudio()
         self.stream_in = self.audio.open(
             input=True, output=False,
@@ -120,21 +196,31 @@ class HotwordDetector(object):
 
     def start(self, detected_callback=play_audio_file,
               interrupt_check=lambda: False,
-              sleep_time=0.03):
+              sleep_time=0.03,
+              audio_callback=None,
+              skip_after_callback=True):
         """
-        Start the voice detector. For every `sleep_time` second it checks the
-        audio buffer for triggering keywords. If detected, then call
+        Start the voice detector. It blocks until the audio callback brings
+        new data and checks it for triggering keywords. If detected, then call
         corresponding function in `detected_callback`, which can be a single
         function (single model) or a list of callback functions (multiple
         models). Every loop it also calls `interrupt_check` -- if it returns
-        True, then breaks from the loop and return.
+        True, then breaks from the loop and return. interrupt() wakes the
+        loop at once, otherwise `interrupt_check` is called at least every
+        `sleep_time` seconds or audio callback period, whichever is less.
 
         :param detected_callback: a function or list of functions. The number of
                                   items must match the number of models in
                                   `decoder_model`.
         :param interrupt_check: a function that returns True if the main loop
                                 needs to stop.
-        :param float sleep_time: how much time in second every loop waits.
+        :param float sleep_time: max time in second every loop waits for audio.
+        :param audio_callback: a function called with every block of audio
+                               data without a keyword.
+        :param skip_after_callback: continue from the audio after the
+                                    callback, False to go on detecting
+                                    where it stopped, e.g. when the callback
+                                    only queues the command.
         :return: None
         """
         if interrupt_check():
@@ -153,34 +239,66 @@ class HotwordDetector(object):
 
         logger.debug("detecting...")
 
+        source_stream = None
+        if self.audio_source is not None:
+            source_stream = self.audio_source.open()
+            frames = self.audio_source.frames_per_buffer
+
         while True:
             if interrupt_check():
                 logger.debug("detect voice break")
                 break
-            data = self.ring_buffer.get()
-            if len(data) == 0:
-                time.sleep(sleep_time)
-                continue
+            if source_stream is not None:
+                if hasattr(source_stream, 'wait') and not source_stream.wait(frames, sleep_time):
+                    continue
+                data = source_stream.read(frames)
+                if len(data) == 0:
+                    logger.debug("audio source ended")
+                    break
+            else:
+                if not self.ring_buffer.wait(sleep_time):
+                    continue
+                data = self.ring_buffer.get()
 
             ans = self.detector.RunDetection(data)
             if ans == -1:
                 logger.warning("Error initializing streams or reading audio data")
+            elif ans in (0, -2) and audio_callback is not None:
+                # No keyword, -2 means silence in newer Snowboy versions.
+                audio_callback(data)
             elif ans > 0:
                 message = "Keyword " + str(ans) + " detected at time: "
                 message += time.strftime("%Y-%m-%d %H:%M:%S",
                                          time.localtime(time.time()))
                 logger.info(message)
                 callback = detected_callback[ans - 1]
+                if source_stream is not None and hasattr(source_stream, 'tell'):
+                    self.detected_position = source_stream.tell()
                 if callback is not None:
                     callback()
+                if source_stream is not None and skip_after_callback:
+                    # Continue from the audio after the callback, live
+                    # sources skip what was captured while it ran.
+                    source_stream.close()
+                    source_stream = self.audio_source.open()
 
         logger.debug("finished.")
 
+    def interrupt(self):
+        """
+        Wakes the detection loop to check `interrupt_check` at once.
+        Works only from the process running start().
+        :return: None
+        """
+        self.ring_buffer.wakeup()
+
     def terminate(self):
         """
         Terminate audio stream. Users cannot call start() again to detect.
         :return: None
         """
+        if self.stream_in is None:
+            return
         self.stream_in.stop_stream()
         self.stream_in.close()
         self.audio.terminate()
@@ -0,0 +1,73 @@
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from SpeechSegmenter import SpeechSegmenter
+
+
+def push_all(segmenter, estimates, chunks=None):
+    """
+    :return: events of every pushed estimate
+    """
+    chunks = chunks or [None] * len(estimates)
+    return [segmenter.push(estimate, data) for estimate, data in zip(estimates, chunks)]
+
+
+class SpeechSegmenterTest(unittest.TestCase):
+
+    def test_phrase_events(self):
+        segmenter = SpeechSegmenter(threshold=1, window_len=2, prev_len=0, silence_stop_len=10,
+                                    recording_stop_len=20)
+        events = push_all(segmenter, [0, 0, 5, 5, 0, 0, 0])
+        # Speech goes on while the window has a pass, the phrase ends on a chunk after it.
+        self.assertEqual(events, [SpeechSegmenter.SILENCE, SpeechSegmenter.SILENCE, SpeechSegmenter.START,
+                                  SpeechSegmenter.SPEECH, SpeechSegmenter.SPEECH, SpeechSegmenter.END,
+                                  SpeechSegmenter.SILENCE])
+        self.assertFalse(segmenter.started)
+
+    def test_stop_on_long_silence(self):
+        segmenter = SpeechSegmenter(threshold=1, window_len=2, prev_len=0, silence_stop_len=3,
+                                    recording_stop_len=20)
+        events = push_all(segmenter, [0] * 4)
+        self.assertEqual(events, [SpeechSegmenter.SILENCE] * 3 + [SpeechSegmenter.STOP])
+
+    def test_recording_limit(self):
+        segmenter = SpeechSegmenter(threshold=1, window_len=1, prev_len=0, silence_stop_len=10,
+                                    recording_stop_len=3)
+        events = push_all(segmenter, [5] * 4)
+        # The phrase is cut on the chunk over the limit.
+        self.assertEqual(events, [SpeechSegmenter.START, SpeechSegmenter.SPEECH, SpeechSegmenter.SPEECH,
+                                  SpeechSegmenter.END])
+        self.assertTrue(segmenter.recording_limit_passed)
+
+    def test_prev_chunks_prepended(self):
+        segmenter = SpeechSegmenter(threshold=1, window_len=1, prev_len=2, silence_stop_len=10,
+                                    recording_stop_len=20)
+        chunks = [bytes(bytearray([i] * 4)) for i in range(7)]
+        events = push_all(segmenter, [0, 0, 0, 5, 5, 0, 0], chunks)
+        self.assertEqual(events[5], SpeechSegmenter.END)
+        # Two chunks before the start, then the phrase, the ending chunk is dropped.
+        self.assertEqual(segmenter.get_phrase(), b''.join(chunks[1:5]))
+        self.assertEqual(bytes(segmenter.get_prev_audio()), b''.join(chunks[1:3]))
+
+    def test_numpy_estimates(self):
+        segmenter = SpeechSegmenter(threshold=1, window_len=2, prev_len=0, silence_stop_len=10,
+                                    recording_stop_len=20)
+        events = push_all(segmenter, numpy.array([0, 5, 0, 0], dtype=numpy.float32))
+        self.assertEqual(events, [SpeechSegmenter.SILENCE, SpeechSegmenter.START, SpeechSegmenter.SPEECH,
+                                  SpeechSegmenter.END])
+
+    def test_reset(self):
+        segmenter = SpeechSegmenter(threshold=1, window_len=2, prev_len=0, silence_stop_len=10,
+                                    recording_stop_len=20)
+        push_all(segmenter, [5, 5])
+        segmenter.reset(threshold=10)
+        self.assertEqual(push_all(segmenter, [5]), [SpeechSegmenter.SILENCE])
+
+
+if __name__ == '__main__':
+    unittest.main()